@@ -0,0 +1,24 @@
+from contextlib import contextmanager, suppress
+from typing import IO, Any, Iterator
+import os
+import threading
+
+
+@contextmanager
+def atomic_write(filename: str, mode: str = 'wb', **kwargs: Any) -> Iterator[IO[Any]]:
+    """
+    Opens a file to write that replaces filename when the block ends. It is written with another name first,
+    so a half written file is never read, even if the program is killed while it writes. The name has the pid
+    and the thread, because the workers of the service and the background threads can write the same file
+    at once. If the block fails, filename is not changed
+    """
+
+    part = f'{filename}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        with open(part, mode, **kwargs) as file:
+            yield file
+    except BaseException:
+        with suppress(OSError):
+            os.remove(part)
+        raise
+    os.replace(part, filename)
@@ -0,0 +1,275 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Callable
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from tabulate import tabulate
+import billboard
+import buses
+import city
+import render
+from fixtures import FixtureServer, street_grid, write_amb_payload, write_billboard
+
+
+SIZES = [25, 50, 100]  # the sides of the street grids; 100 is about the size of Barcelona
+STAGES = ['read', 'buses', 'city', 'find_path', 'plot']
+REPEAT = 3  # the time of a stage is the best of these runs, after one run to warm up
+QUERIES = 100  # the paths searched in the stage find_path
+TOLERANCE = 0.25  # a stage is a regression when it is this much slower than the baseline
+BASELINE = 'benchmark.json'
+STARTUP_BUDGET = 0.5  # s, the time a new python process can take to import demo and show the menu
+HEAVY_MODULES = ['osmnx', 'networkx', 'numpy', 'scipy', 'matplotlib.pyplot', 'staticmap', 'bs4', 'lxml.etree',
+                 'PIL.Image', 'requests']  # the modules that must not be loaded before the menu
+
+
+@dataclass
+class Result:
+    """
+    Class that stores the measures of one stage with the fixtures of one size
+    """
+
+    stage: str
+    size: int
+    seconds: float  # the best wall time of the runs
+    peak_mb: float  # the peak of the memory traced by tracemalloc during one run
+
+
+@dataclass
+class Fixtures:
+    """
+    Class that stores the inputs of each stage for one size, generated in a working directory
+    """
+
+    size: int
+    directory: str
+    server: FixtureServer
+    pages: int
+    amb_file: str
+    g1: Any = None
+    g2: Any = None
+    G: Any = None
+    pairs: list[tuple[tuple[float, float], tuple[float, float]]] | None = None
+
+
+def make_fixtures(size: int, directory: str) -> Fixtures:
+    """
+    Writes the billboard pages and the AMB payload for a city of size x size crossroads, and serves the pages.
+    The number of cinemas, films and lines grows with the size. They are generated by fixtures.py, not saved
+    from Sensacine and AMB: they have the markup and the fields that the program reads, but not the rest of
+    the real pages and payloads, so the stages read and buses parse less than they would with the real ones
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    pages = 3
+    gazetteer = write_billboard(directory, cinemas=max(pages, size // 2), films=max(8, size), pages=pages, size=size)
+    billboard.set_resolver(billboard.gazetteer_resolver(gazetteer))
+
+    amb_file = os.path.join(directory, 'amb.json')
+    write_amb_payload(amb_file, lines=max(1, size), stops=30, size=size)
+
+    fixtures = Fixtures(size, directory, FixtureServer(directory).start(), pages, amb_file)
+    fixtures.g1 = street_grid(size)
+    rng = random.Random(size)
+    nodes = [fixtures.g1.nodes[n] for n in fixtures.g1.nodes]
+    fixtures.pairs = [tuple((p['y'], p['x']) for p in rng.sample(nodes, 2)) for _ in range(QUERIES)]
+    return fixtures
+
+
+def stage_function(stage: str, f: Fixtures) -> Callable[[], Any]:
+    """
+    Returns the function that runs the stage with the fixtures. The stages after buses use the graphs built before
+    """
+
+    if stage == 'read':
+        return lambda: billboard.read(base_url=f.server.url, pages=f.pages)
+    if stage == 'buses':
+        return lambda: buses.build_buses_graph(f.amb_file)
+    if stage == 'city':
+        return lambda: city.build_city_graph(f.g1, f.g2)
+    if stage == 'find_path':
+        return lambda: [city.find_path(f.g1, f.G, src, dst) for src, dst in f.pairs]
+    if stage == 'plot':
+        return lambda: city.plot(f.G, os.path.join(f.directory, 'city.png'))
+    raise ValueError(f'Unknown stage {stage}')
+
+
+def measure(stage: str, size: int, function: Callable[[], Any], repeat: int = REPEAT) -> tuple[Result, Any]:
+    """
+    Runs the function once to warm up, then repeat times to take the best wall time, and once
+    more with tracemalloc to take the peak memory. Returns the result and the value of the function
+    """
+
+    value = function()
+    seconds = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Result(stage, size, seconds, peak / 2 ** 20), value
+
+
+def run(sizes: list[int] = SIZES, stages: list[str] = STAGES, repeat: int = REPEAT) -> list[Result]:
+    """
+    Runs the stages with the fixtures of each size in a temporary directory, that is also where the
+    caches are written, so nothing is read from the caches of the working directory. The tiles are
+    never downloaded, so the stage plot only measures the painting. The geocoder and its cache are
+    restored at the end, because the fixtures replace them
+    """
+
+    results: list[Result] = []
+    cwd = os.getcwd()
+    was_offline = render.offline
+    was_resolver, was_cache = billboard.resolver, billboard.geocode_cache
+    # the cache of coordinates is loaded again from the temporary directory, so the fixtures are not added to it
+    billboard.geocode_cache = None
+    render.set_offline(True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for size in sizes:
+                f = make_fixtures(size, os.path.join(workdir, str(size)))
+                try:
+                    # the graphs are built even when their stages are not measured, because later stages need them
+                    f.g2 = buses.build_buses_graph(f.amb_file)
+                    f.G = city.build_city_graph(f.g1, f.g2)
+                    for stage in stages:
+                        result, _ = measure(stage, size, stage_function(stage, f), repeat)
+                        results.append(result)
+                        print(f'{stage:>10} {size:>5} {result.seconds:10.4f} s {result.peak_mb:10.1f} MB', file=sys.stderr)
+                finally:
+                    f.server.stop()
+        finally:
+            os.chdir(cwd)
+            render.set_offline(was_offline)
+            billboard.set_resolver(was_resolver)
+            billboard.geocode_cache = was_cache
+
+    return results
+
+
+def startup(repeat: int = REPEAT) -> tuple[Result, list[str]]:
+    """
+    Measures the best wall time of a new python process that imports demo, from its start to its end,
+    and returns it with the heavy modules that were loaded by the import
+    """
+
+    code = ('import json, lazy, demo; '
+            f'print(json.dumps([m for m in {HEAVY_MODULES!r} if lazy.is_loaded(m)]))')
+    directory = os.path.dirname(os.path.abspath(__file__))
+    seconds, loaded = math.inf, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', code], cwd=directory, capture_output=True, text=True, check=True)
+        seconds = min(seconds, time.perf_counter() - start)
+        loaded = json.loads(out.stdout.splitlines()[-1])
+    return Result('startup', 0, seconds, 0.0), loaded
+
+
+def save_results(results: list[Result], filename: str) -> None:
+    with open(filename, 'w') as file:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                   'results': [asdict(r) for r in results]}, file, indent=1)
+
+
+def load_results(filename: str) -> list[Result]:
+    with open(filename) as file:
+        return [Result(**r) for r in json.load(file)['results']]
+
+
+def scaling_table(results: list[Result]) -> list[list[Any]]:
+    """
+    Returns the rows of the scaling curve of each stage: its time with each size and the exponent k of
+    time ~ nodes^k between each size and the previous one, where the grid has size^2 nodes
+    """
+
+    rows: list[list[Any]] = []
+    previous: dict[str, Result] = dict()
+    for r in sorted(results, key=lambda r: (STAGES.index(r.stage) if r.stage in STAGES else len(STAGES), r.size)):
+        exponent = None
+        last = previous.get(r.stage)
+        if last is not None and last.seconds > 0 and r.seconds > 0 and r.size != last.size:
+            exponent = math.log(r.seconds / last.seconds) / math.log((r.size / last.size) ** 2)
+        rows.append([r.stage, r.size, r.size ** 2, f'{r.seconds:.4f}', f'{r.peak_mb:.1f}',
+                     '' if exponent is None else f'{exponent:.2f}'])
+        previous[r.stage] = r
+    return rows
+
+
+def compare(results: list[Result], baseline: list[Result], tolerance: float = TOLERANCE) -> tuple[list[list[Any]], int]:
+    """
+    Returns the rows of the diff between the results and the baseline, and the number of regressions:
+    the stages that are slower, or use more memory, than the baseline by more than the tolerance
+    """
+
+    before = {(r.stage, r.size): r for r in baseline}
+    rows: list[list[Any]] = []
+    regressions = 0
+    for r in results:
+        old = before.get((r.stage, r.size))
+        if old is None:
+            rows.append([r.stage, r.size, '', f'{r.seconds:.4f}', '', '', f'{r.peak_mb:.1f}', 'new'])
+            continue
+        time_ratio = r.seconds / old.seconds if old.seconds > 0 else math.inf
+        memory_ratio = r.peak_mb / old.peak_mb if old.peak_mb > 0 else 1.0
+        worse = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        better = time_ratio < 1 - tolerance
+        regressions += worse
+        rows.append([r.stage, r.size, f'{old.seconds:.4f}', f'{r.seconds:.4f}', f'{time_ratio:.2f}x',
+                     f'{old.peak_mb:.1f}', f'{r.peak_mb:.1f}', 'REGRESSION' if worse else 'faster' if better else ''])
+    return rows, regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Runs the benchmarks of the stages offline, with generated fixtures')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='sides of the street grids')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--save', metavar='FILE', help='saves the results as the new baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compares the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--startup', action='store_true', help='only checks the import time of demo against its budget')
+    args = parser.parse_args()
+
+    regressions = 0
+    if args.startup:
+        result, loaded = startup(args.repeat)
+        results = [result]
+        print(f'import demo: {result.seconds:.3f} s (budget {STARTUP_BUDGET} s)')
+        if loaded:
+            print('heavy modules loaded before the menu:', ', '.join(loaded))
+        regressions += result.seconds > STARTUP_BUDGET or bool(loaded)
+    else:
+        results = run(args.sizes, args.stages, args.repeat)
+        print(tabulate(scaling_table(results), headers=['stage', 'size', 'nodes', 'seconds', 'peak MB', 'exponent']))
+
+    if args.baseline:
+        rows, slower = compare(results, load_results(args.baseline), args.tolerance)
+        print()
+        print(tabulate(rows, headers=['stage', 'size', 'baseline s', 'seconds', 'ratio',
+                                      'baseline MB', 'peak MB', '']))
+        regressions += slower
+    if args.save:
+        save_results(results, args.save)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,57 @@
-from dataclasses import dataclass
+from __future__ import annotations
+from dataclasses import dataclass, field
 import requests
-from bs4 import BeautifulSoup
 import json
-from typing import Tuple, Iterator
-import osmnx as ox
-
-
-@dataclass
+from typing import Tuple, Iterator, Iterable, Callable, TypeAlias
+from os.path import exists
+import threading
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from atomic import atomic_write
+from web import make_session
+from lazy import lazy_import
+
+# Only the parser or the geocoder that is used is loaded, the first time it is needed
+bs4 = lazy_import('bs4')
+etree = lazy_import('lxml.etree')
+ox = lazy_import('osmnx')
+
+Resolver: TypeAlias = Callable[[str], Tuple[float, float]]
+
+GEOCODE_CACHE = 'geocode_cache.json'
+BILLBOARD_URL = 'https://www.sensacine.com/cines/cines-en-72480/'
+BILLBOARD_PAGES = 3
+PARSER = 'stream'  # the parser of the pages: 'stream' or 'soup', both give the same billboard
+LANGUAGES: tuple[str, ...] = ('Spanish', 'Original Version')  # the first codes of the languages of every table
+
+# Takes control of the misspellings of Sensacine's web in order to avoid problems with geocode.
+# The replacements are done in this order.
+ADDRESS_FIXES: list[Tuple[str, str]] = [
+    ('Calle', 'Carrer'),
+    ('Avenida', 'Avinguda'),
+    ('Avda.', 'Avinguda'),
+    ('Paseig', 'Passeig'),
+    ('Centro Comercial Splau! -', ''),
+    ('- Centro Comercial Gran Vía 2', ''),
+    ('Paseo', 'Passeig'),
+    ('Sta Fé', 'Carrer de Santa Fe'),
+    ('- Centro Comercial La Maquinista', ''),
+    ('Andreu', 'D\'Andreu'),
+    ('s/n - Pintor Alzamora', ''),
+    ('Avinguda Josep Tarradellas', 'Avinguda de Josep Tarradellas i Joan'),
+    ('Avinguda Virgen Montserrat', 'Avinguda Verge de Montserrat'),
+    ('Centro Comercial Baricentro - Carretera Nacional 150', 'N-150'),
+    ('Carrer Salvador Espriu', 'Carrer de Salvador Espriu'),
+    ('Carrer Verdi', 'C/ de Verdi'),
+    ('Carrer Aribau', "Aribau - Gran Via"),
+]
+
+
+@dataclass(slots=True)
 class Film:
     """
     Class that stores the information of each film
@@ -21,7 +66,7 @@ class Film:
         return hash(self.id)
 
 
-@dataclass
+@dataclass(slots=True)
 class Cinema:
     """
     Class that stores the information of each cinema
@@ -31,7 +76,7 @@ class Cinema:
     coordinates: tuple[float, float]
 
 
-@dataclass
+@dataclass(slots=True)
 class Projection:
     """
     Class that storess the information of each session
@@ -43,6 +88,118 @@ class Projection:
     language: str  # The language of the film
 
 
+class ProjectionTable:
+    """
+    Class that stores the projections by columns: for each projection, the position of its film and its cinema,
+    its start as minutes after midnight and the code of its language. It is where the billboard and its pages
+    keep their projections, and the Projection objects are only built, as views, when they are read
+    """
+
+    __slots__ = ('films', 'cinemas', 'languages', 'film', 'cinema', 'start', 'language', 'positions')
+
+    def __init__(self) -> None:
+        self.films: list[Film] = []  # The films referenced by the column film, each one once
+        self.cinemas: list[Cinema] = []  # The cinemas referenced by the column cinema, each one once
+        self.languages: list[str] = list(LANGUAGES)  # The language of each code of the column language
+        self.film = array('H')
+        self.cinema = array('H')
+        self.start = array('H')
+        self.language = array('B')
+        # The position of each film, cinema and language in its list
+        self.positions: dict[tuple, int] = {('language', (language,)): i for i, language in enumerate(LANGUAGES)}
+
+    @classmethod
+    def from_projections(cls, projections: Iterable[Projection]) -> 'ProjectionTable':
+        """
+        Builds the table of some projections
+        """
+
+        table = cls()
+        table.extend(projections)
+        return table
+
+    def position(self, kind: str, key: tuple, values: list, value) -> int:
+        """
+        Returns the position of value in values, adding it the first time
+        """
+
+        i = self.positions.get((kind, key))
+        if i is None:
+            i = self.positions[kind, key] = len(values)
+            values.append(value)
+        return i
+
+    def append(self, film: Film, cinema: Cinema, time: Tuple[int, int], language: str) -> None:
+        self.film.append(self.position('film', film_key(film), self.films, film))
+        self.cinema.append(self.position('cinema', cinema_key(cinema), self.cinemas, cinema))
+        self.start.append(time[0] * 60 + time[1])
+        self.language.append(self.position('language', (language,), self.languages, sys.intern(language)))
+
+    def extend(self, projections: Iterable[Projection]) -> None:
+        for p in projections:
+            self.append(p.film, p.cinema, p.time, p.language)
+
+    def minutes(self, i: int) -> int:
+        """
+        Returns the start of the i-th projection in minutes after midnight, without building its view
+        """
+
+        return self.start[i]
+
+    def __len__(self) -> int:
+        return len(self.film)
+
+    def __getitem__(self, i: int | slice) -> Projection | list[Projection]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start = self.start[i]
+        return Projection(self.films[self.film[i]], self.cinemas[self.cinema[i]],
+                          (start // 60, start % 60), self.languages[self.language[i]])
+
+    def __iter__(self) -> Iterator[Projection]:
+        return (self[i] for i in range(len(self)))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ProjectionTable):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None  # type: ignore[assignment]
+
+
+@dataclass
+class Page:
+    """
+    Class that stores what has been read from each page of the billboard
+    """
+
+    link: str  # The url of the page
+    films: list[Film]  # The films that appear in the page, without repetitions
+    cinemas: list[Cinema]
+    projections: ProjectionTable
+    etag: str | None = None  # The validators of the download, for the conditional requests
+    last_modified: str | None = None
+
+
+@dataclass
+class Changes:
+    """
+    Class that stores the differences applied to a billboard by a refresh
+    """
+
+    pages: list[str] = field(default_factory=list)  # The links of the pages that have changed
+    added_films: list[Film] = field(default_factory=list)
+    removed_films: list[Film] = field(default_factory=list)
+    added_cinemas: list[Cinema] = field(default_factory=list)
+    removed_cinemas: list[Cinema] = field(default_factory=list)
+    added_projections: list[Projection] = field(default_factory=list)
+    removed_projections: list[Projection] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return any([self.added_films, self.removed_films, self.added_cinemas, self.removed_cinemas,
+                    self.added_projections, self.removed_projections])
+
+
 @dataclass
 class Billboard:
     """
@@ -52,75 +209,400 @@ class Billboard:
 
     films: list[Film]
     cinemas: list[Cinema]
-    projections: list[Projection]
+    projections: ProjectionTable  # a list of projections is also accepted, and stored as a table
+    pages: list[Page] = field(default_factory=list, repr=False)  # The pages it has been read from
+    _index: 'BillboardIndex | None' = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.projections, ProjectionTable):
+            self.projections = ProjectionTable.from_projections(self.projections)
+
+    @property
+    def index(self) -> 'BillboardIndex':
+        """
+        The indexes of the billboard. They are built the first time they are needed
+        """
+
+        if self._index is None:
+            self._index = index_billboard(self)
+        return self._index
 
     def filter_title(self, title: str) -> list[Projection]:
         """
-        Filters the films of the projection for a given title using lambda function
-        and filter iterator. Returns a list of Projections.
+        Filters the films of the projection for a given title using the index of titles.
+        Returns a list of Projections.
         """
 
-        return list(filter(lambda projec: title.lower() == projec.film.title.lower(), self.projections))
-        # lower() is used to avoid errors of capital letters on the user writting
+        return [self.projections[i] for i in self.index.by_title.get(normalize(title), [])]
+        # the keys are normalized to avoid errors of capital letters on the user writting
 
     def filter_genre(self, genre: str) -> Iterator[Film]:
         """
         Filters the films by genre. Returns an iterator with the film corresponding to the genre.
         """
 
-        for film in self.films:
-            if genre in film.genre:
-                yield film
+        return (self.films[i] for i in self.index.by_genre.get(normalize(genre), []))
 
     def filter_cinema(self, cine: str) -> list[Projection]:
         """
         Given a cinema, filters all the movies shown in that cinema. returns a list of Projections shown in the cinema.
         """
 
-        return list(filter(lambda projec: cine.lower() == projec.cinema.name.lower(), self.projections))
+        return [self.projections[i] for i in self.index.by_cinema.get(normalize(cine), [])]
 
     def filter_actors(self, actor: str) -> Iterator[Film]:
         """Filters the movies where the actor appears. 
         Returns an iterator with the list of films where the actor appears.
         """
 
-        for film in self.films:
-            if actor in film.actors:
-                yield film
+        return (self.films[i] for i in self.index.by_actor.get(normalize(actor), []))
+
+    def sessions(self, title: str | None = None, cinema: str | None = None,
+                 first: float = 0, last: float = 48 * 60) -> list[Projection]:
+        """
+        Returns the projections, of a film and/or in a cinema if they are given, that start from minute first
+        to minute last after midnight, sorted by their start
+        """
+
+        index = self.index
+        if title is not None and cinema is not None:
+            timeline = index.title_cinema_timelines.get((normalize(title), normalize(cinema)))
+        elif title is not None:
+            timeline = index.title_timelines.get(normalize(title))
+        elif cinema is not None:
+            timeline = index.cinema_timelines.get(normalize(cinema))
+        else:
+            timeline = index.timeline
+
+        if timeline is None:
+            return []
+        return [self.projections[i] for i in timeline.between(first, last)]
+
+    def starting_within(self, window: float, title: str | None = None, cinema: str | None = None,
+                        now: datetime | None = None) -> list[Projection]:
+        """
+        Returns the projections that start in the next window minutes
+        """
+
+        start = now_minutes(now)
+        return self.sessions(title, cinema, start, start + window)
+
+    def first_catchable(self, title: str, times_to_cinemas: dict[str, float],
+                        now: datetime | None = None) -> Projection | None:
+        """
+        Given the time in seconds to arrive to each cinema, returns the earliest projection of the
+        film that can be reached before it starts, or None if there is not any
+        """
+
+        best: int | None = None
+        start = now_minutes(now)
+
+        for cinema, seconds in times_to_cinemas.items():
+            timeline = self.index.title_cinema_timelines.get((normalize(title), normalize(cinema)))
+            if timeline is None or seconds == float('inf'):
+                continue
+            i = timeline.first_after(start + seconds / 60)
+            if i is not None and (best is None or self.projections.minutes(i) < self.projections.minutes(best)):
+                best = i
+
+        return None if best is None else self.projections[best]
+
+    def table(self) -> ProjectionTable:
+        """
+        Returns the projections of the billboard stored by columns, the table where they are kept
+        """
+
+        return self.projections
+
+    def search(self, title: str | None = None, cinema: str | None = None,
+               genre: str | None = None, actor: str | None = None) -> list[Projection]:
+        """
+        Returns the projections that satisfy all the given criteria, intersecting the sets of each index
+        """
+
+        index = self.index
+        selected: list[set[int]] = []
+
+        if title is not None:
+            selected.append(set(index.by_title.get(normalize(title), [])))
+        if cinema is not None:
+            selected.append(set(index.by_cinema.get(normalize(cinema), [])))
+        if genre is not None:
+            selected.append({i for film in self.filter_genre(genre)
+                             for i in index.by_film.get(film.id, [])})
+        if actor is not None:
+            selected.append({i for film in self.filter_actors(actor)
+                             for i in index.by_film.get(film.id, [])})
+
+        if not selected:
+            return list(self.projections)
+
+        return [self.projections[i] for i in sorted(set.intersection(*selected))]
+
+    @metrics.timed('billboard.refresh')
+    def refresh(self, parser: str = PARSER) -> Changes:
+        """
+        Downloads again the pages of the billboard with conditional requests, so only the pages that have
+        changed are parsed again. The differences are applied to the lists of the billboard in place, keeping
+        the objects that have not changed, and they are returned so the caches can be updated
+        """
+
+        changes = Changes()
+
+        with make_session() as session, ThreadPoolExecutor(max(1, len(self.pages))) as pool:
+            responses = [pool.submit(fetch_page, session, page.link, page)
+                         for page in self.pages]
+            for i, response in enumerate(responses):
+                r = response.result()
+                if r.status_code != 304:
+                    self.pages[i] = parse_page(self.pages[i].link, r, parser)
+                    changes.pages.append(self.pages[i].link)
+
+        if not changes.pages:
+            return changes
+
+        self._index = None  # the positions of the elements may have changed
+
+        films, cinemas, projections = merge_pages(self.pages)
+
+        # a film or a cinema edited in the website is removed and added again, with its projections
+        self.films[:], changes.added_films, changes.removed_films = apply_diff(self.films, films, film_key)
+        self.cinemas[:], changes.added_cinemas, changes.removed_cinemas = apply_diff(self.cinemas, cinemas, cinema_key)
+        kept, changes.added_projections, changes.removed_projections = apply_diff(
+            list(self.projections), list(projections), projection_key)
+        self.projections = ProjectionTable.from_projections(kept)
+
+        return changes
+
+
+class Timeline:
+    """
+    Class that stores the positions of some projections sorted by their start, in minutes after midnight,
+    to find the ones that start in a range of time with a binary search
+    """
+
+    __slots__ = ('starts', 'positions')
+
+    def __init__(self, pairs: Iterable[Tuple[int, int]] = ()) -> None:
+        """
+        Builds the timeline of the pairs (start, position), sorting them only once. The projections
+        that start at the same time are kept by their position
+        """
+
+        pairs = sorted(pairs)
+        self.starts: list[int] = [start for start, _ in pairs]
+        self.positions: list[int] = [position for _, position in pairs]
+
+    def between(self, first: float, last: float) -> list[int]:
+        """
+        Returns the positions of the projections that start from first to last, both included
+        """
+
+        return self.positions[bisect_left(self.starts, first):bisect_right(self.starts, last)]
+
+    def first_after(self, time: float) -> int | None:
+        """
+        Returns the position of the first projection that starts strictly after time, if there is any
+        """
+
+        i = bisect_right(self.starts, time)
+        return self.positions[i] if i < len(self.positions) else None
+
+
+def minutes(time: Tuple[int, int]) -> int:
+    """
+    Returns the minutes after midnight of an (hour, minute) time
+    """
+
+    return time[0] * 60 + time[1]
+
+
+def now_minutes(now: datetime | None = None) -> int:
+    """
+    Returns the minutes after midnight of now, the current time by default
+    """
+
+    now = now or datetime.now()
+    return now.hour * 60 + now.minute
+
+
+@dataclass
+class BillboardIndex:
+    """
+    Class that stores the indexes of a billboard. The keys are normalized and the values
+    are the positions of the projections or the films in the lists of the billboard
+    """
+
+    by_title: dict[str, list[int]]  # title -> projections
+    by_cinema: dict[str, list[int]]  # cinema name -> projections
+    by_film: dict[str, list[int]]  # film id -> projections
+    by_genre: dict[str, list[int]]  # genre -> films
+    by_actor: dict[str, list[int]]  # actor -> films
+    timeline: Timeline = field(default_factory=Timeline)  # all the projections sorted by start
+    title_timelines: dict[str, Timeline] = field(default_factory=dict)  # title -> projections sorted by start
+    cinema_timelines: dict[str, Timeline] = field(default_factory=dict)  # cinema -> projections sorted by start
+    title_cinema_timelines: dict[Tuple[str, str], Timeline] = field(default_factory=dict)
+
+
+def normalize(text: str) -> str:
+    """
+    Returns the key of a text in the indexes, so that the capital letters and the spaces at the ends do not matter
+    """
+
+    return text.strip().lower()
+
+
+def index_billboard(bill: Billboard) -> BillboardIndex:
+    """
+    Builds the indexes of the billboard with only one pass over its projections and films
+    """
+
+    index = BillboardIndex(dict(), dict(), dict(), dict(), dict())
+
+    # the columns of the table are read directly, so no Projection is built
+    table = bill.projections
+    titles = [normalize(film.title) for film in table.films]
+    ids = [film.id for film in table.films]
+    names = [normalize(cinema.name) for cinema in table.cinemas]
+
+    # the pairs (start, position) of each timeline are collected first, and each timeline is sorted once
+    title_pairs: dict[str, list[Tuple[int, int]]] = dict()
+    cinema_pairs: dict[str, list[Tuple[int, int]]] = dict()
+    title_cinema_pairs: dict[Tuple[str, str], list[Tuple[int, int]]] = dict()
+
+    for i, (f, c, start) in enumerate(zip(table.film, table.cinema, table.start)):
+        title, cinema = titles[f], names[c]
+        index.by_title.setdefault(title, []).append(i)
+        index.by_cinema.setdefault(cinema, []).append(i)
+        index.by_film.setdefault(ids[f], []).append(i)
+        title_pairs.setdefault(title, []).append((start, i))
+        cinema_pairs.setdefault(cinema, []).append((start, i))
+        title_cinema_pairs.setdefault((title, cinema), []).append((start, i))
+
+    index.timeline = Timeline(zip(table.start, range(len(table))))
+    index.title_timelines = {key: Timeline(pairs) for key, pairs in title_pairs.items()}
+    index.cinema_timelines = {key: Timeline(pairs) for key, pairs in cinema_pairs.items()}
+    index.title_cinema_timelines = {key: Timeline(pairs) for key, pairs in title_cinema_pairs.items()}
+
+    for i, film in enumerate(bill.films):
+        # a film is only added once to each key, even if it has a genre or an actor repeated
+        for genre in {normalize(genre) for genre in film.genre}:
+            index.by_genre.setdefault(genre, []).append(i)
+        for actor in {normalize(actor) for actor in film.actors}:
+            index.by_actor.setdefault(actor, []).append(i)
+
+    return index
+
+
+def normalize_address(address: str) -> str:
+    """
+    Applies the fixes of ADDRESS_FIXES to the address, so that it can be found by the geocoder
+    """
+
+    for wrong, right in ADDRESS_FIXES:
+        address = address.replace(wrong, right)
+    return address
+
+
+def nominatim_resolver(address: str) -> Tuple[float, float]:
+    """
+    Finds the coordinates of the address with the geocoder of osmnx, that asks Nominatim
+    """
+
+    return ox.geocoder.geocode(address)
+
+
+def gazetteer_resolver(filename: str) -> Resolver:
+    """
+    Returns a resolver that finds the addresses in a local json file that maps
+    each normalized address to its [latitude, longitude], for offline and test runs
+    """
+
+    with open(filename, encoding='utf-8') as file:
+        gazetteer: dict[str, list[float]] = json.load(file)
+
+    def resolver(address: str) -> Tuple[float, float]:
+        if address not in gazetteer:
+            raise ValueError(f'The address {address} is not in the gazetteer {filename}')
+        lat, lon = gazetteer[address]
+        return (lat, lon)
+
+    return resolver
+
+
+resolver: Resolver = nominatim_resolver  # the resolver used when the address is not in the cache
+geocode_cache: dict[str, list[float]] | None = None  # loaded from GEOCODE_CACHE the first time it is needed
+cache_lock = threading.Lock()
+
+
+def set_resolver(new_resolver: Resolver) -> None:
+    """
+    Changes the resolver used to find the addresses that are not in the cache
+    """
+
+    global resolver
+    resolver = new_resolver
+
+
+def get_geocode_cache() -> dict[str, list[float]]:
+    """
+    Returns the cache of coordinates of the addresses, loading it from its file the first time
+    """
+
+    global geocode_cache
+    if geocode_cache is None:
+        geocode_cache = dict()
+        if exists(GEOCODE_CACHE):
+            with open(GEOCODE_CACHE, encoding='utf-8') as file:
+                geocode_cache = json.load(file)
+    return geocode_cache
 
 
 def get_coordinates(address: str) -> Tuple[float, float]:
     """
-    Returns the coodinates lattitude and longitud of the addreses of the each cinema
-    """
-
-    # Takes control of the misspellings of Sensacine's web in order to avoid problems with geocode
-    address = address.replace('Calle', 'Carrer')\
-        .replace('Avenida', 'Avinguda')\
-        .replace('Avda.', 'Avinguda')\
-        .replace('Paseig', 'Passeig')\
-        .replace('Centro Comercial Splau! -', '')\
-        .replace('- Centro Comercial Gran Vía 2', '')\
-        .replace('Paseo', 'Passeig')\
-        .replace('Sta Fé', 'Carrer de Santa Fe')\
-        .replace('- Centro Comercial La Maquinista', '')\
-        .replace('Andreu', 'D\'Andreu')\
-        .replace('s/n - Pintor Alzamora', '')\
-        .replace('Avinguda Josep Tarradellas', 'Avinguda de Josep Tarradellas i Joan')\
-        .replace('Avinguda Virgen Montserrat', 'Avinguda Verge de Montserrat')\
-        .replace('Centro Comercial Baricentro - Carretera Nacional 150', 'N-150')\
-        .replace('Carrer Salvador Espriu', 'Carrer de Salvador Espriu')\
-        .replace('Carrer Verdi', 'C/ de Verdi')\
-        .replace('Carrer Aribau', "Aribau - Gran Via")
-
-    """if address == 'Calle Aribau, 8, 08011 Barcelona':
-        location = (41.3876521, 2.1602093)"""
-
-    location = ox.geocoder.geocode(address)
+    Returns the coodinates lattitude and longitud of the addreses of the each cinema.
+    They are saved in a cache file, so each address is only geocoded once
+    """
+
+    address = normalize_address(address)
+
+    with cache_lock:
+        cache = get_geocode_cache()
+        if address in cache:
+            metrics.count('billboard.geocode_cache_hits')
+            lat, lon = cache[address]
+            return (lat, lon)
+
+    metrics.count('billboard.geocode_calls')
+    with metrics.span('billboard.geocode'):
+        location = resolver(address)
+
+    with cache_lock:
+        cache[address] = list(location)
+        save_geocode_cache(cache)
 
     return location
 
 
+def save_geocode_cache(cache: dict[str, list[float]]) -> None:
+    """
+    Saves the cache of coordinates in its file. The workers of the service have their own copy of the cache,
+    so the addresses saved by the others since it was loaded are added to it before it replaces the file
+    """
+
+    if exists(GEOCODE_CACHE):
+        try:
+            with open(GEOCODE_CACHE, encoding='utf-8') as file:
+                saved = json.load(file)
+        except ValueError:
+            saved = dict()
+        for address, location in saved.items():
+            cache.setdefault(address, location)
+
+    with atomic_write(GEOCODE_CACHE, 'w', encoding='utf-8') as file:
+        json.dump(cache, file, ensure_ascii=False, indent=1)
+
+
 def translate_genres(new_film: Film) -> list:
     """
     Translates the genres of each film from Spanish to English
@@ -141,105 +623,333 @@ def translate_genres(new_film: Film) -> list:
     return list(english_genres)
 
 
-def read() -> Billboard:
+def page_urls(base_url: str = BILLBOARD_URL, pages: int = BILLBOARD_PAGES) -> list[str]:
+    """
+    Returns the links of the pages of the billboard. The first one is the base url and the others add ?page=i
+    """
+
+    return [base_url if i == 1 else base_url + '?page=' + str(i) for i in range(1, pages + 1)]
+
+
+def fetch_page(session: requests.Session, link: str, page: Page | None = None) -> requests.Response:
+    """
+    Downloads a page of the billboard. If the page has been read before, the request is conditional
+    and the answer is 304 when it has not changed
+    """
+
+    headers: dict[str, str] = dict()
+    if page is not None and page.etag is not None:
+        headers['If-None-Match'] = page.etag
+    if page is not None and page.last_modified is not None:
+        headers['If-Modified-Since'] = page.last_modified
 
-    set_films: set[Film] = set()
-    dict_cinemas: dict[str, Tuple[str, Tuple[float, float]]] = dict()
+    r = session.get(link, headers=headers, timeout=30)
+    r.raise_for_status()
+    metrics.count('billboard.pages_fetched')
+    if r.status_code == 304:
+        metrics.count('billboard.pages_not_modified')
+    return r
 
+
+@dataclass(slots=True)
+class RawItem:
+    """
+    Class that stores the elements read from each div 'item_resa' of a page: a film in a cinema and its sessions
+    """
+
+    theater: str  # The json of the cinema, in the attribute data-theater of the div 'j_w'
+    movie: str  # The json of the film, in the attribute data-movie of the div 'j_w'
+    language: str | None  # The text of the first span 'bold'
+    hours: list[str]  # The text of each 'em'
+
+
+@dataclass
+class RawPage:
+    """
+    Class that stores the only elements of a page of the billboard that are needed to read it
+    """
+
+    names: list[str]  # The text of each 'a' of class 'no_underline j_entities'
+    addresses: list[str]  # The text of each 'span' of class 'lighten'
+    items: list[RawItem]
+
+
+def extract_soup(content: bytes) -> RawPage:
+    """
+    Reads the elements of the page building its whole tree with BeautifulSoup
+    """
+
+    soup = bs4.BeautifulSoup(content, 'lxml')
+
+    # Entries of films filtred by 'div' and the class 'item_resa'
+    divslist = soup.find_all('div', attrs={'class': 'item_resa'})
+
+    # Entries of cinema name filtred by 'a' and class 'no_underline j_entities'
+    cin_names = soup.find_all(
+        'a', attrs={'class': 'no_underline j_entities'})
+
+    # Entries of cinema adress filtred by 'span' and class 'lighten'
+    cinlist = soup.find_all('span', attrs={'class': 'lighten'})
+
+    items: list[RawItem] = []
+    for div in divslist:
+        # the class j_w is selected fot the film and cinema information and list_hours for the projections
+        new = div.find('div', attrs={'class': 'j_w'})
+        if new is None:
+            continue
+        # Searches for the language of the cinema in 'span' class 'bold'
+        bold = div.find('span', attrs={'class': 'bold'})
+        items.append(RawItem(new['data-theater'], new['data-movie'],
+                             None if bold is None else bold.text, [em.text for em in div.find_all('em')]))
+
+    return RawPage([k.text.strip() for k in cin_names], [span.text.strip() for span in cinlist], items)
+
+
+def has_class(element: etree._Element, wanted: str) -> bool:
+    """
+    Checks if the element has the class as BeautifulSoup does: one of its classes or all of them together
+    """
+
+    value = element.get('class')
+    if value is None:
+        return False
+    classes = value.split()
+    # BeautifulSoup also joins the classes with single spaces before comparing them
+    return value == wanted or ' '.join(classes) == wanted or wanted in classes
+
+
+def extract_stream(content: bytes, chunk_size: int = 1 << 16) -> RawPage:
+    """
+    Reads the elements of the page in a single streaming pass with the pull parser of lxml.
+    Only the elements that are needed are kept: the rest of the tree is cleared as soon as it is parsed
+    """
+
+    page = RawPage([], [], [])
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+
+    item: RawItem | None = None  # the item of the div 'item_resa' that is open
+    item_div = None
+    bold = None  # the first span 'bold' of the open item
+    capturing = 0  # the number of open elements whose text we need
+
+    def wanted(element: etree._Element) -> bool:
+        tag = element.tag
+        return (tag == 'a' and has_class(element, 'no_underline j_entities')) or \
+            (tag == 'span' and has_class(element, 'lighten')) or \
+            (item is not None and (tag == 'em' or element is bold))
+
+    text = bs4.UnicodeDammit(content, is_html=True).unicode_markup
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+
+        for event, element in parser.read_events():
+            if event == 'start':
+                if item is None and element.tag == 'div' and has_class(element, 'item_resa'):
+                    item, item_div, bold = RawItem('', '', None, []), element, None
+                elif item is not None and not item.theater and element.tag == 'div' and has_class(element, 'j_w'):
+                    item.theater = element.get('data-theater', '')
+                    item.movie = element.get('data-movie', '')
+                elif item is not None and bold is None and element.tag == 'span' and has_class(element, 'bold'):
+                    bold = element
+                if wanted(element):
+                    capturing += 1
+                continue
+
+            if wanted(element):
+                capturing -= 1
+                element_text = ''.join(element.itertext())
+                if element.tag == 'a':
+                    page.names.append(element_text.strip())
+                elif element.tag == 'span' and has_class(element, 'lighten'):
+                    page.addresses.append(element_text.strip())
+                if item is not None and element is bold:
+                    item.language = element_text
+                elif item is not None and element.tag == 'em':
+                    item.hours.append(element_text)
+
+            if element is item_div:
+                if item.theater:
+                    page.items.append(item)
+                item, item_div = None, None
+
+            if capturing == 0:
+                # the text of this element is not needed anymore, neither the elements before it.
+                # The root has no parent, and the comments before it are not removed
+                element.clear()
+                parent = element.getparent()
+                while parent is not None and element.getprevious() is not None:
+                    del parent[0]
+
+    parser.close()
+    return page
+
+
+EXTRACTORS: dict[str, Callable[[bytes], RawPage]] = {'soup': extract_soup, 'stream': extract_stream}
+
+
+@metrics.timed('billboard.parse_page')
+def parse_page(link: str, r: requests.Response, parser: str = PARSER) -> Page:
+    """
+    Reads the films, the cinemas and the projections of a downloaded page of the billboard.
+    The parser can be 'soup', that builds the whole tree of the page, or 'stream', that only keeps the elements needed
+    """
+
+    set_films: set[str] = set()
     list_films: list[Film] = []
     list_cinemas: list[Cinema] = []
-    list_projections: list[Projection] = []
+    list_projections = ProjectionTable()
+
+    raw = EXTRACTORS[parser](r.content)
+
+    # In the even postions there is information we do not need
+    directions = [raw.addresses[x] for x in range(1, len(raw.addresses), 2)]
+
+    # Each name is paired with its address before the cinemas out of Barcelona are dropped
+    names_bcn: list[str] = []
+    directions_bcn: list[str] = []
+
+    for name, addres in zip(raw.names, directions):
+        city = addres.split()[-1]
+        if city == 'Barcelona':
+            names_bcn.append(name)
+            directions_bcn.append(addres)
+
+    coordinates = [get_coordinates(adress) for adress in directions_bcn]
 
-    # Searches for all the relevant information of the three pages of the sensacine website
-    for i in range(1, 4):
-        if i == 1:
-            link = 'https://www.sensacine.com/cines/cines-en-72480/'
+    # Creates a dictionary of cinemas where the key is its name. The same object is used by all its projections
+    dict_cinemas = {sys.intern(k): Cinema(sys.intern(k), v1, v2) for k,
+                    v1, v2 in zip(names_bcn, directions_bcn, coordinates)}
+    list_cinemas = list(dict_cinemas.values())
+
+    # The films already created in this page, by their id
+    dict_films: dict[str, Film] = dict()
+
+    for div in raw.items:
+
+        if div.language == ' Versión Original':
+            language = LANGUAGES[1]
         else:
-            link = 'https://www.sensacine.com/cines/cines-en-72480/?page=' + \
-                str(i)
+            language = LANGUAGES[0]
+
+        # Converts the data to a python's dictionary using json
+        cine = json.loads(div.theater)
+        film = json.loads(div.movie)
+
+        c_name = cine['name'].rstrip()
+
+        if c_name in dict_cinemas:
+
+            new_cinema = dict_cinemas[c_name]
 
-        r = requests.get(link)
-        soup = BeautifulSoup(r.content, 'lxml')
+            if film['id'] in dict_films:
+                new_film = dict_films[film['id']]
+            else:
+                new_film = Film(sys.intern(film['title']), film['genre'],
+                                [sys.intern(d) for d in film['directors']],
+                                [sys.intern(a) for a in film['actors']], film['id'])
+                new_film.genre = [sys.intern(g) for g in translate_genres(new_film)]
+                dict_films[film['id']] = new_film
 
-        # Entries of films filtred by 'div' and the class 'item_resa'
-        divslist = soup.find_all('div', attrs={'class': 'item_resa'})
+            if new_film.title not in set_films:
+                set_films.add(film['title'])
+                list_films.append(new_film)
 
-        # Entries of cinema name filtred by 'a' and class 'no_underline j_entities'
-        cin_names = soup.find_all(
-            'a', attrs={'class': 'no_underline j_entities'})
+            # All the sessions of the film were in 'em' and we append each projection in the list of projections
+            for em in div.hours:
+                hour, minut = em.split(':')
+                hour = int(hour)
+                minut = int(minut)
+                list_projections.append(new_film, new_cinema, (hour, minut), language)
 
-        # Entries of cinema adress filtred by 'span' and class 'lighten'
-        cinlist = soup.find_all('span', attrs={'class': 'lighten'})
+    return Page(link, list_films, list_cinemas, list_projections,
+                r.headers.get('ETag'), r.headers.get('Last-Modified'))
 
-        # In the even postions there is information we do not need
-        directions = [cinlist[x].text.strip()
-                      for x in range(1, len(cinlist), 2)]
 
-        directions_bcn: list[str] = []
+def merge_pages(pages: list[Page]) -> Tuple[list[Film], list[Cinema], ProjectionTable]:
+    """
+    Joins the pages of the billboard in order. A film that appears in more than one page is only kept once
+    """
 
-        for addres in directions:
-            city = addres.split()[-1]
-            if city == 'Barcelona':
-                directions_bcn.append(addres)
+    set_films: set[str] = set()
+    list_films: list[Film] = []
+    list_cinemas: list[Cinema] = []
+    list_projections = ProjectionTable()
 
-        coordinates = [get_coordinates(adress) for adress in directions_bcn]
+    for page in pages:
+        for film in page.films:
+            if film.title not in set_films:
+                set_films.add(film.title)
+                list_films.append(film)
+        list_cinemas += page.cinemas
+        list_projections.extend(page.projections)
 
-        # Creates a dictionary of cinemas where the key is its name and the value its direction
-        dict_cinemas = {k.text.strip(): (v1, v2) for k,
-                        v1, v2 in zip(cin_names, directions_bcn, coordinates)}
+    return list_films, list_cinemas, list_projections
 
-        for k, v in dict_cinemas.items():
-            list_cinemas.append(Cinema(k, v[0], v[1]))
 
-        for div in divslist:
+def film_key(film: Film) -> tuple:
+    """
+    Returns all the fields of the film, so that a film is only the same as before if nothing of it has changed.
+    The genres are sorted because translate_genres does not keep their order
+    """
 
-            # the class j_w is selected fot the film and cinema information and list_hours for the projections
-            new = div.find('div', attrs={'class': 'j_w'})
+    return (film.id, film.title, tuple(sorted(film.genre)), tuple(film.director), tuple(film.actors))
 
-            # Searches for the language of the cinema in 'span' class 'bold'
-            language = div.find('span', attrs={'class': 'bold'}).text
 
-            if language == ' Versión Original':
-                language = 'Original Version'
-            else:
-                language = 'Spanish'
+def cinema_key(cinema: Cinema) -> tuple:
+    return (cinema.name, cinema.adress, cinema.coordinates)
 
-            cine_name = (new['data-theater'])
-            film_name = (new['data-movie'])
 
-            # Converts the data to a python's dictionary using json
-            cine = json.loads(str(cine_name))
-            film = json.loads(str(film_name))
+def projection_key(projection: Projection) -> tuple:
+    return (film_key(projection.film), cinema_key(projection.cinema), projection.time, projection.language)
 
-            c_name = cine['name'].rstrip()
 
-            if c_name in dict_cinemas:
+def apply_diff(old: list, new: list, key: Callable) -> Tuple[list, list, list]:
+    """
+    Compares two lists of elements by their key. Returns the new list, where the elements that have not changed
+    are the old objects, the list of added elements and the list of removed ones
+    """
 
-                adress = dict_cinemas[c_name]
-                new_cinema = Cinema(c_name, adress[0], adress[1])
+    old_by_key: dict = dict()
+    for x in old:
+        old_by_key.setdefault(key(x), []).append(x)
 
-                new_film = Film(film['title'], film['genre'],
-                                film['directors'], film['actors'], film['id'])
+    result: list = []
+    added: list = []
+    for x in new:
+        same = old_by_key.get(key(x))
+        if same:
+            result.append(same.pop(0))
+        else:
+            result.append(x)
+            added.append(x)
 
-                if new_film.title not in set_films:
-                    set_films.add(film['title'])
-                    list_films.append(new_film)
+    removed = [x for same in old_by_key.values() for x in same]
+    return result, added, removed
 
-                new_film.genre = translate_genres(new_film)
 
-                # Searches all the sessions of the film in 'em' and we append each projection in the list of projections
-                all_hours = div.find_all('em')
+@metrics.timed('billboard.read')
+def read(base_url: str = BILLBOARD_URL, pages: int = BILLBOARD_PAGES, concurrent: bool = True, parser: str = PARSER) -> Billboard:
+    """
+    Reads the billboard from the pages of the sensacine website. In concurrent mode all the
+    pages are downloaded at the same time with a shared session, and each page is parsed
+    while the next ones are still downloading. The base_url can be a local fixture server.
+    The parser can be 'soup' or 'stream' (see parse_page)
+    """
+
+    links = page_urls(base_url, pages)
 
-                for em in all_hours:
-                    hour, minut = em.text.split(':')
-                    hour = int(hour)
-                    minut = int(minut)
-                    p = Projection(new_film, new_cinema,
-                                   (hour, minut), language)
+    with make_session() as session:
+        if concurrent:
+            with ThreadPoolExecutor(max(1, len(links))) as pool:
+                # the pages are parsed in order, so the billboard is the same as downloading them one by one
+                responses = [pool.submit(fetch_page, session, link) for link in links]
+                list_pages = [parse_page(link, r.result(), parser) for link, r in zip(links, responses)]
+        else:
+            list_pages = [parse_page(link, fetch_page(session, link), parser) for link in links]
 
-                    list_projections.append(p)
+    list_films, list_cinemas, list_projections = merge_pages(list_pages)
 
-    return Billboard(list_films, list_cinemas, list_projections)
+    return Billboard(list_films, list_cinemas, list_projections, list_pages)
 
 
 if __name__ == '__main__':
@@ -1,52 +1,191 @@
+from __future__ import annotations
 import requests
 import networkx as nx
-from typing import TypeAlias
-import matplotlib.pyplot as plt
-import staticmap
+from typing import TypeAlias, Iterator
+from os.path import exists
+import os
+import json
+import hashlib
+import numpy as np
+from snapshot import save_buses_graph, load_buses_graph, SNAPSHOT_VERSION
+from render import Canvas, RENDERER
+import metrics
+from atomic import atomic_write
+from lazy import lazy_import
+
+# They are only loaded to show or paint the graphs
+plt = lazy_import('matplotlib.pyplot')
+staticmap = lazy_import('staticmap')
+
+try:
+    import ijson  # optional, to parse the data of AMB incrementally
+except ImportError:
+    ijson = None
 
 BusesGraph: TypeAlias = nx.Graph
 
+AMB_URL = "https://www.ambmobilitat.cat/OpenData/ObtenirDadesAMB.json"
+AMB_FILE = 'amb.json'  # the last payload downloaded from AMB
+META_SUFFIX = '.meta.json'  # the ETag, Last-Modified and version of each payload are saved next to it
+BUSES_PREFIX = 'amb_'  # the snapshot of the graph of each version is saved as amb_<version>_v<snapshot version>.snap
+LINE_PREFIX = 'ObtenirDadesAMBResult.Linies.Linia.item'
+STOP_PREFIX = LINE_PREFIX + '.Parades.Parada.item'
 
-def get_buses_graph() -> BusesGraph:
+buses_graphs: dict[str, BusesGraph] = dict()  # the graph built from each version of the payload
+
+
+def meta_filename(filename: str) -> str:
+    """
+    Returns the file where the ETag, Last-Modified and version of the payload saved in filename are kept
+    """
+
+    return os.path.splitext(filename)[0] + META_SUFFIX
+
+
+@metrics.timed('buses.download')
+def download_amb_data(url: str = AMB_URL, filename: str = AMB_FILE) -> str:
     """
-    Downloads the data from AMB and returns a not-directed graph containing all lines of buses in Barcelona.
+    Downloads the data from AMB to filename if it has changed since the last time, with a conditional request.
+    Returns the version of the payload, the hash of its content. If AMB can not be reached, the saved one is used
     """
 
-    # Download info
-    url = "https://www.ambmobilitat.cat/OpenData/ObtenirDadesAMB.json"
-    response = requests.get(url)
+    meta: dict[str, str] = dict()
+    meta_file = meta_filename(filename)
+    if exists(filename) and exists(meta_file):
+        with open(meta_file) as file:
+            meta = json.load(file)
+
+    headers: dict[str, str] = dict()
+    if 'etag' in meta:
+        headers['If-None-Match'] = meta['etag']
+    if 'last_modified' in meta:
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+    except requests.RequestException:
+        if 'version' in meta:
+            metrics.count('buses.download_offline')
+            return meta['version']
+        raise
+
+    # The response is streamed, so it is closed to give its connection back even when its body is not read
+    with response:
+        if response.status_code == 304:
+            metrics.count('buses.download_not_modified')
+            return meta['version']
+
+        # The payload is written by blocks, so it is never in memory as a whole
+        h = hashlib.sha256()
+        with atomic_write(filename) as file:
+            for block in response.iter_content(1 << 16):
+                h.update(block)
+                file.write(block)
+
+    meta = {'version': h.hexdigest()}
+    if 'ETag' in response.headers:
+        meta['etag'] = response.headers['ETag']
+    if 'Last-Modified' in response.headers:
+        meta['last_modified'] = response.headers['Last-Modified']
+    with atomic_write(meta_file, 'w') as file:
+        json.dump(meta, file)
+
+    return meta['version']
+
+
+def read_lines(filename: str = AMB_FILE) -> Iterator[tuple[str, list[dict]]]:
+    """
+    Reads the payload of AMB and yields the name of each line with its stops in Barcelona.
+    With ijson the file is parsed incrementally and only the stops of Barcelona are kept
+    """
 
-    # In each position of the list there is a list with the info of each stop
-    data = response.json()['ObtenirDadesAMBResult']['Linies']['Linia']
+    with open(filename, 'rb') as file:
+        if ijson is None:
+            # In each position of the list there is a list with the info of each stop
+            for linea in json.load(file)['ObtenirDadesAMBResult']['Linies']['Linia']:
+                yield linea['Nom'], [parada for parada in linea['Parades']['Parada'] if parada['Municipi'] == 'Barcelona']
+            return
+
+        name = ''
+        stops: list[dict] = []
+        builder = None
+        for prefix, event, value in ijson.parse(file, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == STOP_PREFIX and event == 'end_map':
+                    if builder.value['Municipi'] == 'Barcelona':
+                        stops.append(builder.value)
+                    builder = None
+            elif prefix == STOP_PREFIX and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == LINE_PREFIX + '.Nom':
+                name = value
+            elif prefix == LINE_PREFIX and event == 'start_map':
+                name, stops = '', []
+            elif prefix == LINE_PREFIX and event == 'end_map':
+                # the name of the line can be after its stops, so the line is given when it ends
+                yield name, stops
+
+
+@metrics.timed('buses.build')
+def build_buses_graph(filename: str = AMB_FILE) -> BusesGraph:
+    """
+    Returns a not-directed graph containing all lines of buses in Barcelona of the payload saved in filename
+    """
 
     # Create an empty graph
     G = nx.Graph()
 
-    for linea in data:
+    for nom, parades in read_lines(filename):
         prev_stop = None
-        for parada in linea['Parades']['Parada']:
+        for parada in parades:
             # we filter the busos in bcn, however if there is a line that goes to another city and has some stop in bcn we consider just the ones of bcn
-            if parada['Municipi'] == 'Barcelona':
 
-                idLinia = str(parada['IdLinia'])
-                ordre = str(parada['Ordre'])
-                nodeId = idLinia + '_' + ordre
+            idLinia = str(parada['IdLinia'])
+            ordre = str(parada['Ordre'])
+            nodeId = idLinia + '_' + ordre
 
-                posicio = (parada['UTM_X'],  parada['UTM_Y'])
+            posicio = (parada['UTM_X'],  parada['UTM_Y'])
 
-                G.add_node(nodeId, pos=posicio)
-                G.nodes[nodeId]['Nom'] = parada['Nom']
+            G.add_node(nodeId, pos=posicio)
+            G.nodes[nodeId]['Nom'] = parada['Nom']
 
-                if prev_stop is not None and nodeId != prev_stop:
-                    G.add_edge(prev_stop, nodeId)
-                    G.edges[prev_stop, nodeId]["nom_linia"] = linea['Nom']
+            if prev_stop is not None and nodeId != prev_stop:
+                G.add_edge(prev_stop, nodeId)
+                G.edges[prev_stop, nodeId]["nom_linia"] = nom
 
-                # We update the previous stop
-                prev_stop = nodeId
+            # We update the previous stop
+            prev_stop = nodeId
 
     return G
 
 
+def get_buses_graph() -> BusesGraph:
+    """
+    Downloads the data from AMB, if it has changed, and returns a not-directed graph containing all lines of buses in Barcelona.
+    The graph of each version of the data is only built once and saved as a snapshot, so it must not be modified.
+    """
+
+    version = download_amb_data()
+    if version not in buses_graphs:
+        filename = f'{BUSES_PREFIX}{version[:16]}_v{SNAPSHOT_VERSION}.snap'
+        if exists(filename):
+            metrics.count('buses.snapshot_hits')
+            buses_graphs[version] = load_buses_graph(filename)
+        else:
+            buses_graphs[version] = build_buses_graph()
+            save_buses_graph(buses_graphs[version], filename)
+    else:
+        metrics.count('buses.memory_hits')
+
+    g = buses_graphs[version]
+    metrics.gauge('buses.nodes', g.number_of_nodes())
+    metrics.gauge('buses.edges', g.number_of_edges())
+    return g
+
+
 def show_buses(g: BusesGraph) -> None:
     """
     Displays the graph interactively using network.draw
@@ -83,11 +222,34 @@ def paint_edges(g: BusesGraph, m: staticmap.StaticMap) -> None:
         m.add_line(line)
 
 
-def plot_buses(g: BusesGraph, nom_fitxer: str) -> None:
+def raster_buses(g: BusesGraph, width: int, height: int) -> Canvas:
+    """
+    Paints the graph on a Canvas with the map in the background: all the edges in one pass and then all the nodes
+    """
+
+    stops = list(g.nodes)
+    index = {n: i for i, n in enumerate(stops)}
+    lats, lons = np.array([g.nodes[n]['pos'] for n in stops], dtype=np.float64).reshape(-1, 2).T
+    u = np.array([index[a] for a, _ in g.edges], dtype=np.int64)
+    v = np.array([index[b] for _, b in g.edges], dtype=np.int64)
+
+    canvas = Canvas.fit(lons, lats, width, height, padding=40)
+    canvas.draw_base()
+    canvas.draw_segments(lons[u], lats[u], lons[v], lats[v], 'blue', 5)
+    canvas.draw_points(lons, lats, 'red', 20)
+    return canvas
+
+
+@metrics.timed('buses.plot')
+def plot_buses(g: BusesGraph, nom_fitxer: str, renderer: str = RENDERER) -> None:
     """
     Saves the graph as an image with the city map of Barcelona in the background
     """
 
+    if renderer == 'raster':
+        raster_buses(g, 10000, 10000).save(nom_fitxer)
+        return
+
     m = staticmap.StaticMap(10000, 10000)
     paint_nodes(g, m)
     paint_edges(g, m)
@@ -1,11 +1,26 @@
+from __future__ import annotations
 from typing import TypeAlias, Tuple
 from buses import *
 import networkx as nx
-import osmnx as ox
 from os.path import exists
 import pickle
-import staticmap
-from datetime import timedelta
+import hashlib
+from routing import get_backend, one_to_many, astar, Reach, TableReach, compile_graph, CinemaTables, precompute_cinema_tables, load_cinema_tables
+from concurrent.futures import ProcessPoolExecutor
+from spatial import SpatialIndex, build_index
+from snapshot import save_city_graph, load_city_graph, SNAPSHOT_VERSION
+from hierarchy import Hierarchy, HIERARCHY_KEY, build_hierarchy, load_hierarchy
+from transit import TransitNetwork, TransitRoute, TRANSIT_KEY, build_transit, transit_route
+import heapq
+import numpy as np
+from render import Canvas, RENDERER
+import metrics
+from atomic import atomic_write
+from lazy import lazy_import
+
+# osmnx is only needed to download the streets and staticmap to paint with it
+ox = lazy_import('osmnx')
+staticmap = lazy_import('staticmap')
 
 
 CityGraph: TypeAlias = nx.Graph
@@ -16,11 +31,18 @@ Path: TypeAlias = list[str]
 
 
 GRAPH_NAME = 'barcelona.grf'
+CITY_GRAPH_PREFIX = 'barcelona_city_'
+CITY_GRAPH_VERSION = 1  # bump it when the way the CityGraph is built changes
+CINEMA_TABLES_PREFIX = 'barcelona_cinemas_'
+INDEX_PREFIX = 'barcelona_index_'
+STREET_DIGEST_KEY = 'street_digest'  # key of the hash of the street graph in the dictionary g1.graph
+HIERARCHY_PREFIX = 'barcelona_ch_'
 BUS_STOP_LENGTH = 5
 WALK_SPEED = 1.25  # m/s
 BUS_SPEED = 3.5  # m/s
 
 
+@metrics.timed('city.street_graph')
 def get_osmnx_graph() -> OsmnxGraph:
     """
     If the graph is not alredy created it gets the graph of the streets of BCN from the OPM, 
@@ -37,15 +59,17 @@ def get_osmnx_graph() -> OsmnxGraph:
     else:
         graph: OsmnxGraph = load_osmnx_graph(GRAPH_NAME)
 
+    metrics.gauge('city.street_nodes', graph.number_of_nodes())
+    metrics.gauge('city.street_edges', graph.number_of_edges())
     return graph
 
 
 def save_osmnx_graph(graph: OsmnxGraph, filename: str):
     """
-    Saves the graph in the pickle
+    Saves the graph in the pickle. It is written with another name and renamed, so a half written file is never loaded
     """
 
-    with open(filename, 'wb') as file:
+    with atomic_write(filename) as file:
         pickle.dump(graph, file)
 
 
@@ -58,6 +82,53 @@ def load_osmnx_graph(filename: str):
         return pickle.load(file)
 
 
+def get_spatial_index(g1: OsmnxGraph) -> SpatialIndex:
+    """
+    Returns the spatial index of the street nodes of g1. It is built only once: it is kept in g1.graph
+    and saved in a file named after the content of g1, so each street graph has its own
+    """
+
+    if 'spatial_index' in g1.graph:
+        return g1.graph['spatial_index']
+
+    digest = street_digest(g1)
+    filename = INDEX_PREFIX + digest[:16] + '.idx'
+
+    index = None
+    if exists(filename):
+        saved_digest, saved_index = load_osmnx_graph(filename)
+        if saved_digest == digest:
+            index = saved_index
+
+    if index is None:
+        nodes = list(g1.nodes)
+        index = build_index(nodes, [g1.nodes[n]['y'] for n in nodes], [g1.nodes[n]['x'] for n in nodes])
+        save_osmnx_graph((digest, index), filename)
+
+    g1.graph['spatial_index'] = index
+    return index
+
+
+def nearest_nodes(g1: OsmnxGraph, X: float | list[float], Y: float | list[float]):
+    """
+    Works as ox.distance.nearest_nodes(g1, X, Y) but using the spatial index of g1, so that
+    the search structure is not built again in every call
+    """
+
+    metrics.count('city.snapped_points', 1 if np.isscalar(X) else len(X))
+    with metrics.span('city.snap'):
+        return get_spatial_index(g1).nearest_nodes(X, Y)
+
+
+def get_buses_index(g2: BusesGraph) -> SpatialIndex:
+    """
+    Returns a spatial index of the bus stops, to find the nearest stop to some points
+    """
+
+    stops = list(g2.nodes)
+    return build_index(stops, [g2.nodes[s]['pos'][0] for s in stops], [g2.nodes[s]['pos'][1] for s in stops])
+
+
 def add_street_nodes(g1: OsmnxGraph, G: CityGraph) -> None:
     """
     Adds the street nodes to the CityGraph
@@ -96,7 +167,7 @@ def add_buses_nodes(g1: OsmnxGraph, g2: BusesGraph, G: CityGraph) -> dict:
         position: Coord = (coords_x[i], coords_y[i])
         G.add_node(stop, pos=position, type='Parada', name=stop.split('_')[0])
 
-    nearest_crossroads = ox.distance.nearest_nodes(g1, coords_y, coords_x)
+    nearest_crossroads = nearest_nodes(g1, coords_y, coords_x)
     stops_crossroads = list(zip(buses_stops, nearest_crossroads))
 
     """stops_crossroads = []
@@ -110,25 +181,95 @@ def add_buses_nodes(g1: OsmnxGraph, g2: BusesGraph, G: CityGraph) -> dict:
     return busos_cruilles
 
 
-def add_bus_edges(g1: OsmnxGraph, g2: BusesGraph, G: CityGraph, busos_cruilles: dict[str, int]) -> None:
+def bounded_dijkstra(g1: OsmnxGraph, source: int, targets: set[int]) -> dict[int, float]:
     """
-    Adds the bus edges to the CityGraph
+    Dijkstra from source over g1 that stops as soon as all the targets are settled.
+    The weight of an edge is the one nx.shortest_path_length(weight='time') gives it:
+    the minimum 'time' of its parallel edges, or 1 if they do not have it.
+    Returns the distance to each target. Raises nx.NetworkXNoPath if some target can not be reached
+    """
+
+    dist: dict[int, float] = {source: 0}
+    settled: set[int] = set()
+    pending = set(targets)
+    heap = [(0, source)]
+
+    while heap and pending:
+        d, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        pending.discard(u)
+
+        for v, keydict in g1[u].items():
+            if v not in settled:
+                nd = d + min(data.get('time', 1) for data in keydict.values())
+                if nd < dist.get(v, float('inf')):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+
+    metrics.count('city.dijkstra_runs')
+    metrics.count('city.nodes_settled', len(settled))
+    if pending:
+        raise nx.NetworkXNoPath(f'No path from {source} to {pending.pop()}')
+
+    return {t: dist[t] for t in targets}
+
+
+_pool_graph: OsmnxGraph | None = None  # the street graph of each process of the pool
+
+
+def _init_pool(g1: OsmnxGraph) -> None:
+    global _pool_graph
+    _pool_graph = g1
+
+
+def _pool_search(group: tuple[int, set[int]]) -> tuple[int, dict[int, float]]:
+    source, targets = group
+    return source, bounded_dijkstra(_pool_graph, source, targets)
+
+
+@metrics.timed('city.bus_edges')
+def bus_edges_lengths(g1: OsmnxGraph, pairs: list[tuple[int, int]], processes: int | None = None) -> dict[tuple[int, int], float]:
     """
+    Returns the shortest path length in g1 of each pair of crossroads (source, target).
+    The pairs are grouped by source, so only one bounded search is done for each source crossroad.
+    If processes is given, the groups are spread over a pool with that number of processes
+    """
+
+    groups: dict[int, set[int]] = dict()
+    for source, target in pairs:
+        groups.setdefault(source, set()).add(target)
+
+    if processes is None or processes <= 1:
+        results = ((source, bounded_dijkstra(g1, source, targets)) for source, targets in groups.items())
+        lengths = dict(results)
+    else:
+        with ProcessPoolExecutor(processes, initializer=_init_pool, initargs=(g1,)) as pool:
+            lengths = dict(pool.map(_pool_search, groups.items(), chunksize=16))
+
+    return {(source, target): lengths[source][target] for source, target in pairs}
 
-    for g2 in g2.edges:
 
-        near_crui_1 = busos_cruilles[g2[0]]
-        near_crui_2 = busos_cruilles[g2[1]]
+def add_bus_edges(g1: OsmnxGraph, g2: BusesGraph, G: CityGraph, busos_cruilles: dict[str, int], processes: int | None = None) -> None:
+    """
+    Adds the bus edges to the CityGraph
+    """
+
+    pairs = [(busos_cruilles[u], busos_cruilles[v]) for u, v in g2.edges]
+    lengths = bus_edges_lengths(g1, pairs, processes)
 
-        i = nx.shortest_path_length(
-            g1, source=near_crui_1, target=near_crui_2, weight='time')
-        G.add_edge(g2[0], g2[1], type='Bus', length=i,
+    for (u, v), pair in zip(g2.edges, pairs):
+        i = lengths[pair]
+        G.add_edge(u, v, type='Bus', length=i,
                    speed=BUS_SPEED, time=i/BUS_SPEED)
 
 
-def build_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
+@metrics.timed('city.build')
+def build_city_graph(g1: OsmnxGraph, g2: BusesGraph, processes: int | None = None) -> CityGraph:
     """
     Builds the city graph by combining the Osmnx graph of streets (g1) and the BusesGraph (g2).
+    The lengths of the bus edges can be computed with a pool of processes.
     """
     # Create an empty graph
     G: CityGraph = nx.Graph()
@@ -136,27 +277,98 @@ def build_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
     add_street_nodes(g1, G)
     add_street_edges(g1, G)
     busos_cruilles = add_buses_nodes(g1, g2, G)
-    add_bus_edges(g1, g2, G, busos_cruilles)
+    add_bus_edges(g1, g2, G, busos_cruilles, processes)
 
     return G
 
 
-def find_path(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord) -> Path:
+def street_digest(g1: OsmnxGraph) -> str:
+    """
+    Returns a hash of the content of the street graph: the id and position of each node, and the ends, name
+    and length of each edge. It is kept in g1.graph, so it is computed once for each graph
+    """
+
+    if STREET_DIGEST_KEY in g1.graph:
+        return g1.graph[STREET_DIGEST_KEY]
+
+    h = hashlib.sha256()
+    nodes = list(g1.nodes(data=True))
+    h.update(repr([n for n, _ in nodes]).encode())
+    h.update(np.array([(d['x'], d['y']) for _, d in nodes], dtype=np.float64).tobytes())
+    edges = list(g1.edges(keys=True, data=True))
+    h.update(repr([(u, v, k, d.get('name')) for u, v, k, d in edges]).encode())
+    h.update(np.array([d['length'] for _, _, _, d in edges], dtype=np.float64).tobytes())
+
+    g1.graph[STREET_DIGEST_KEY] = h.hexdigest()
+    return g1.graph[STREET_DIGEST_KEY]
+
+
+def buses_digest(g2: BusesGraph) -> str:
+    """
+    Returns a hash of the content of the BusesGraph, so that it changes whenever the AMB data does
+    """
+
+    h = hashlib.sha256()
+    for n in sorted(g2.nodes):
+        h.update(repr((n, g2.nodes[n]['pos'], g2.nodes[n]['Nom'])).encode())
+    for u, v in sorted(tuple(sorted(e)) for e in g2.edges):
+        h.update(repr((u, v, g2.edges[u, v]['nom_linia'])).encode())
+    return h.hexdigest()
+
+
+def city_graph_digest(g1: OsmnxGraph, g2: BusesGraph) -> str:
+    """
+    Returns the key of the CityGraph built from g1 and g2: a hash of the content of the street graph,
+    the bus graph and the constants used to build and save it
+    """
+
+    h = hashlib.sha256()
+    h.update(street_digest(g1).encode())
+    h.update(buses_digest(g2).encode())
+    h.update(repr((CITY_GRAPH_VERSION, SNAPSHOT_VERSION, WALK_SPEED, BUS_SPEED, BUS_STOP_LENGTH)).encode())
+    return h.hexdigest()
+
+
+@metrics.timed('city.get_city_graph')
+def get_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
+    """
+    Returns the CityGraph of g1 and g2. It is saved as a snapshot in a file named after the hash of its inputs,
+    so it is only built again when the streets, the buses or the constants change
+    """
+
+    digest = city_graph_digest(g1, g2)
+    filename = CITY_GRAPH_PREFIX + digest[:16] + '.snap'
+
+    if exists(filename):
+        metrics.count('city.snapshot_hits')
+        G: CityGraph = load_city_graph(filename)
+    else:
+        G = build_city_graph(g1, g2)
+        G.graph['digest'] = digest
+        save_city_graph(G, filename)
+
+    metrics.gauge('city.nodes', G.number_of_nodes())
+    metrics.gauge('city.edges', G.number_of_edges())
+    return G
+
+
+@metrics.timed('city.find_path')
+def find_path(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord, backend: str | None = None) -> Path:
     """
     Returns the shortest path to arrive o a film.
+    The backend can be 'csr' (the default), 'networkx', to check the results, 'astar', or 'ch' after get_hierarchy(g).
     """
 
     x_coords = [src[1], dst[1]]
     y_coords = [src[0], dst[0]]
 
-    src_node, dst_node = ox.distance.nearest_nodes(ox_g, x_coords, y_coords)
-    path: list[str] = nx.shortest_path(
-        g, source=src_node, target=dst_node, weight='time')
+    src_node, dst_node = nearest_nodes(ox_g, x_coords, y_coords)
+    path: list[str] = get_backend(backend).path(g, src_node, dst_node)
 
     return path
 
 
-def find_path_time(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord) -> float:
+def find_path_time(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord, backend: str | None = None) -> float:
     """
     Finds the time in minutes that takes to go from src to dst and returns it
     """
@@ -164,13 +376,135 @@ def find_path_time(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord) -> fl
     x_coords = [src[1], dst[1]]
     y_coords = [src[0], dst[0]]
 
-    src_node, dst_node = ox.distance.nearest_nodes(ox_g, x_coords, y_coords)
+    src_node, dst_node = nearest_nodes(ox_g, x_coords, y_coords)
 
-    time: float = nx.shortest_path_length(
-        g, source=src_node, target=dst_node, weight='time')
+    time: float = get_backend(backend).time(g, src_node, dst_node)
     return time
 
 
+def compare_search_space(ox_g: OsmnxGraph, g: CityGraph, pairs: list[tuple[Coord, Coord]]) -> list[tuple[int, int]]:
+    """
+    For each pair of coordinates (like an origin and a cinema), returns the number of nodes settled
+    by Dijkstra and by A* to find the shortest path between them
+    """
+
+    x_coords = [c[1] for pair in pairs for c in pair]
+    y_coords = [c[0] for pair in pairs for c in pair]
+    nodes = nearest_nodes(ox_g, x_coords, y_coords)
+
+    settled: list[tuple[int, int]] = []
+    for src_node, dst_node in zip(nodes[::2], nodes[1::2]):
+        settled.append((one_to_many(g, src_node, [dst_node]).settled, astar(g, src_node, dst_node)[2]))
+    return settled
+
+
+def find_paths_to_many(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dsts: list[Coord]) -> Reach:
+    """
+    Finds with only one search the time from src to each of the coordinates of dsts.
+    The path to the i-th destination is reach.path(i)
+    """
+
+    x_coords = [src[1]] + [dst[1] for dst in dsts]
+    y_coords = [src[0]] + [dst[0] for dst in dsts]
+
+    src_node, *dst_nodes = nearest_nodes(ox_g, x_coords, y_coords)
+
+    reach = one_to_many(g, src_node, dst_nodes)
+    metrics.count('routing.searches')
+    metrics.count('routing.nodes_settled', reach.settled)
+    return reach
+
+
+def graph_digest(g: CityGraph) -> str:
+    """
+    Returns the hash of the CityGraph. The one given by get_city_graph is used if it has it
+    """
+
+    if 'digest' in g.graph:
+        return g.graph['digest']
+
+    c = compile_graph(g)
+    h = hashlib.sha256()
+    h.update(repr(c.nodes).encode())
+    h.update(c.indptr.tobytes())
+    h.update(c.indices.tobytes())
+    h.update(c.times.tobytes())
+    return h.hexdigest()
+
+
+def get_cinema_tables(ox_g: OsmnxGraph, g: CityGraph, cinemas: dict[str, Coord]) -> CinemaTables:
+    """
+    Returns the tables with the time from every node to each cinema, given by its name and coordinates.
+    They are saved next to the graph, in a file named after the graph and the cinemas
+    """
+
+    names = list(cinemas)
+    x_coords = [cinemas[name][1] for name in names]
+    y_coords = [cinemas[name][0] for name in names]
+    cinema_nodes = list(nearest_nodes(ox_g, x_coords, y_coords))
+
+    h = hashlib.sha256()
+    h.update(graph_digest(g).encode())
+    h.update(repr((names, cinema_nodes)).encode())
+    filename = CINEMA_TABLES_PREFIX + h.hexdigest()[:16] + '.npz'
+
+    if exists(filename):
+        tables = load_cinema_tables(filename)
+    else:
+        tables = precompute_cinema_tables(g, names, cinema_nodes)
+        tables.save(filename)
+
+    return tables
+
+
+def get_hierarchy(g: CityGraph) -> Hierarchy:
+    """
+    Prepares the contraction hierarchy of the CityGraph, so that find_path and find_path_time can use backend='ch'.
+    It is saved next to the graph, in a file named after the graph, because building it takes some minutes
+    """
+
+    if HIERARCHY_KEY not in g.graph:
+        filename = HIERARCHY_PREFIX + graph_digest(g)[:16] + '.npz'
+        if exists(filename):
+            g.graph[HIERARCHY_KEY] = load_hierarchy(filename)
+        else:
+            g.graph[HIERARCHY_KEY] = build_hierarchy(compile_graph(g))
+            g.graph[HIERARCHY_KEY].save(filename)
+
+    return g.graph[HIERARCHY_KEY]
+
+
+def get_transit_network(g: CityGraph, g2: BusesGraph) -> TransitNetwork:
+    """
+    Returns the lines of buses of g2 as routes, with the walking transfers taken from the streets of g.
+    It is built once and kept in g.graph
+    """
+
+    if TRANSIT_KEY not in g.graph:
+        g.graph[TRANSIT_KEY] = build_transit(g2, g)
+    return g.graph[TRANSIT_KEY]
+
+
+def find_transit_route(ox_g: OsmnxGraph, g: CityGraph, g2: BusesGraph, src: Coord, dst: Coord, max_transfers: int = 2) -> TransitRoute:
+    """
+    Returns the fastest route from src to dst taking at most max_transfers + 1 buses. The route knows its
+    lines, its number of buses and its path, that can be painted with plot_path
+    """
+
+    src_node, dst_node = nearest_nodes(ox_g, [src[1], dst[1]], [src[0], dst[0]])
+    return transit_route(get_transit_network(g, g2), src_node, dst_node, max_transfers)
+
+
+def find_times_to_cinemas(ox_g: OsmnxGraph, g: CityGraph, tables: CinemaTables, src: Coord) -> TableReach:
+    """
+    Returns the times from src to the cinemas of the tables, without any search.
+    The path to the i-th cinema is reach.path(i)
+    """
+
+    src_node = nearest_nodes(ox_g, src[1], src[0])
+    return tables.reach_from(g, src_node)
+
+
 def show(g: CityGraph) -> None:
     """
     Displays the city graph interactively in a window.
@@ -219,11 +553,39 @@ def paint_edges(G: CityGraph, m: staticmap.StaticMap) -> None:
         m.add_line(line)
 
 
-def plot(G: CityGraph, filename: str) -> None:
+def raster_city(G: CityGraph, width: int, height: int) -> Canvas:
+    """
+    Paints the CityGraph on a Canvas with the map in the background: the edges of each type in one pass,
+    and then the nodes of each type
+    """
+
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    lats, lons = np.array([G.nodes[n]['pos'] for n in nodes], dtype=np.float64).reshape(-1, 2).T
+    u = np.array([index[a] for a, _ in G.edges], dtype=np.int64)
+    v = np.array([index[b] for _, b in G.edges], dtype=np.int64)
+    streets = np.array([d['type'] == 'Carrer' for _, _, d in G.edges(data=True)], dtype=bool)
+    crossings = np.array([G.nodes[n]['type'] == 'Cruilla' for n in nodes], dtype=bool)
+
+    canvas = Canvas.fit(lons, lats, width, height, padding=10)
+    canvas.draw_base()
+    for selected, color in ((streets, 'black'), (~streets, 'blue')):
+        canvas.draw_segments(lons[u[selected]], lats[u[selected]], lons[v[selected]], lats[v[selected]], color, 1)
+    for selected, color in ((crossings, 'green'), (~crossings, 'blue')):
+        canvas.draw_points(lons[selected], lats[selected], color, 5)
+    return canvas
+
+
+@metrics.timed('city.plot')
+def plot(G: CityGraph, filename: str, renderer: str = RENDERER) -> None:
     """
     Saves the CityGraph as an image with the city map in the background in a file called 'filename'
     """
 
+    if renderer == 'raster':
+        raster_city(G, 6000, 6000).save(filename)
+        return
+
     m = staticmap.StaticMap(6000, 6000)
 
     paint_nodes(G, m)
@@ -241,40 +603,68 @@ def get_color(g: CityGraph, node: int | str) -> str:
         return 'blue'
 
 
-def plot_path(g: CityGraph, p: Path, filename: str) -> None:
+def path_runs(g: CityGraph, p: Path) -> list[tuple[str, list[tuple[float, float]]]]:
     """
-    Shows the path p on the city graph g and saves it as an image in the file specified by filename.
+    Splits the path in runs of nodes with the same color. Each run has its color and the (lon, lat) of
+    its nodes, followed by the first node of the next run, because the edge that changes of type is painted
+    with the color of the node where it starts
     """
 
-    m = staticmap.StaticMap(2000, 2000)  # Create a StaticMap object
-    coords1 = g.nodes[p[0]]['pos']
-    color1 = get_color(g, p[0])
-
-    coords1 = (coords1[1], coords1[0])
-    coords2 = coords1
-    start_marker = staticmap.CircleMarker(coords1, 'black', 15)
-    m.add_marker(start_marker)
-
-    for i in range(1, len(p)):
-        coords2 = g.nodes[p[i]]['pos']
-        coords2 = (coords2[1], coords2[0])
-        color2 = get_color(g, p[i])
-
-        line = staticmap.Line([list(coords1), list(coords2)], color1, 7)
-        m.add_line(line)  # Add the line between consecutive nodes
+    runs: list[tuple[str, list[tuple[float, float]]]] = []
+    previous = None
+    for node in p:
+        lat, lon = g.nodes[node]['pos']
+        color = get_color(g, node)
+        if runs:
+            runs[-1][1].append((lon, lat))
+        if color != previous:
+            runs.append((color, [(lon, lat)]))
+            previous = color
+    # the last run has only the last node when the color changes there
+    if len(runs) > 1 and len(runs[-1][1]) == 1:
+        runs.pop()
+    return runs
+
+
+def raster_path(g: CityGraph, p: Path, width: int, height: int) -> Canvas:
+    """
+    Paints the path on a Canvas cropped to it: one line for each run of nodes of the same type, and
+    markers only at the start, at each change of type and at the end
+    """
 
-        if color1 != color2:
-            marker = staticmap.CircleMarker(coords2, color2, 12)
-            m.add_marker(marker)
-        else:
-            marker = staticmap.CircleMarker(coords2, color1, 12)
-            m.add_marker(marker)
+    runs = path_runs(g, p)
+    lons, lats = np.array([coord for _, coords in runs for coord in coords], dtype=np.float64).reshape(-1, 2).T
+    canvas = Canvas.around(lons, lats, width, height, padding=20)
+    canvas.draw_base()
+    for color, coords in runs:
+        run_lons, run_lats = np.array(coords, dtype=np.float64).reshape(-1, 2).T
+        canvas.draw_polyline(run_lons, run_lats, color, 7)
+    canvas.draw_points(lons[:1], lats[:1], 'black', 7.5)
+    for color, coords in runs[1:]:
+        canvas.draw_points([coords[0][0]], [coords[0][1]], color, 6)
+    canvas.draw_points(lons[-1:], lats[-1:], 'red', 15)
+    return canvas
+
+
+@metrics.timed('city.plot_path')
+def plot_path(g: CityGraph, p: Path, filename: str, renderer: str = RENDERER) -> None:
+    """
+    Shows the path p on the city graph g and saves it as an image in the file specified by filename.
+    The image is cropped to the path, of 2000 x 2000 at most
+    """
 
-        coords1 = coords2
-        color1 = color2
+    if renderer == 'raster':
+        raster_path(g, p, 2000, 2000).save(filename)
+        return
 
-    end_marker = staticmap.CircleMarker(coords2, "red", 30)
-    m.add_marker(end_marker)
+    m = staticmap.StaticMap(2000, 2000)  # Create a StaticMap object
+    runs = path_runs(g, p)
+    m.add_marker(staticmap.CircleMarker(runs[0][1][0], 'black', 15))
+    for color, coords in runs:
+        m.add_line(staticmap.Line(coords, color, 7))
+    for color, coords in runs[1:]:
+        m.add_marker(staticmap.CircleMarker(coords[0], color, 12))
+    m.add_marker(staticmap.CircleMarker(runs[-1][1][-1], 'red', 30))
 
     image = m.render()
     image.save(filename)
@@ -1,12 +1,59 @@
-from billboard import *
+from __future__ import annotations
 from tabulate import tabulate
 import yogi
-from typing import Optional, Tuple
+from typing import Optional, Tuple, TYPE_CHECKING
+import metrics
+import warmup
+from lazy import lazy_import
 
+if TYPE_CHECKING:
+    from datetime import datetime
+    from billboard import Film, Billboard, Projection
+    from city import OsmnxGraph, CityGraph, Coord, Path, CinemaTables
+    from buses import BusesGraph
 
-from city import *
-from buses import *
-from datetime import timedelta, datetime
+# The modules are loaded when an option needs them, so the menu does not wait for osmnx, networkx, scipy or matplotlib
+billboard = lazy_import('billboard')
+city = lazy_import('city')
+buses = lazy_import('buses')
+
+PRECOMPUTE_CINEMAS = False  # precompute the times from every node to every cinema of the billboard
+METRICS_FILE = 'metrics.json'  # where the times and counters are saved at exit, when CITYBUS_METRICS=1 (.prom for Prometheus)
+
+loading: warmup.Warmup | None = None  # the billboard and the graphs, read in the background since the start
+
+
+def get_loading() -> warmup.Warmup:
+    """
+    Returns the futures of the billboard and the graphs, starting to read them the first time
+    """
+
+    global loading
+    if loading is None:
+        loading = warmup.start()
+    return loading
+
+
+def get_billboard() -> Billboard:
+    """
+    Returns the billboard, waiting for it if it is still being read
+    """
+
+    if not get_loading().billboard.done():
+        print('Reading the billboard...')
+    return get_loading().get_billboard()
+
+
+def get_graphs(message: str) -> Tuple[OsmnxGraph, BusesGraph, CityGraph]:
+    """
+    Returns the street graph, the bus graph and the city graph, waiting for the ones that are still
+    being built. The message is printed if some of them are not ready
+    """
+
+    graphs = get_loading()
+    if not graphs.city.done():
+        print(message)
+    return graphs.get_streets(), graphs.get_buses(), graphs.get_city()
 
 
 def print_selected_films(films_filtered: list[Film]) -> None:
@@ -181,56 +228,79 @@ def print_by_cinema(bill: Billboard) -> None:
         menu_billboard(bill)
 
 
-def check_time(time_to_last_cinema: int, projec_time: Tuple[int, int]) -> bool:
+def best_projection(bill: Billboard, title: str, ox_g: OsmnxGraph, g: CityGraph, source_coord: Tuple[float, float],
+                    tables: Optional[CinemaTables] = None, now: Optional[datetime] = None) -> Tuple[Projection, Path] | None:
     """
-    Checks if according to the time that takes to arrive in the cinema we are able to arrive before the film starts
+    Returns the first projection of the film that can be reached from source_coord, at the time now, and the path
+    to its cinema, or None if there is not any. If the tables of the cinemas are given, the times are read from them
+    instead of searching.
     """
 
-    # time delta is used in order to be able to sum and substract hours easily
-    h_cinema = timedelta(seconds=time_to_last_cinema)
-    h_projec = timedelta(hours=projec_time[0], minutes=projec_time[1])
-    actual_time = datetime.now()
-    suma = h_cinema + timedelta(hours=actual_time.hour,
-                                minutes=actual_time.minute)
+    projec_filtered = bill.filter_title(title)
+
+    cinemas: dict[str, int] = dict()
+    if tables is not None:
+        cinemas = {name: i for i, name in enumerate(tables.names)}
 
-    return suma < h_projec
+    if tables is not None and all(p.cinema.name in cinemas for p in projec_filtered):
+        reach = city.find_times_to_cinemas(ox_g, g, tables, source_coord)
+    else:
+        # Only one search is done from the source to all the cinemas of the projections
+        cinemas = dict()
+        coords: list[Coord] = []
+        for p in projec_filtered:
+            if p.cinema.name not in cinemas:
+                cinemas[p.cinema.name] = len(coords)
+                coords.append(p.cinema.coordinates)
+
+        reach = city.find_paths_to_many(ox_g, g, source_coord, coords)
+
+    # The sessions of each cinema are sorted, so the first one we can reach is found with a binary search
+    times = reach.times
+    best = bill.first_catchable(
+        title, {p.cinema.name: times[cinemas[p.cinema.name]] for p in projec_filtered}, now)
+
+    if best is None:
+        return None
+    return best, reach.path(cinemas[best.cinema.name])
 
 
-def best_path(projec_filtered: list[Projection], ox_g: OsmnxGraph, g: CityGraph, source_coord: Tuple[int, int]) -> Path | None:
+def best_path(bill: Billboard, title: str, ox_g: OsmnxGraph, g: CityGraph, source_coord: Tuple[float, float],
+              tables: Optional[CinemaTables] = None) -> Path | None:
     """
-    Saves an image with the path to arrive to the first projection
+    Prints the first projection of the film that can be reached and returns the path to arrive to it.
+    If the tables of the cinemas are given, the times are read from them instead of searching.
     """
 
-    best_projection = None
-    last_cinema_name = None
-    time_to_last_cinema = None
-    best_proj_time = None
-
-    for p in projec_filtered:
+    found = best_projection(bill, title, ox_g, g, source_coord, tables)
+    if found is None:
+        return None
+    projection, path = found
+    print(
+        f'YOUR BEST SELECTION TO SEE THE EARLIEST PROJECTION OF "{projection.film.title.upper()}" IS IN:')
 
-        if p.cinema.name != last_cinema_name:
-            last_cinema_name = p.cinema.name
+    info: list[list[str]] = [['CINEMA NAME', projection.cinema.name], ['ADRESS', projection.cinema.adress], [
+        'TIME', f"{projection.time[0]:02d}:{projection.time[1]:02d} h"], ['LANGUAGE', projection.language]]
+    print(tabulate(info, tablefmt='fancy_grid'))
 
-            time_to_last_cinema = find_path_time(
-                ox_g, g, source_coord, p.cinema.coordinates)
+    return path
 
-        if check_time(time_to_last_cinema, p.time):
-            projec_time = timedelta(hours=p.time[0], minutes=p.time[1])
-            if best_projection is None or projec_time < best_proj_time:
-                best_projection = p
-                best_proj_time = timedelta(
-                    hours=best_projection.time[0], minutes=best_projection.time[1])
 
-    if best_projection is None:
-        return None
-    print(
-        f'YOUR BEST SELECTION TO SEE THE EARLIEST PROJECTION OF "{best_projection.film.title.upper()}" IS IN:')
+def count_buses(p: Path) -> int:
+    """
+    Returns the number of different buses that have to be taken along the path
+    """
 
-    info: list[list[str]] = [['CINEMA NAME', best_projection.cinema.name], ['ADRESS', best_projection.cinema.adress], [
-        'TIME', f"{best_projection.time[0]:02d}:{best_projection.time[1]:02d} h"], ['LANGUAGE', best_projection.language]]
-    print(tabulate(info, tablefmt='fancy_grid'))
+    num = 0
+    prev_line = None
 
-    return find_path(ox_g, g, source_coord, best_projection.cinema.coordinates)
+    for node in p:
+        if type(node) == str:
+            act_line = node.split('_')
+            if prev_line is None or prev_line[0] != act_line[0]:
+                num += 1
+                prev_line = act_line
+    return num
 
 
 def menu_billboard(bill: Billboard) -> None:
@@ -297,10 +367,9 @@ def display_main_menu() -> str:
 def main() -> None:
     print('Please write the number that corresponds to the information you want to acces in the menu.')
     print()
-    bill = read()
-    g_ox = None
-    g_buses = None
-    g_city = None
+    # the billboard and the graphs start to be read while the user chooses an option
+    get_loading()
+    tables = None
 
     while True:
         choice = display_main_menu()
@@ -314,44 +383,35 @@ def main() -> None:
             # Show billboard
             print(
                 'PLEASE, IN ORDER TO SEE THE INFORMATION PROPERLY, REDUCE THE SIZE OF THE TERMINAL USING CTRL- ')
-            menu_billboard(bill)
+            menu_billboard(get_billboard())
             print()
 
         elif choice == 3:
             # Show the bus graph
             print(
                 'REMEMBER TO CLOSE THE SCREEN OF THE GRAPH IF YOU WANT TO CONTINUE USING THIS INTERFACE')
-            create_graph('3')
+            buses.show_buses(get_loading().get_buses())
             print()
 
         elif choice == 4:
             # Save an image of the buses graph in your computer
             print(
                 'Wait for the image to be saved in your computer. This can take some time. ')
-            create_graph('4')
+            buses.plot_buses(get_loading().get_buses(), 'graf_buses_bcn.png')
             print()
 
         elif choice == 5:
             # show the city graph interactively
-            if g_buses is None:
-                print("Wait a minute, the city graph is creating...")
-                g_buses = get_buses_graph()
-            g_ox = get_osmnx_graph()
-            g_city = build_city_graph(g_ox, g_buses)
-            show(g_city)
+            g_ox, g_buses, g_city = get_graphs("Wait a minute, the city graph is creating...")
+            city.show(g_city)
             print(
                 'PLEASE, TO CONTINUE NAVIGATING THROUGH THE MENU, CLOSE THE GRAPH WINDOW.')
 
         elif choice == 6:
             # Saves an image of the city graph in your computer
-            if g_buses == None:
-                print(
-                    "Wait a minute, the city graph is being created... The image will appear as a new file in this same directory.")
-                g_buses = get_buses_graph()
-            if g_city == None:
-                g_ox = get_osmnx_graph()
-                g_city = build_city_graph(g_ox, g_buses)
-            plot(g_city, 'bcn_city_graph.png')
+            g_ox, g_buses, g_city = get_graphs(
+                "Wait a minute, the city graph is being created... The image will appear as a new file in this same directory.")
+            city.plot(g_city, 'bcn_city_graph.png')
 
         elif choice == 7:
             # show the shortest path to see a movie
@@ -359,6 +419,7 @@ def main() -> None:
             print("Enter the title of the film you are interested in")
             title = input()
 
+            bill = get_billboard()
             projec_filtered = bill.filter_title(title)
 
             if len(projec_filtered) == 0:
@@ -369,41 +430,36 @@ def main() -> None:
 
                 adress = input()
 
-                location = get_coordinates(adress.strip())
+                location = billboard.get_coordinates(adress.strip())
+
+                g_ox, g_buses, g_city = get_graphs("Wait a minute, the city graph is creating...")
 
-                if g_ox is None:
-                    g_ox = get_osmnx_graph()
-                if g_buses is None:
-                    g_buses = get_buses_graph()
-                if g_city is None:
-                    g_city = build_city_graph(g_ox, g_buses)
+                if PRECOMPUTE_CINEMAS and tables is None:
+                    tables = city.get_cinema_tables(g_ox, g_city, {
+                        c.name: c.coordinates for c in bill.cinemas})
 
-                p = best_path(projec_filtered, g_ox, g_city, location)
+                p = best_path(bill, title, g_ox, g_city,
+                              location, tables)
 
                 if p is None:
                     print(
                         'THERE IS NO PATH TO ARRIVE TO THE FILM AT TIME. MAYBE YOU COULD TRY TOMORROW!')
                 else:
-                    num = 0
-                    prev_line = None
-
-                    for node in p:
-                        if type(node) == str:
-                            act_line = node.split('_')
-                            if prev_line is None or prev_line[0] != act_line[0]:
-                                num += 1
-                                prev_line = act_line
+                    num = count_buses(p)
                     if num > 0:
                         print("You need to take", num,
                               "different buses to arrive to your selected cinema.")
                     else:
                         print(
                             "You don't need to take any bus. The route is all walking.")
-                    plot_path(g_city, p, 'path.png')
+                    city.plot_path(g_city, p, 'path.png')
                     print('CHECK THE DIRECTORY TO SEE THE PATH')
 
         elif choice == 0:
             # Exit the program
+            if metrics.enabled:
+                metrics.save(METRICS_FILE)
+                print("The times of each stage are saved in", METRICS_FILE)
             print("Exiting... See you soon!")
             break
         else:
@@ -0,0 +1,207 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from email.utils import formatdate
+from os.path import join, isfile, getmtime, abspath, normpath, commonpath
+from typing import Any
+import html
+import math
+import json
+import random
+import hashlib
+import threading
+import networkx as nx
+
+
+LAT0, LON0 = 41.36, 2.10  # the south-west corner of the generated city, in Barcelona
+GENRES = ['Drama', 'Comedia', 'Acción', 'Terror', 'Animación', 'Aventura', 'Ciencia ficción', 'Documental']
+
+
+class FixtureServer:
+    """
+    Local http server that stands in for the websites in tests. It serves the files of a directory:
+    a request with ?page=i (or to a path ending in '/') gets page_i.html, and any other path gets the file with its name.
+    Use it as read(base_url=server.url). The answers have ETag and Last-Modified, and the
+    conditional requests get a 304 when the file has not changed
+    """
+
+    def __init__(self, directory: str, port: int = 0) -> None:
+        self.directory = abspath(directory)
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                server.serve(self)
+
+            def log_message(self, format: str, *args) -> None:
+                pass  # the tests do not need a line for each request
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def filename(self, path: str) -> str | None:
+        """
+        Returns the file of the directory that answers the request to path, or None if the path
+        goes out of the directory
+        """
+
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        if 'page' in query or url.path.endswith('/'):
+            filename = join(self.directory, f"page_{query.get('page', ['1'])[0]}.html")
+        else:
+            filename = join(self.directory, unquote(url.path).lstrip('/'))
+
+        filename = normpath(filename)
+        if commonpath([self.directory, filename]) != self.directory:
+            return None
+        return filename
+
+    def serve(self, request: BaseHTTPRequestHandler) -> None:
+        filename = self.filename(request.path)
+        if filename is None or not isfile(filename):
+            request.send_error(404)
+            return
+
+        with open(filename, 'rb') as file:
+            content = file.read()
+
+        etag = '"' + hashlib.sha1(content).hexdigest() + '"'
+        last_modified = formatdate(getmtime(filename), usegmt=True)
+
+        if request.headers.get('If-None-Match') == etag:
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+
+        request.send_response(200)
+        request.send_header('ETag', etag)
+        request.send_header('Last-Modified', last_modified)
+        request.send_header('Content-Length', str(len(content)))
+        request.end_headers()
+        request.wfile.write(content)
+
+    def start(self) -> 'FixtureServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'FixtureServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def street_grid(size: int, step: float = 0.0008, seed: int = 0) -> nx.MultiDiGraph:
+    """
+    Generates a graph like the one of osmnx: size x size crossroads in a grid, step degrees apart, with a
+    street in both ways between each two neighbours. With size 100 it is as big as the streets of Barcelona
+    """
+
+    rng = random.Random(seed)
+    g = nx.MultiDiGraph(crs='epsg:4326')
+    for i in range(size):
+        for j in range(size):
+            g.add_node(i * size + j + 1, y=LAT0 + i * step, x=LON0 + j * step)
+
+    for i in range(size):
+        for j in range(size):
+            u = i * size + j + 1
+            for di, dj in ((0, 1), (1, 0)):
+                if i + di < size and j + dj < size:
+                    v = (i + di) * size + j + dj + 1
+                    length = rng.uniform(60, 120)
+                    name = f'Carrer {i}' if di == 0 else f'Avinguda {j}'
+                    g.add_edge(u, v, length=length, name=name)
+                    g.add_edge(v, u, length=length, name=name)
+    return g
+
+
+def random_position(rng: random.Random, size: int, step: float) -> tuple[float, float]:
+    return (LAT0 + rng.uniform(0, (size - 1) * step), LON0 + rng.uniform(0, (size - 1) * step))
+
+
+def amb_payload(lines: int, stops: int, size: int, step: float = 0.0008, seed: int = 0) -> dict[str, Any]:
+    """
+    Generates a payload of AMB with the given number of lines and stops in each one, inside the street grid
+    of that size. Each line is a random walk with its stops about 3 crossroads apart, as in a real line,
+    and it has a last stop outside Barcelona, that has to be filtered out
+    """
+
+    rng = random.Random(seed)
+    top = (size - 1) * step
+    linies = []
+    for line in range(lines):
+        lat, lon = random_position(rng, size, step)
+        heading = rng.uniform(0, 2 * math.pi)
+        parades = []
+        for order in range(stops + 1):
+            parades.append({'IdLinia': 100 + line, 'Ordre': order + 1, 'UTM_X': lat, 'UTM_Y': lon,
+                            'Nom': f'Parada {line}-{order}',
+                            'Municipi': 'Barcelona' if order < stops else "L'Hospitalet de Llobregat"})
+            heading += rng.gauss(0, 0.5)
+            distance = rng.uniform(2, 4) * step
+            lat = min(max(lat + distance * math.sin(heading), LAT0), LAT0 + top)
+            lon = min(max(lon + distance * math.cos(heading), LON0), LON0 + top)
+        linies.append({'Nom': f'L{line}', 'Parades': {'Parada': parades}})
+    return {'ObtenirDadesAMBResult': {'Linies': {'Linia': linies}}}
+
+
+def write_amb_payload(filename: str, lines: int, stops: int, size: int, step: float = 0.0008, seed: int = 0) -> None:
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(amb_payload(lines, stops, size, step, seed), file)
+
+
+def billboard_page(cinemas: list[tuple[str, str]], films: int, sessions: int, rng: random.Random) -> str:
+    """
+    Generates a page of the billboard of Sensacine with the elements that parse_page reads
+    """
+
+    out = ['<html><head><meta charset="utf-8"></head><body>']
+    for name, address in cinemas:
+        out.append(f'<div class="theater"><h2><a class="no_underline j_entities" href="#">{html.escape(name)}</a></h2>')
+        out.append(f'<span class="lighten">Cine</span><span class="lighten"> {html.escape(address)} </span>')
+        for f in rng.sample(range(films), min(films, 8)):
+            theater = html.escape(json.dumps({'name': name + ' '}))
+            movie = html.escape(json.dumps({'title': f'Film {f}', 'genre': [GENRES[f % len(GENRES)], GENRES[f % 3]],
+                                            'directors': [f'Director {f}'], 'actors': [f'Actor {f}', f'Actor {f + 1}'],
+                                            'id': str(f)}))
+            language = ' Versión Original' if f % 3 == 0 else ' Versión Doblada'
+            hours = ' '.join(f'<em>{h:02d}:{rng.randrange(0, 60, 5):02d}</em>'
+                             for h in sorted(rng.sample(range(10, 24), sessions)))
+            out.append(f'<div class="item_resa"><div class="j_w" data-theater="{theater}" data-movie="{movie}"></div>'
+                       f'<span class="bold">{language}</span><p>{hours}</p></div>')
+        out.append('</div>')
+    out.append('</body></html>')
+    return '\n'.join(out)
+
+
+def write_billboard(directory: str, cinemas: int, films: int, pages: int, size: int,
+                    step: float = 0.0008, sessions: int = 4, seed: int = 0) -> str:
+    """
+    Writes the pages of a billboard in directory as page_i.html, to be served by FixtureServer, and a gazetteer
+    with the position of each cinema inside the street grid of that size. Returns the name of the gazetteer.
+    The addresses are not changed by normalize_address, so they are the keys of the gazetteer as they are
+    """
+
+    rng = random.Random(seed)
+    names = [(f'Cine {c}', f'Carrer del Cine {c}, {c + 1}, 08001 Barcelona') for c in range(cinemas)]
+    for page in range(pages):
+        with open(join(directory, f'page_{page + 1}.html'), 'w', encoding='utf-8') as file:
+            file.write(billboard_page(names[page::pages], films, sessions, rng))
+
+    gazetteer = join(directory, 'gazetteer.json')
+    with open(gazetteer, 'w', encoding='utf-8') as file:
+        json.dump({address: random_position(rng, size, step) for _, address in names}, file)
+    return gazetteer
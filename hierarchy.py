@@ -0,0 +1,253 @@
+from dataclasses import dataclass, field
+from typing import Any
+import heapq
+import networkx as nx
+import numpy as np
+from routing import CompiledGraph, compile_graph, register_backend
+from atomic import atomic_write
+
+
+HIERARCHY_KEY = 'hierarchy'  # key of the contraction hierarchy in the dictionary g.graph
+WITNESS_LIMIT = 500  # the maximum number of nodes settled by each witness search
+
+
+@dataclass
+class Hierarchy:
+    """
+    Class that stores the contraction hierarchy of a compiled graph. Every node has a rank, and the upward
+    graph has, for each node, the edges and shortcuts to the nodes of higher rank. A shortcut has the node
+    it skips as middle, and it is -1 for the edges of the graph
+    """
+
+    rank: np.ndarray  # int32, the order in which each node was contracted
+    indptr: np.ndarray  # int32, where the upward edges of each node start
+    indices: np.ndarray  # int32, the node of higher rank of each upward edge
+    times: np.ndarray  # float64, the time of each upward edge
+    middle: np.ndarray  # int32, the node skipped by each shortcut, or -1
+    up: list[dict[int, tuple[float, int]]] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        indptr, indices, times, middle = (self.indptr.tolist(), self.indices.tolist(),
+                                          self.times.tolist(), self.middle.tolist())
+        self.up = [{indices[e]: (times[e], middle[e]) for e in range(indptr[u], indptr[u + 1])}
+                   for u in range(len(indptr) - 1)]
+
+    def save(self, filename: str) -> None:
+        """
+        Saves the hierarchy in a numpy file
+        """
+
+        with atomic_write(filename) as file:
+            np.savez(file, rank=self.rank, indptr=self.indptr, indices=self.indices,
+                     times=self.times, middle=self.middle)
+
+    def query(self, source: int, target: int) -> tuple[float, list[int]]:
+        """
+        Bidirectional search over the upward graph from source and target. Returns the time and
+        the path between them, with the shortcuts unpacked. The time is inf if there is no path
+        """
+
+        dists = ({source: 0.0}, {target: 0.0})
+        preds = ({source: -1}, {target: -1})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        settled: tuple[set[int], set[int]] = (set(), set())
+        best, meeting = float('inf'), -1
+
+        while heaps[0] or heaps[1]:
+            # the side with the smallest key goes on; the search ends when no key can improve the best time
+            side = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, u = heapq.heappop(heaps[side])
+            if d >= best:
+                heaps[side].clear()
+                continue
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+
+            other = dists[1 - side].get(u)
+            if other is not None and d + other < best:
+                best, meeting = d + other, u
+
+            for v, (w, _) in self.up[u].items():
+                if d + w < dists[side].get(v, float('inf')):
+                    dists[side][v] = d + w
+                    preds[side][v] = u
+                    heapq.heappush(heaps[side], (d + w, v))
+
+        if meeting < 0:
+            return float('inf'), []
+
+        forward = [meeting]
+        while preds[0][forward[-1]] >= 0:
+            forward.append(preds[0][forward[-1]])
+        forward.reverse()
+        backward = [meeting]
+        while preds[1][backward[-1]] >= 0:
+            backward.append(preds[1][backward[-1]])
+
+        path = forward + backward[1:]
+        unpacked = [path[0]]
+        for a, b in zip(path, path[1:]):
+            self.unpack(a, b, unpacked)
+        return best, unpacked
+
+    def unpack(self, a: int, b: int, path: list[int]) -> None:
+        """
+        Appends to path the nodes of the edge from a to b after a, replacing each shortcut by the two edges it skips
+        """
+
+        stack = [(a, b)]
+        while stack:
+            a, b = stack.pop()
+            low, high = (a, b) if self.rank[a] < self.rank[b] else (b, a)
+            m = self.up[low][high][1]
+            if m < 0:
+                path.append(b)
+            else:
+                # the first half is unpacked before the second one
+                stack.append((m, b))
+                stack.append((a, m))
+
+
+def witness_distance(adj: list[dict[int, tuple[float, int]]], contracted: list[bool], source: int,
+                     targets: set[int], excluded: int, limit: float) -> dict[int, float]:
+    """
+    Dijkstra from source among the nodes not contracted yet and without excluded. It stops when
+    the targets are settled, when the distance goes over limit or after WITNESS_LIMIT nodes
+    """
+
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    pending = set(targets)
+    settled = 0
+    while heap and pending and settled < WITNESS_LIMIT:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        pending.discard(u)
+        for v, (w, _) in adj[u].items():
+            if v != excluded and not contracted[v] and d + w < dist.get(v, float('inf')):
+                dist[v] = d + w
+                heapq.heappush(heap, (d + w, v))
+    return dist
+
+
+def shortcuts_needed(adj: list[dict[int, tuple[float, int]]], contracted: list[bool], v: int) -> list[tuple[int, int, float]]:
+    """
+    Returns the shortcuts (u, w, time) that contracting v needs: the ones whose path through v
+    is shorter than any witness path that avoids it
+    """
+
+    neighbours = [u for u in adj[v] if not contracted[u]]
+    shortcuts: list[tuple[int, int, float]] = []
+
+    for i, u in enumerate(neighbours):
+        others = neighbours[i + 1:]
+        if not others:
+            continue
+        via = {w: adj[u][v][0] + adj[v][w][0] for w in others}
+        dist = witness_distance(adj, contracted, u, set(others), v, max(via.values()))
+        for w in others:
+            if dist.get(w, float('inf')) > via[w]:
+                shortcuts.append((u, w, via[w]))
+
+    return shortcuts
+
+
+def build_hierarchy(c: CompiledGraph) -> Hierarchy:
+    """
+    Contracts the nodes of the compiled graph one by one, ordered by their edge difference (the shortcuts
+    they need minus their edges) and the number of their neighbours already contracted. The priorities
+    are updated lazily, when a node is the next to contract
+    """
+
+    n = len(c.nodes)
+    indptr, indices, times = c.adjacency
+    adj: list[dict[int, tuple[float, int]]] = [dict() for _ in range(n)]
+    for u in range(n):
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            if v not in adj[u] or times[e] < adj[u][v][0]:
+                adj[u][v] = (times[e], -1)
+
+    contracted = [False] * n
+    deleted_neighbours = [0] * n
+    rank = np.zeros(n, dtype=np.int32)
+
+    def priority(v: int) -> int:
+        degree = sum(1 for u in adj[v] if not contracted[u])
+        return len(shortcuts_needed(adj, contracted, v)) - degree + deleted_neighbours[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    up: list[list[tuple[int, float, int]]] = [[] for _ in range(n)]
+    order = 0
+
+    while heap:
+        _, v = heapq.heappop(heap)
+        if contracted[v]:
+            continue
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+
+        for u, w, t in shortcuts_needed(adj, contracted, v):
+            if w not in adj[u] or t < adj[u][w][0]:
+                adj[u][w] = (t, v)
+                adj[w][u] = (t, v)
+
+        # the edges that v still has go to nodes of higher rank
+        for u, (t, m) in adj[v].items():
+            if not contracted[u]:
+                up[v].append((u, t, m))
+                deleted_neighbours[u] += 1
+
+        contracted[v] = True
+        rank[v] = order
+        order += 1
+
+    up_indptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum([len(edges) for edges in up], out=up_indptr[1:])
+    flat = [edge for edges in up for edge in edges]
+    return Hierarchy(rank, up_indptr,
+                     np.array([e[0] for e in flat], dtype=np.int32),
+                     np.array([e[1] for e in flat], dtype=np.float64),
+                     np.array([e[2] for e in flat], dtype=np.int32))
+
+
+def load_hierarchy(filename: str) -> Hierarchy:
+    """
+    Loads the hierarchy saved with Hierarchy.save
+    """
+
+    with np.load(filename) as data:
+        return Hierarchy(data['rank'], data['indptr'], data['indices'], data['times'], data['middle'])
+
+
+class ChBackend:
+    """
+    Bidirectional search over the contraction hierarchy of the CityGraph, that has to be prepared before in g.graph
+    """
+
+    def search(self, g: nx.Graph, src: Any, dst: Any) -> tuple[CompiledGraph, float, list[int]]:
+        if HIERARCHY_KEY not in g.graph:
+            raise ValueError('The contraction hierarchy of the graph has not been prepared')
+        c = compile_graph(g)
+        time, path = g.graph[HIERARCHY_KEY].query(c.index[src], c.index[dst])
+        if not path:
+            raise nx.NetworkXNoPath(f'Node {dst} not reachable from {src}')
+        return c, time, path
+
+    def path(self, g: nx.Graph, src: Any, dst: Any) -> list[Any]:
+        c, _, path = self.search(g, src, dst)
+        return [c.nodes[i] for i in path]
+
+    def time(self, g: nx.Graph, src: Any, dst: Any) -> float:
+        return self.search(g, src, dst)[1]
+
+
+register_backend('ch', ChBackend())
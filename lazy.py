@@ -0,0 +1,41 @@
+from types import ModuleType
+from typing import Any
+import importlib
+import importlib.util
+import sys
+
+
+class LazyModule(ModuleType):
+    """
+    Stands for a module that is imported the first time one of its attributes is used. The import is
+    done by importlib, that holds a lock for each module, so it is safe when several threads use it at once
+    """
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(importlib.import_module(self.__name__), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        setattr(importlib.import_module(self.__name__), attr, value)
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Returns the module name without running it: it is imported the first time one of its attributes is used.
+    If it has been imported before, it is returned as it is
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    # only the top package is looked for, because finding a submodule would import its package
+    if importlib.util.find_spec(name.partition('.')[0]) is None:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    return LazyModule(name)
+
+
+def is_loaded(name: str) -> bool:
+    """
+    Checks if the module has been really imported, not only lazily
+    """
+
+    return name in sys.modules
@@ -0,0 +1,206 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, TypeVar
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+
+PREFIX = 'citybus_'  # the prefix of the names of the metrics in the Prometheus text
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# The metrics are only recorded when enabled, by set_enabled or with the environment variable CITYBUS_METRICS=1.
+# When they are not, each instrumented call only checks this flag
+enabled = os.environ.get('CITYBUS_METRICS', '') not in ('', '0')
+lock = threading.Lock()
+
+
+@dataclass
+class SpanStats:
+    """
+    Class that stores the times of all the runs of a span
+    """
+
+    count: int = 0
+    total: float = 0.0  # s
+    max: float = 0.0  # s
+    last: float = 0.0  # s
+
+
+spans: dict[str, SpanStats] = dict()
+counters: dict[str, float] = dict()
+gauges: dict[str, float] = dict()
+
+
+def set_enabled(value: bool) -> None:
+    """
+    Turns the recording of the metrics on or off. The metrics recorded before are kept
+    """
+
+    global enabled
+    enabled = value
+
+
+def reset() -> None:
+    with lock:
+        spans.clear()
+        counters.clear()
+        gauges.clear()
+
+
+def record(name: str, seconds: float) -> None:
+    with lock:
+        stats = spans.setdefault(name, SpanStats())
+        stats.count += 1
+        stats.total += seconds
+        stats.max = max(stats.max, seconds)
+        stats.last = seconds
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adds value to the counter name
+    """
+
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + value
+
+
+def gauge(name: str, value: float) -> None:
+    """
+    Sets the gauge name to value
+    """
+
+    if enabled:
+        with lock:
+            gauges[name] = value
+
+
+class Span:
+    """
+    Context manager that records the time of the block as a run of the span name
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        record(self.name, time.perf_counter() - self.start)
+
+
+class NullSpan:
+    """
+    The span given when the metrics are disabled, that does nothing
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> 'NullSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name: str) -> Span | NullSpan:
+    """
+    Returns a context manager that times the block: with metrics.span('city.snap'): ...
+    """
+
+    return Span(name) if enabled else NULL_SPAN
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """
+    Decorator that records each call of the function as a run of the span name
+    """
+
+    def decorator(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def snapshot() -> dict[str, Any]:
+    """
+    Returns a copy of all the metrics recorded
+    """
+
+    with lock:
+        return {'spans': {name: asdict(stats) for name, stats in spans.items()},
+                'counters': dict(counters), 'gauges': dict(gauges)}
+
+
+def to_json(indent: int | None = 1) -> str:
+    return json.dumps(snapshot(), indent=indent)
+
+
+def metric_name(name: str) -> str:
+    """
+    Returns the name as Prometheus accepts it: 'city.bus_edges' is 'citybus_city_bus_edges'
+    """
+
+    return PREFIX + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def to_prometheus(labels: dict[str, str] | None = None) -> str:
+    """
+    Returns the metrics in the text format of Prometheus. The spans are summaries with their count and sum
+    in seconds, and a gauge with the longest run. The labels are added to every sample
+    """
+
+    data = snapshot()
+    lines: list[str] = []
+    tags = ''
+    if labels:
+        tags = '{' + ','.join(f'{name}={json.dumps(str(value))}' for name, value in labels.items()) + '}'
+
+    for name, stats in sorted(data['spans'].items()):
+        metric = metric_name(name) + '_seconds'
+        lines.append(f'# TYPE {metric} summary')
+        lines.append(f'{metric}_count{tags} {stats["count"]}')
+        lines.append(f'{metric}_sum{tags} {stats["total"]!r}')
+        lines.append(f'# TYPE {metric}_max gauge')
+        lines.append(f'{metric}_max{tags} {stats["max"]!r}')
+
+    for name, value in sorted(data['counters'].items()):
+        metric = metric_name(name) + '_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric}{tags} {value!r}')
+
+    for name, value in sorted(data['gauges'].items()):
+        metric = metric_name(name)
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric}{tags} {value!r}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def save(filename: str) -> None:
+    """
+    Saves the metrics in filename: as Prometheus text if it ends in .prom and as json otherwise
+    """
+
+    with open(filename, 'w') as file:
+        file.write(to_prometheus() if filename.endswith('.prom') else to_json())
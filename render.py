@@ -0,0 +1,279 @@
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from io import BytesIO
+import os
+import numpy as np
+import requests
+from PIL import Image, ImageColor
+import metrics
+from atomic import atomic_write
+from web import make_session
+
+
+TILE_URL = 'https://a.tile.openstreetmap.org/{z}/{x}/{y}.png'
+TILE_SIZE = 256  # px
+TILE_CACHE = 'tiles'  # directory where the tiles are kept as TILE_CACHE/z/x/y.png
+TILE_WORKERS = 4
+TILE_TIMEOUT = 10  # s
+HEADERS = {'User-Agent': 'StaticMap'}
+BACKGROUND = (255, 255, 255)
+MAX_ZOOM = 17
+CHUNK = 1 << 21  # the maximum number of pixels painted in each pass
+RENDERER = 'raster'  # 'raster' paints with numpy on a Canvas, 'staticmap' adds one object for each node and edge
+
+offline = False  # when it is True the tiles are only read from the cache
+
+
+def set_offline(value: bool) -> None:
+    """
+    Sets whether the tiles that are not in the cache are downloaded (False) or left blank (True)
+    """
+
+    global offline
+    offline = value
+
+
+def lon_to_x(lons: Iterable[float], zoom: int) -> np.ndarray:
+    """
+    Returns the x of each longitude in tiles of the given zoom, as staticmap does
+    """
+
+    lons = np.asarray(lons, dtype=np.float64)
+    return (lons + 180.0) / 360.0 * 2.0 ** zoom
+
+
+def lat_to_y(lats: Iterable[float], zoom: int) -> np.ndarray:
+    """
+    Returns the y of each latitude in tiles of the given zoom, as staticmap does
+    """
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    return (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / np.pi) / 2.0 * 2.0 ** zoom
+
+
+def disk(radius: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the offsets (dx, dy) of the pixels of a filled circle of the given radius
+    """
+
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx ** 2 + dy ** 2 <= max(radius, 0.5) ** 2
+    return dx[inside], dy[inside]
+
+
+def brush(width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the offsets (dx, dy) of the pixels painted around each point of a line of the given width
+    """
+
+    if width <= 1:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    return disk(width / 2)
+
+
+def rasterize(x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the pixels of all the segments from (x0, y0) to (x1, y1) at once: each segment is
+    sampled at one point for each pixel of its longest side
+    """
+
+    steps = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)).astype(np.int64)
+    counts = steps + 1
+    segment = np.repeat(np.arange(len(steps)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(counts.sum()) - starts[segment]) / np.maximum(steps, 1)[segment]
+    xs = np.rint(x0[segment] + t * (x1 - x0)[segment]).astype(np.int64)
+    ys = np.rint(y0[segment] + t * (y1 - y0)[segment]).astype(np.int64)
+    return xs, ys
+
+
+def tile_path(z: int, x: int, y: int) -> str:
+    return os.path.join(TILE_CACHE, str(z), str(x), f'{y}.png')
+
+
+def get_tile(session: requests.Session | None, z: int, x: int, y: int) -> Image.Image | None:
+    """
+    Returns the tile from the cache, or downloads it and keeps it there. Returns None if it
+    is not in the cache and it cannot be downloaded
+    """
+
+    filename = tile_path(z, x, y)
+    if os.path.exists(filename):
+        metrics.count('render.tile_cache_hits')
+        return Image.open(filename).convert('RGB')
+    if session is None:
+        metrics.count('render.tile_misses')
+        return None
+
+    try:
+        r = session.get(TILE_URL.format(z=z, x=x, y=y), timeout=TILE_TIMEOUT)
+    except requests.RequestException:
+        r = None
+    if r is None or r.status_code != 200:
+        metrics.count('render.tile_misses')
+        return None
+    metrics.count('render.tile_downloads')
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with atomic_write(filename) as file:
+        file.write(r.content)
+    return Image.open(BytesIO(r.content)).convert('RGB')
+
+
+def fit_zoom(lons: Iterable[float], lats: Iterable[float], width: int, height: int,
+             padding: int = 0) -> tuple[int, float, float, float, float]:
+    """
+    Returns the highest zoom where all the points fit in width x height, the center of the points in tiles
+    of that zoom and the width and height in px that they take, as staticmap chooses them
+    """
+
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    west, east, south, north = lons.min(), lons.max(), lats.min(), lats.max()
+
+    zoom, w, h = 0, 0.0, 0.0
+    for z in range(MAX_ZOOM, -1, -1):
+        w = float((lon_to_x([east], z) - lon_to_x([west], z))[0]) * TILE_SIZE
+        h = float((lat_to_y([south], z) - lat_to_y([north], z))[0]) * TILE_SIZE
+        if w <= width - 2 * padding and h <= height - 2 * padding:
+            zoom = z
+            break
+
+    x_center = float(lon_to_x([(west + east) / 2], zoom)[0])
+    y_center = float(lat_to_y([(south + north) / 2], zoom)[0])
+    return zoom, x_center, y_center, w, h
+
+
+@dataclass
+class Canvas:
+    """
+    Class that stores an image of the map as an array of pixels. The positions are projected as staticmap
+    does, and the points and lines are painted with numpy in a few passes, instead of one object for each
+    """
+
+    width: int
+    height: int
+    zoom: int
+    x_center: float  # in tiles
+    y_center: float  # in tiles
+    pixels: np.ndarray = field(init=False, repr=False)  # uint8, height x width x 3
+
+    def __post_init__(self) -> None:
+        self.pixels = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.pixels[:] = BACKGROUND
+
+    @classmethod
+    def fit(cls, lons: Iterable[float], lats: Iterable[float], width: int, height: int, padding: int = 0) -> 'Canvas':
+        """
+        Returns the canvas with the highest zoom where all the points fit, centered in them
+        """
+
+        return cls(width, height, *fit_zoom(lons, lats, width, height, padding)[:3])
+
+    @classmethod
+    def around(cls, lons: Iterable[float], lats: Iterable[float], width: int, height: int, padding: int = 0) -> 'Canvas':
+        """
+        Returns the canvas cropped to the points: the zoom is the one of fit with width x height,
+        but the canvas is only as big as the box of the points and the padding
+        """
+
+        zoom, x_center, y_center, w, h = fit_zoom(lons, lats, width, height, padding)
+        return cls(min(width, int(np.ceil(w)) + 2 * padding + 1), min(height, int(np.ceil(h)) + 2 * padding + 1),
+                   zoom, x_center, y_center)
+
+    def to_pixels(self, lons: Iterable[float], lats: Iterable[float]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the column and the row of the canvas of each point
+        """
+
+        xs = np.rint((lon_to_x(lons, self.zoom) - self.x_center) * TILE_SIZE + self.width / 2)
+        ys = np.rint((lat_to_y(lats, self.zoom) - self.y_center) * TILE_SIZE + self.height / 2)
+        return xs.astype(np.int64), ys.astype(np.int64)
+
+    def stamp(self, xs: np.ndarray, ys: np.ndarray, offsets: tuple[np.ndarray, np.ndarray], color: str) -> None:
+        """
+        Paints the offsets around each pixel (xs, ys) with color. The pixels outside the canvas are dropped
+        """
+
+        rgb = ImageColor.getrgb(color)[:3]
+        dx, dy = offsets
+        step = max(1, CHUNK // len(dx))
+        for first in range(0, len(xs), step):
+            px = (xs[first:first + step, None] + dx).ravel()
+            py = (ys[first:first + step, None] + dy).ravel()
+            inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+            self.pixels[py[inside], px[inside]] = rgb
+
+    def draw_points(self, lons: Iterable[float], lats: Iterable[float], color: str, radius: float) -> None:
+        """
+        Paints a filled circle at each point
+        """
+
+        xs, ys = self.to_pixels(lons, lats)
+        self.stamp(xs, ys, disk(radius), color)
+
+    def draw_segments(self, lons0: Iterable[float], lats0: Iterable[float],
+                      lons1: Iterable[float], lats1: Iterable[float], color: str, width: int) -> None:
+        """
+        Paints a line from each point (lons0, lats0) to the point (lons1, lats1) in the same position
+        """
+
+        x0, y0 = self.to_pixels(lons0, lats0)
+        x1, y1 = self.to_pixels(lons1, lats1)
+        offsets = brush(width)
+        # the segments are rasterized in groups, so the pixels of all of them are never in memory at once
+        groups = np.cumsum(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)) + 1) // CHUNK
+        cuts = [0] + (np.flatnonzero(np.diff(groups)) + 1).tolist() + [len(x0)]
+        for first, last in zip(cuts, cuts[1:]):
+            if last > first:
+                xs, ys = rasterize(x0[first:last], y0[first:last], x1[first:last], y1[first:last])
+                self.stamp(xs, ys, offsets, color)
+
+    def draw_polyline(self, lons: Iterable[float], lats: Iterable[float], color: str, width: int) -> None:
+        """
+        Paints a line through all the points, in order
+        """
+
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        self.draw_segments(lons[:-1], lats[:-1], lons[1:], lats[1:], color, width)
+
+    @metrics.timed('render.tiles')
+    def draw_base(self) -> None:
+        """
+        Paints the tiles of the map under the canvas. They are read from the cache and the missing ones
+        are downloaded at the same time, unless offline is set; then the missing ones are left blank
+        """
+
+        half_w, half_h = 0.5 * self.width / TILE_SIZE, 0.5 * self.height / TILE_SIZE
+        max_tile = 2 ** self.zoom
+        tiles = [(x, y) for x in range(int(np.floor(self.x_center - half_w)), int(np.ceil(self.x_center + half_w)))
+                 for y in range(int(np.floor(self.y_center - half_h)), int(np.ceil(self.y_center + half_h)))
+                 if 0 <= y < max_tile]
+
+        session = None if offline else make_session(pool_maxsize=TILE_WORKERS, headers=HEADERS)
+        with ThreadPoolExecutor(TILE_WORKERS) as executor:
+            images = executor.map(lambda t: get_tile(session, self.zoom, t[0] % max_tile, t[1]), tiles)
+            for (x, y), image in zip(tiles, images):
+                if image is not None:
+                    self.paste(x, y, np.asarray(image))
+
+    def paste(self, x: int, y: int, tile: np.ndarray) -> None:
+        """
+        Copies the tile (x, y) in its place of the canvas, cut by the borders
+        """
+
+        left = int(round((x - self.x_center) * TILE_SIZE + self.width / 2))
+        top = int(round((y - self.y_center) * TILE_SIZE + self.height / 2))
+        l, t = max(left, 0), max(top, 0)
+        r, b = min(left + tile.shape[1], self.width), min(top + tile.shape[0], self.height)
+        if l < r and t < b:
+            self.pixels[t:b, l:r] = tile[t - top:b - top, l - left:r - left]
+
+    def image(self) -> Image.Image:
+        return Image.fromarray(self.pixels)
+
+    def save(self, filename: str) -> None:
+        self.image().save(filename)
@@ -0,0 +1,417 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Protocol
+import heapq
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from atomic import atomic_write
+
+
+EDGE_TYPES: dict[str, int] = {'Carrer': 0, 'Bus': 1}  # code of each type of edge in the arrays
+COMPILED_KEY = 'compiled'  # key of the compiled graph in the dictionary g.graph
+LANDMARKS = 8  # the number of landmarks whose times give the lower bounds of A*
+
+
+@dataclass
+class CompiledGraph:
+    """
+    Class that stores a CityGraph as arrays in CSR form. Node i is nodes[i], and its
+    neighbours are indices[indptr[i]:indptr[i + 1]], with the times and types of the edges
+    in the same positions of times and types
+    """
+
+    nodes: list[Any]  # the node id of each index
+    index: dict[Any, int]  # the index of each node id
+    indptr: np.ndarray  # int32, where the edges of each node start
+    indices: np.ndarray  # int32, the node at the other side of each edge
+    times: np.ndarray  # float64, the time of each edge
+    types: np.ndarray  # uint8, the code of the type of each edge
+    pos: np.ndarray | None = None  # float64 (nodes x 2), the (latitude, longitude) of each node
+    matrix: sp.csr_matrix = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        n = len(self.nodes)
+        # explicit zeros are kept by csr_matrix, so edges of time 0 are still edges for dijkstra
+        self.matrix = sp.csr_matrix(
+            (self.times, self.indices, self.indptr), shape=(n, n))
+
+    @cached_property
+    def adjacency(self) -> tuple[list[int], list[int], list[float]]:
+        """
+        The arrays indptr, indices and times as python lists, which are faster to read one by one
+        """
+
+        return self.indptr.tolist(), self.indices.tolist(), self.times.tolist()
+
+    @cached_property
+    def landmarks(self) -> np.ndarray:
+        """
+        The times (landmarks x nodes) from a few landmarks to every node, inf where a node is not reached.
+        Each landmark is the node furthest from the ones chosen before, so they end up at the edges of the
+        city. They are computed once, with a search of scipy from each of them
+        """
+
+        rows: list[np.ndarray] = []
+        if not self.nodes:
+            return np.zeros((0, 0))
+        furthest = dijkstra(self.matrix, directed=True, indices=0)
+        for _ in range(min(LANDMARKS, len(self.nodes))):
+            landmark = int(np.argmax(np.where(np.isfinite(furthest), furthest, -1)))
+            rows.append(dijkstra(self.matrix, directed=True, indices=landmark))
+            furthest = rows[0] if len(rows) == 1 else np.minimum(furthest, rows[-1])
+        return np.array(rows)
+
+    def heuristic(self, target: int) -> np.ndarray:
+        """
+        Returns for every node the lower bound of its time to target, computed for all the nodes at once.
+        The graph is not directed, so by the triangle inequality no path from a node to target is shorter
+        than the difference of their times from any landmark
+        """
+
+        times = self.landmarks
+        if len(times) == 0:
+            return np.zeros(len(self.nodes))
+        to_target = times[:, target, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            bounds = np.where(np.isfinite(times) & np.isfinite(to_target), np.abs(times - to_target), 0.0)
+        return bounds.max(axis=0)
+
+    def path_to(self, predecessors: np.ndarray, target: int) -> list[Any]:
+        """
+        Returns the list of node ids from the source of the search to target
+        """
+
+        path: list[Any] = []
+        while target >= 0:
+            path.append(self.nodes[target])
+            target = predecessors[target]
+        path.reverse()
+        return path
+
+
+def compile_arrays(nodes: list[Any], u: np.ndarray, v: np.ndarray, times: np.ndarray, types: np.ndarray,
+                   pos: np.ndarray | None = None) -> CompiledGraph:
+    """
+    Builds the CompiledGraph of a not-directed graph given by the indices of the ends of its edges,
+    their times and their type codes. The positions of the nodes are optional
+    """
+
+    # Each edge of the not-directed graph is stored in both directions. Self-loops are useless for routing
+    keep = u != v
+    u, v = np.asarray(u[keep], dtype=np.int32), np.asarray(v[keep], dtype=np.int32)
+    times = np.asarray(times[keep], dtype=np.float64)
+    types = np.asarray(types[keep], dtype=np.uint8)
+
+    src, dst = np.concatenate([u, v]), np.concatenate([v, u])
+    times, types = np.concatenate([times, times]), np.concatenate([types, types])
+
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+
+    index = {node: i for i, node in enumerate(nodes)}
+    return CompiledGraph(nodes, index, indptr, dst[order], times[order], types[order],
+                         None if pos is None else np.asarray(pos, dtype=np.float64))
+
+
+def compile_graph(g: nx.Graph) -> CompiledGraph:
+    """
+    Compiles the CityGraph g to arrays. The result is kept in g.graph, so it is only done once per graph
+    """
+
+    if COMPILED_KEY in g.graph:
+        return g.graph[COMPILED_KEY]
+
+    nodes = list(g.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+
+    edges = [(index[u], index[v], data['time'], EDGE_TYPES[data['type']])
+             for u, v, data in g.edges(data=True)]
+    u = np.array([e[0] for e in edges], dtype=np.int32)
+    v = np.array([e[1] for e in edges], dtype=np.int32)
+    times = np.array([e[2] for e in edges], dtype=np.float64)
+    types = np.array([e[3] for e in edges], dtype=np.uint8)
+
+    pos = np.array([g.nodes[n]['pos'] for n in nodes], dtype=np.float64).reshape(-1, 2)
+
+    compiled = compile_arrays(nodes, u, v, times, types, pos)
+    g.graph[COMPILED_KEY] = compiled
+    return compiled
+
+
+@dataclass
+class Reach:
+    """
+    Class that stores the result of a search from one source to many targets
+    """
+
+    compiled: CompiledGraph
+    targets: list[Any]  # the node of each target
+    times: list[float]  # the time to each target, inf if it can not be reached
+    predecessors: dict[int, int]  # the previous index of each settled index in its shortest path
+    settled: int = 0  # the number of nodes settled by the search
+
+    def path(self, i: int) -> list[Any]:
+        """
+        Returns the shortest path from the source to the i-th target
+        """
+
+        if self.times[i] == float('inf'):
+            raise nx.NetworkXNoPath(f'Node {self.targets[i]} not reachable')
+
+        c = self.compiled
+        path: list[Any] = []
+        u = c.index[self.targets[i]]
+        while u >= 0:
+            path.append(c.nodes[u])
+            u = self.predecessors[u]
+        path.reverse()
+        return path
+
+
+def one_to_many(g: nx.Graph, src: Any, targets: list[Any]) -> Reach:
+    """
+    Dijkstra from src over the compiled CityGraph that stops once all the targets are settled.
+    Returns the times and the predecessors of the search, so that any of the paths can be built
+    """
+
+    c = compile_graph(g)
+    indptr, indices, times = c.adjacency
+    source = c.index[src]
+
+    dist: dict[int, float] = {source: 0.0}
+    pred: dict[int, int] = {source: -1}
+    settled: set[int] = set()
+    pending = {c.index[t] for t in targets}
+    heap = [(0.0, source)]
+
+    while heap and pending:
+        d, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        pending.discard(u)
+
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d + times[e]
+            if v not in settled and nd < dist.get(v, float('inf')):
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(heap, (nd, v))
+
+    inf = float('inf')
+    found = [dist[c.index[t]] if c.index[t] in settled else inf for t in targets]
+    return Reach(c, list(targets), found, pred, len(settled))
+
+
+@dataclass
+class CinemaTables:
+    """
+    Class that stores, for each cinema, the time from every node of the compiled graph to it
+    and the next node of the shortest path towards it. The times are float32 to halve the size of the
+    tables, so they differ from the ones of a search by up to about 1e-7 of the time (some 1e-5 s)
+    """
+
+    names: list[str]  # the name of each cinema
+    targets: list[Any]  # the node of each cinema
+    times: np.ndarray  # float32 (cinemas x nodes), the time from each node to each cinema
+    next_nodes: np.ndarray  # int32 (cinemas x nodes), the next index towards each cinema, negative at the cinema
+
+    def reach_from(self, g: nx.Graph, src: Any) -> 'TableReach':
+        """
+        Returns the times from src to every cinema, reading the column of src
+        """
+
+        c = compile_graph(g)
+        return TableReach(self, c, c.index[src])
+
+    def save(self, filename: str) -> None:
+        """
+        Saves the tables in a numpy file
+        """
+
+        with atomic_write(filename) as file:
+            np.savez(file, names=np.array(self.names, dtype=object),
+                     targets=np.array(self.targets, dtype=object),
+                     times=self.times, next_nodes=self.next_nodes)
+
+
+@dataclass
+class TableReach:
+    """
+    The times from one source to all the cinemas, read from the CinemaTables.
+    It can be used as the Reach of a search
+    """
+
+    tables: CinemaTables
+    compiled: CompiledGraph
+    source: int  # the index of the source
+
+    @property
+    def times(self) -> list[float]:
+        return self.tables.times[:, self.source].astype(float).tolist()
+
+    def path(self, i: int) -> list[Any]:
+        """
+        Returns the path from the source to the i-th cinema following its table
+        """
+
+        if np.isinf(self.tables.times[i, self.source]):
+            raise nx.NetworkXNoPath(f'Cinema {self.tables.names[i]} not reachable')
+
+        next_nodes = self.tables.next_nodes[i]
+        u = self.source
+        path = [self.compiled.nodes[u]]
+        while next_nodes[u] >= 0:
+            u = next_nodes[u]
+            path.append(self.compiled.nodes[u])
+        return path
+
+
+def precompute_cinema_tables(g: nx.Graph, names: list[str], targets: list[Any]) -> CinemaTables:
+    """
+    Does a search from each cinema over the compiled CityGraph. Since the graph is not directed,
+    the tree of each search gives the times and the paths from every node to the cinema
+    """
+
+    c = compile_graph(g)
+    dist, pred = dijkstra(c.matrix, directed=True, indices=[c.index[t] for t in targets],
+                          return_predecessors=True)
+    dist = np.atleast_2d(dist).astype(np.float32)
+    pred = np.atleast_2d(pred).astype(np.int32)
+    return CinemaTables(list(names), list(targets), dist, pred)
+
+
+def load_cinema_tables(filename: str) -> CinemaTables:
+    """
+    Loads the tables saved with CinemaTables.save
+    """
+
+    with np.load(filename, allow_pickle=True) as data:
+        return CinemaTables(data['names'].tolist(), data['targets'].tolist(), data['times'], data['next_nodes'])
+
+
+def astar(g: nx.Graph, src: Any, dst: Any) -> tuple[float, list[Any], int]:
+    """
+    A* from src to dst over the compiled CityGraph, with the lower bounds of the landmarks as heuristic.
+    Returns the time, the path and the number of nodes settled
+    """
+
+    c = compile_graph(g)
+    indptr, indices, times = c.adjacency
+    source, target = c.index[src], c.index[dst]
+    h = c.heuristic(target).tolist()
+
+    dist: dict[int, float] = {source: 0.0}
+    pred: dict[int, int] = {source: -1}
+    settled: set[int] = set()
+    heap = [(h[source], source)]
+
+    while heap:
+        _, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled.add(u)
+        if u == target:
+            break
+
+        d = dist[u]
+        for e in range(indptr[u], indptr[u + 1]):
+            v = indices[e]
+            nd = d + times[e]
+            if v not in settled and nd < dist.get(v, float('inf')):
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(heap, (nd + h[v], v))
+
+    if target not in settled:
+        raise nx.NetworkXNoPath(f'Node {dst} not reachable from {src}')
+
+    path: list[Any] = []
+    u = target
+    while u >= 0:
+        path.append(c.nodes[u])
+        u = pred[u]
+    path.reverse()
+    return dist[target], path, len(settled)
+
+
+class Backend(Protocol):
+    """
+    A way of finding shortest paths by time in a CityGraph
+    """
+
+    def path(self, g: nx.Graph, src: Any, dst: Any) -> list[Any]: ...
+
+    def time(self, g: nx.Graph, src: Any, dst: Any) -> float: ...
+
+
+class NetworkxBackend:
+    """
+    Dijkstra of networkx over the CityGraph itself. It is the reference to check the other backends
+    """
+
+    def path(self, g: nx.Graph, src: Any, dst: Any) -> list[Any]:
+        return nx.shortest_path(g, source=src, target=dst, weight='time')
+
+    def time(self, g: nx.Graph, src: Any, dst: Any) -> float:
+        return nx.shortest_path_length(g, source=src, target=dst, weight='time')
+
+
+class CsrBackend:
+    """
+    Dijkstra of scipy over the compiled arrays of the CityGraph
+    """
+
+    def search(self, g: nx.Graph, src: Any) -> tuple[CompiledGraph, np.ndarray, np.ndarray]:
+        c = compile_graph(g)
+        dist, pred = dijkstra(c.matrix, directed=True,
+                              indices=c.index[src], return_predecessors=True)
+        return c, dist, pred
+
+    def path(self, g: nx.Graph, src: Any, dst: Any) -> list[Any]:
+        c, dist, pred = self.search(g, src)
+        if np.isinf(dist[c.index[dst]]):
+            raise nx.NetworkXNoPath(f'Node {dst} not reachable from {src}')
+        return c.path_to(pred, c.index[dst])
+
+    def time(self, g: nx.Graph, src: Any, dst: Any) -> float:
+        c, dist, _ = self.search(g, src)
+        if np.isinf(dist[c.index[dst]]):
+            raise nx.NetworkXNoPath(f'Node {dst} not reachable from {src}')
+        return float(dist[c.index[dst]])
+
+
+class AstarBackend:
+    """
+    A* over the compiled arrays of the CityGraph, guided by the lower bounds of the times from a few landmarks
+    """
+
+    def path(self, g: nx.Graph, src: Any, dst: Any) -> list[Any]:
+        return astar(g, src, dst)[1]
+
+    def time(self, g: nx.Graph, src: Any, dst: Any) -> float:
+        return astar(g, src, dst)[0]
+
+
+BACKENDS: dict[str, Backend] = {'networkx': NetworkxBackend(), 'csr': CsrBackend(), 'astar': AstarBackend()}
+DEFAULT_BACKEND = 'csr'
+
+
+def register_backend(name: str, backend: Backend) -> None:
+    """
+    Makes a new routing backend available by its name
+    """
+
+    BACKENDS[name] = backend
+
+
+def get_backend(name: str | None = None) -> Backend:
+    """
+    Returns the backend with the given name, or the default one
+    """
+
+    return BACKENDS[name or DEFAULT_BACKEND]
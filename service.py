@@ -0,0 +1,464 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Callable, TYPE_CHECKING
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import signal
+import socket
+import sys
+import tempfile
+import metrics
+from lazy import lazy_import
+
+if TYPE_CHECKING:
+    from billboard import Billboard, Film, Cinema, Projection
+    from city import OsmnxGraph, CityGraph, CinemaTables
+    from buses import BusesGraph
+
+billboard = lazy_import('billboard')
+buses = lazy_import('buses')
+city = lazy_import('city')
+demo = lazy_import('demo')
+render = lazy_import('render')
+
+
+HOST = '127.0.0.1'
+PORT = 8000
+MAX_HEADER = 1 << 14  # bytes, the longest request line and headers accepted
+KEEP_ALIVE = 15  # s, the time an idle connection is kept open
+IMAGE_SIZE = 800  # px, the default width and height of /route.png
+MAX_IMAGE_SIZE = 2000  # px
+PARENT_CHECK = 1  # s, how often a worker checks that its parent is alive
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """
+    Error that is answered to the client with its status and message
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class State:
+    """
+    Class that stores what is loaded once, before the workers are forked, and shared by all the requests
+    """
+
+    bill: Billboard
+    g_ox: OsmnxGraph
+    g_buses: BusesGraph
+    g_city: CityGraph
+    tables: CinemaTables | None = None
+
+
+state: State | None = None
+
+
+def load_state(tables: bool = False) -> State:
+    """
+    Reads the billboard and the graphs as the demo does, from the caches in the working directory
+    or downloading them. The cinema tables are precomputed if tables is True
+    """
+
+    bill = billboard.read()
+    g_ox = city.get_osmnx_graph()
+    g_buses = buses.get_buses_graph()
+    g_city = city.get_city_graph(g_ox, g_buses)
+    cinema_tables = None
+    if tables:
+        cinema_tables = city.get_cinema_tables(g_ox, g_city, {c.name: c.coordinates for c in bill.cinemas})
+    return State(bill, g_ox, g_buses, g_city, cinema_tables)
+
+
+def fixture_state(size: int, directory: str) -> State:
+    """
+    Generates the fixtures of benchmark for a city of size x size crossroads in directory, that is also
+    where the caches are written, and builds the state from them without any access to the network
+    """
+
+    from benchmark import make_fixtures  # only the fixture mode needs the fixtures
+
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    render.set_offline(True)
+    billboard.geocode_cache = None
+
+    f = make_fixtures(size, directory)
+    try:
+        bill = billboard.read(base_url=f.server.url, pages=f.pages)
+    finally:
+        f.server.stop()
+    g_buses = buses.build_buses_graph(f.amb_file)
+    return State(bill, f.g1, g_buses, city.build_city_graph(f.g1, g_buses))
+
+
+def prepare(s: State) -> None:
+    """
+    Builds the structures that are otherwise built by the first query: the spatial index, the compiled graph
+    with its adjacency lists and the indexes of the billboard. Otherwise each worker would build its own copy,
+    and the first queries of a worker, which run in threads at once, would race to build them.
+    Then the objects that exist are moved out of the collector, so the forked workers do not write on
+    their pages when it runs, and the pages of the graphs stay shared with the parent
+    """
+
+    city.get_spatial_index(s.g_ox)
+    city.compile_graph(s.g_city).adjacency
+    s.bill.index
+    gc.collect()
+    gc.freeze()
+
+
+def film_json(film: Film) -> dict[str, Any]:
+    return {'id': film.id, 'title': film.title, 'genre': film.genre, 'director': film.director, 'actors': film.actors}
+
+
+def cinema_json(cinema: Cinema) -> dict[str, Any]:
+    return {'name': cinema.name, 'adress': cinema.adress, 'coordinates': list(cinema.coordinates)}
+
+
+def projection_json(projection: Projection) -> dict[str, Any]:
+    return {'film': projection.film.title, 'cinema': projection.cinema.name,
+            'time': f'{projection.time[0]:02d}:{projection.time[1]:02d}', 'language': projection.language}
+
+
+def param(query: dict[str, list[str]], name: str, required: bool = False) -> str | None:
+    values = query.get(name)
+    if not values:
+        if required:
+            raise HTTPError(400, f'Missing parameter {name}')
+        return None
+    return values[0]
+
+
+def number(query: dict[str, list[str]], name: str, default: float | None = None) -> float | None:
+    value = param(query, name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPError(400, f'The parameter {name} must be a number')
+
+
+def image_size(query: dict[str, list[str]], name: str) -> int:
+    """
+    Returns the size in px given by the parameter name, that must be a whole number from 1 to MAX_IMAGE_SIZE
+    """
+
+    value = number(query, name, IMAGE_SIZE)
+    if not math.isfinite(value) or value != int(value) or not 1 <= value <= MAX_IMAGE_SIZE:
+        raise HTTPError(400, f'The parameter {name} must be a whole number from 1 to {MAX_IMAGE_SIZE}')
+    return int(value)
+
+
+def parse_time(value: str | None) -> datetime | None:
+    """
+    Returns today at the time HH:MM, or None, that is now, if it is not given
+    """
+
+    if value is None:
+        return None
+    try:
+        return datetime.combine(datetime.now().date(), datetime.strptime(value, '%H:%M').time())
+    except ValueError:
+        raise HTTPError(400, 'The parameter at must be a time as HH:MM')
+
+
+def source(query: dict[str, list[str]]) -> tuple[float, float]:
+    """
+    Returns the coordinates of the origin of a route: lat and lon, or an address
+    """
+
+    lat, lon = number(query, 'lat'), number(query, 'lon')
+    if lat is not None and lon is not None:
+        return lat, lon
+    address = param(query, 'address')
+    if address is None:
+        raise HTTPError(400, 'Missing parameters lat and lon, or address')
+    try:
+        return billboard.get_coordinates(address.strip())
+    except Exception:
+        raise HTTPError(400, f'The address {address!r} cannot be found')
+
+
+def find_route(s: State, query: dict[str, list[str]]) -> tuple[Projection, list]:
+    title = param(query, 'title', required=True)
+    if not s.bill.filter_title(title):
+        raise HTTPError(404, f'There are no projections of {title!r} today')
+    found = demo.best_projection(s.bill, title, s.g_ox, s.g_city, source(query), s.tables,
+                                 parse_time(param(query, 'at')))
+    if found is None:
+        raise HTTPError(404, f'No projection of {title!r} can be reached in time')
+    return found
+
+
+def get_health(s: State, query: dict[str, list[str]]) -> Any:
+    return {'status': 'ok', 'pid': os.getpid(), 'films': len(s.bill.films), 'cinemas': len(s.bill.cinemas),
+            'projections': len(s.bill.projections), 'nodes': s.g_city.number_of_nodes()}
+
+
+def get_films(s: State, query: dict[str, list[str]]) -> Any:
+    films = s.bill.films
+    title, genre, actor = param(query, 'title'), param(query, 'genre'), param(query, 'actor')
+    if title is not None or genre is not None or actor is not None:
+        found = {p.film.id for p in s.bill.search(title=title, genre=genre, actor=actor)}
+        films = [film for film in films if film.id in found]
+    return [film_json(film) for film in films]
+
+
+def get_cinemas(s: State, query: dict[str, list[str]]) -> Any:
+    return [cinema_json(cinema) for cinema in s.bill.cinemas]
+
+
+def get_projections(s: State, query: dict[str, list[str]]) -> Any:
+    return [projection_json(p) for p in s.bill.search(title=param(query, 'title'), cinema=param(query, 'cinema'),
+                                                        genre=param(query, 'genre'), actor=param(query, 'actor'))]
+
+
+def get_route(s: State, query: dict[str, list[str]]) -> Any:
+    projection, path = find_route(s, query)
+    return {'projection': projection_json(projection), 'cinema': cinema_json(projection.cinema),
+            'buses': demo.count_buses(path), 'path': [list(s.g_city.nodes[node]['pos']) for node in path]}
+
+
+def get_route_png(s: State, query: dict[str, list[str]]) -> bytes:
+    width, height = image_size(query, 'width'), image_size(query, 'height')
+    _, path = find_route(s, query)
+    out = BytesIO()
+    city.raster_path(s.g_city, path, width, height).image().save(out, format='PNG')
+    return out.getvalue()
+
+
+def get_metrics(s: State, query: dict[str, list[str]]) -> bytes:
+    """
+    Returns the metrics of the worker that takes the connection, not the ones of the whole service: each
+    forked worker counts its own requests. They are labelled with its pid, so the metrics of the same
+    worker can be told apart from the rest when they are scraped several times
+    """
+
+    return metrics.to_prometheus({'pid': str(os.getpid())}).encode()
+
+
+# each endpoint: the function that answers it, its content type and whether it searches in the graph,
+# so it runs in a thread and the connections of the worker are still served meanwhile
+ENDPOINTS: dict[str, tuple[Callable[[State, dict[str, list[str]]], Any], str, bool]] = {
+    '/health': (get_health, 'application/json', False),
+    '/films': (get_films, 'application/json', False),
+    '/cinemas': (get_cinemas, 'application/json', False),
+    '/projections': (get_projections, 'application/json', False),
+    '/route': (get_route, 'application/json', True),
+    '/route.png': (get_route_png, 'image/png', True),
+    '/metrics': (get_metrics, 'text/plain; version=0.0.4', False),
+}
+
+
+async def answer(method: str, target: str) -> tuple[int, str, bytes]:
+    """
+    Returns the status, the content type and the body of the answer to a request
+    """
+
+    url = urlsplit(target)
+    endpoint = ENDPOINTS.get(url.path)
+    try:
+        if endpoint is None:
+            raise HTTPError(404, f'Unknown path {url.path}')
+        if method not in ('GET', 'HEAD'):
+            raise HTTPError(405, f'Method {method} not allowed')
+        function, content_type, searches = endpoint
+        query = parse_qs(url.query)
+        metrics.count('service.requests')
+        with metrics.span('service' + url.path):
+            if searches:
+                result = await asyncio.to_thread(function, state, query)
+            else:
+                result = function(state, query)
+        body = result if isinstance(result, bytes) else json.dumps(result, ensure_ascii=False).encode()
+        return 200, content_type, body
+    except HTTPError as e:
+        return error_answer(e.status, e.message)
+    except Exception as e:
+        return error_answer(500, f'{type(e).__name__}: {e}')
+
+
+def error_answer(status: int, message: str) -> tuple[int, str, bytes]:
+    metrics.count(f'service.errors_{status}')
+    return status, 'application/json', json.dumps({'error': message}, ensure_ascii=False).encode()
+
+
+async def serve_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Answers the requests of a connection, one after another, while the client keeps it alive
+    """
+
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                return
+
+            lines = head.decode('latin-1').split('\r\n')
+            parts = lines[0].split()
+            if len(parts) != 3:
+                return
+            method, target, version = parts
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            connection = headers.get('connection', '').lower()
+            keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+
+            # the bodies are not used, but they are read so the next request starts at its place
+            try:
+                length = int(headers.get('content-length', '0') or 0)
+            except ValueError:
+                length = -1
+            if length >= 0:
+                if length:
+                    await reader.readexactly(length)
+                status, content_type, body = await answer(method, target)
+            else:
+                # where the next request starts is not known, so the connection is closed after the answer
+                keep_alive = False
+                status, content_type, body = error_answer(400, f"Invalid Content-Length {headers['content-length']!r}")
+
+            writer.write((f'{version} {status} {REASONS[status]}\r\n'
+                          f'Content-Type: {content_type}\r\n'
+                          f'Content-Length: {len(body)}\r\n'
+                          f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n').encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(body)
+            await writer.drain()
+            if not keep_alive:
+                return
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def watch_parent(parent: int) -> None:
+    """
+    Returns when the parent process is gone, so a worker does not keep serving alone after it is killed
+    """
+
+    while os.getppid() == parent:
+        await asyncio.sleep(PARENT_CHECK)
+
+
+async def serve(sock: socket.socket, parent: int | None = None) -> None:
+    server = await asyncio.start_server(serve_connection, sock=sock, limit=MAX_HEADER)
+    async with server:
+        if parent is None:
+            await server.serve_forever()
+        else:
+            await watch_parent(parent)
+
+
+def run_worker(sock: socket.socket, parent: int | None = None) -> None:
+    try:
+        asyncio.run(serve(sock, parent))
+    except KeyboardInterrupt:
+        pass
+
+
+def fork_worker(sock: socket.socket) -> int:
+    """
+    Forks a worker that serves the socket and returns its pid. The worker shares the memory of the parent,
+    so the graphs are not copied until some page of them is written
+    """
+
+    parent = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            run_worker(sock, parent)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def run(sock: socket.socket, workers: int) -> None:
+    """
+    Serves the socket with the given number of forked workers, forking a new one when some worker dies,
+    until the parent gets SIGTERM or SIGINT. With one worker the requests are served in this process
+    """
+
+    if workers <= 1:
+        run_worker(sock)
+        return
+
+    stopping = False
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    children = {fork_worker(sock) for _ in range(workers)}
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f'Worker {pid} died, forking another one', file=sys.stderr)
+            children.add(fork_worker(sock))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Serves the billboard and the best paths to the cinemas over HTTP')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT, help='0 takes a free port')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='forked processes that serve')
+    parser.add_argument('--tables', action='store_true', help='precomputes the times from every node to every cinema')
+    parser.add_argument('--fixtures', type=int, default=0, metavar='SIZE',
+                        help='serves generated fixtures of a city of SIZE x SIZE crossroads instead of Barcelona')
+    parser.add_argument('--fixtures-dir', help='where the fixtures are written, a temporary directory by default')
+    args = parser.parse_args()
+
+    global state
+    if args.fixtures > 0:
+        state = fixture_state(args.fixtures, args.fixtures_dir or tempfile.mkdtemp(prefix='citybus_'))
+        if args.tables:
+            state.tables = city.get_cinema_tables(state.g_ox, state.g_city,
+                                                  {c.name: c.coordinates for c in state.bill.cinemas})
+    else:
+        state = load_state(args.tables)
+    prepare(state)
+
+    sock = socket.create_server((args.host, args.port))
+    host, port = sock.getsockname()[:2]
+    print(f'Serving on http://{host}:{port} with {max(args.workers, 1)} workers', flush=True)
+    run(sock, args.workers)
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+from dataclasses import dataclass
+from typing import Any
+import json
+import struct
+import networkx as nx
+import numpy as np
+from routing import CompiledGraph, compile_graph, COMPILED_KEY
+from atomic import atomic_write
+
+
+MAGIC = b'CBSNAP\0\0'
+SNAPSHOT_VERSION = 2  # bump it when the arrays of the format change
+ALIGNMENT = 64  # every array starts at a multiple of it, so it can be viewed without copying
+
+NODE_TYPES: dict[str, int] = {'Cruilla': 0, 'Parada': 1}
+# The edges of the CityGraph: the streets, the links between a stop and its crossroad, and the buses
+STREET, ACCESS, BUS = 0, 1, 2
+
+
+@dataclass
+class Snapshot:
+    """
+    Class that stores the arrays of a snapshot file. When it is loaded with mmap they are views of the file,
+    so only the pages that are read are loaded in memory
+    """
+
+    kind: str  # 'city' or 'buses'
+    meta: dict[str, Any]  # the graph attributes of the graph, like its digest
+    arrays: dict[str, np.ndarray]
+
+    def strings(self, name: str) -> list[str]:
+        """
+        Returns the list of strings stored as the arrays name_offsets and name_data
+        """
+
+        offsets = self.arrays[name + '_offsets'].tolist()
+        data = self.arrays[name + '_data'].tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def node_ids(self) -> list[Any]:
+        """
+        Returns the id of each node: the int ones come from the street graph and the str ones are bus stops
+        """
+
+        ints = self.arrays['node_int'].tolist()
+        strs = self.strings('node_str')
+        return [strs[i] if kind else ints[i] for i, kind in enumerate(self.arrays['node_kind'].tolist())]
+
+
+def string_arrays(name: str, strings: list[str]) -> dict[str, np.ndarray]:
+    """
+    Stores a list of strings as the utf-8 bytes of all of them and the offset where each one starts
+    """
+
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.array([len(b) for b in encoded], dtype=np.int64), out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return {name + '_offsets': offsets, name + '_data': data}
+
+
+def node_arrays(nodes: list[Any]) -> dict[str, np.ndarray]:
+    """
+    Stores the ids of the nodes, that can be int or str
+    """
+
+    arrays = {
+        'node_kind': np.array([isinstance(n, str) for n in nodes], dtype=np.uint8),
+        'node_int': np.array([-1 if isinstance(n, str) else n for n in nodes], dtype=np.int64),
+    }
+    arrays.update(string_arrays('node_str', [n if isinstance(n, str) else '' for n in nodes]))
+    return arrays
+
+
+def save_snapshot(filename: str, kind: str, arrays: dict[str, np.ndarray], meta: dict[str, Any]) -> None:
+    """
+    Writes the arrays in a snapshot file: the magic, the version, the size of a json header that
+    describes each array, the header and then the raw arrays, each one aligned to ALIGNMENT bytes
+    """
+
+    descriptions: dict[str, dict[str, Any]] = dict()
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        descriptions[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({'kind': kind, 'meta': meta, 'arrays': descriptions}).encode('utf-8')
+    start = len(MAGIC) + 8 + len(header)
+    start = -(-start // ALIGNMENT) * ALIGNMENT
+
+    # the file is written with another name and renamed, so a half written snapshot is never loaded
+    with atomic_write(filename) as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<II', SNAPSHOT_VERSION, len(header)))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(start + descriptions[name]['offset'])
+            file.write(array.tobytes())
+        file.truncate(start + offset)
+
+
+def load_snapshot(filename: str, mmap: bool = True) -> Snapshot:
+    """
+    Reads a snapshot file. With mmap the arrays are read-only views of the mapped file, without any copy
+    """
+
+    with open(filename, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not a snapshot')
+        version, size = struct.unpack('<II', file.read(8))
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'{filename} has version {version} and {SNAPSHOT_VERSION} is expected')
+        header = json.loads(file.read(size).decode('utf-8'))
+
+    start = -(-(len(MAGIC) + 8 + size) // ALIGNMENT) * ALIGNMENT
+    if mmap:
+        buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.fromfile(filename, dtype=np.uint8)
+
+    arrays: dict[str, np.ndarray] = dict()
+    for name, d in header['arrays'].items():
+        dtype = np.dtype(d['dtype'])
+        count = int(np.prod(d['shape'], dtype=np.int64))
+        first = start + d['offset']
+        arrays[name] = buffer[first:first + count * dtype.itemsize].view(dtype).reshape(d['shape'])
+
+    return Snapshot(header['kind'], header['meta'], arrays)
+
+
+def city_to_snapshot(G: nx.Graph) -> dict[str, np.ndarray]:
+    """
+    Converts the CityGraph to arrays. The names of the edges are stored as json, because osmnx gives lists for some streets.
+    The arrays of its CompiledGraph are stored too, so routing can read them from the file as they are
+    """
+
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    arrays = node_arrays(nodes)
+    arrays['node_type'] = np.array([NODE_TYPES[G.nodes[n]['type']] for n in nodes], dtype=np.uint8)
+    arrays['node_pos'] = np.array([G.nodes[n]['pos'] for n in nodes], dtype=np.float64).reshape(-1, 2)
+    arrays.update(string_arrays('node_name', [G.nodes[n].get('name', '') for n in nodes]))
+
+    edges = list(G.edges(data=True))
+    # The streets that join a stop with its crossroad are the access edges
+    kinds = [BUS if d['type'] == 'Bus' else
+             ACCESS if G.nodes[u]['type'] == 'Parada' or G.nodes[v]['type'] == 'Parada' else STREET
+             for u, v, d in edges]
+    arrays['edge_u'] = np.array([index[u] for u, _, _ in edges], dtype=np.int32)
+    arrays['edge_v'] = np.array([index[v] for _, v, _ in edges], dtype=np.int32)
+    arrays['edge_kind'] = np.array(kinds, dtype=np.uint8)
+    arrays['edge_time'] = np.array([d['time'] for _, _, d in edges], dtype=np.float64)
+    arrays['edge_length'] = np.array([d.get('lenght', d.get('length')) for _, _, d in edges], dtype=np.float64)
+    arrays['edge_speed'] = np.array([d['speed'] for _, _, d in edges], dtype=np.float64)
+    arrays.update(string_arrays('edge_name', [json.dumps(d.get('name')) for _, _, d in edges]))
+
+    compiled = compile_graph(G)
+    arrays['csr_indptr'] = compiled.indptr
+    arrays['csr_indices'] = compiled.indices
+    arrays['csr_times'] = compiled.times
+    arrays['csr_types'] = compiled.types
+    return arrays
+
+
+def city_from_snapshot(snap: Snapshot) -> nx.Graph:
+    """
+    Builds the CityGraph of a snapshot, with the same attributes it had. The networkx graph is built again
+    from the arrays, node by node and edge by edge, so it is in memory as a whole. Only its CompiledGraph,
+    which is what routing reads, keeps the arrays of the snapshot without copying them
+    """
+
+    a = snap.arrays
+    nodes = snap.node_ids()
+    types = list(NODE_TYPES)
+    G = nx.Graph(**snap.meta)
+
+    node_names = snap.strings('node_name')
+    for i, (n, t, pos) in enumerate(zip(nodes, a['node_type'].tolist(), a['node_pos'].tolist())):
+        if t == NODE_TYPES['Cruilla']:
+            G.add_node(n, pos=tuple(pos), type=types[t])
+        else:
+            G.add_node(n, pos=tuple(pos), type=types[t], name=node_names[i])
+
+    edge_names = snap.strings('edge_name')
+    columns = zip(a['edge_u'].tolist(), a['edge_v'].tolist(), a['edge_kind'].tolist(),
+                  a['edge_time'].tolist(), a['edge_length'].tolist(), a['edge_speed'].tolist(), edge_names)
+    for u, v, kind, time, length, speed, name in columns:
+        if kind == STREET:
+            G.add_edge(nodes[u], nodes[v], type='Carrer', name=json.loads(name),
+                       lenght=length, speed=speed, time=time)
+        elif kind == ACCESS:
+            G.add_edge(nodes[u], nodes[v], type='Carrer', length=length, speed=speed, time=time)
+        else:
+            G.add_edge(nodes[u], nodes[v], type='Bus', length=length, speed=speed, time=time)
+
+    G.graph[COMPILED_KEY] = compile_snapshot(snap, nodes)
+    return G
+
+
+def compile_snapshot(snap: Snapshot, nodes: list[Any] | None = None) -> CompiledGraph:
+    """
+    Returns the CompiledGraph of a city snapshot without building the networkx graph. Its arrays are the
+    ones of the snapshot: with mmap they are read-only views of the file, and only the node ids are copied
+    """
+
+    a = snap.arrays
+    nodes = nodes if nodes is not None else snap.node_ids()
+    index = {node: i for i, node in enumerate(nodes)}
+    return CompiledGraph(nodes, index, a['csr_indptr'], a['csr_indices'], a['csr_times'], a['csr_types'],
+                         a['node_pos'])
+
+
+def graph_meta(g: nx.Graph) -> dict[str, Any]:
+    """
+    Returns the attributes of the graph that can be saved in the header, like its digest
+    """
+
+    return {k: v for k, v in g.graph.items() if isinstance(v, (str, int, float, bool))}
+
+
+def save_city_graph(G: nx.Graph, filename: str) -> None:
+    """
+    Saves the CityGraph in a snapshot file
+    """
+
+    save_snapshot(filename, 'city', city_to_snapshot(G), graph_meta(G))
+
+
+def load_city_graph(filename: str, mmap: bool = True) -> nx.Graph:
+    """
+    Loads the CityGraph saved with save_city_graph
+    """
+
+    return city_from_snapshot(load_snapshot(filename, mmap))
+
+
+def buses_to_snapshot(g: nx.Graph) -> dict[str, np.ndarray]:
+    """
+    Converts the BusesGraph to arrays
+    """
+
+    stops = list(g.nodes)
+    index = {n: i for i, n in enumerate(stops)}
+    arrays = node_arrays(stops)
+    arrays['node_pos'] = np.array([g.nodes[n]['pos'] for n in stops], dtype=np.float64).reshape(-1, 2)
+    arrays.update(string_arrays('node_name', [g.nodes[n]['Nom'] for n in stops]))
+
+    edges = list(g.edges(data=True))
+    arrays['edge_u'] = np.array([index[u] for u, _, _ in edges], dtype=np.int32)
+    arrays['edge_v'] = np.array([index[v] for _, v, _ in edges], dtype=np.int32)
+    arrays.update(string_arrays('edge_name', [d['nom_linia'] for _, _, d in edges]))
+    return arrays
+
+
+def buses_from_snapshot(snap: Snapshot) -> nx.Graph:
+    """
+    Builds the BusesGraph of a snapshot
+    """
+
+    a = snap.arrays
+    stops = snap.node_ids()
+    g = nx.Graph(**snap.meta)
+
+    for n, pos, name in zip(stops, a['node_pos'].tolist(), snap.strings('node_name')):
+        g.add_node(n, pos=tuple(pos), Nom=name)
+    for u, v, name in zip(a['edge_u'].tolist(), a['edge_v'].tolist(), snap.strings('edge_name')):
+        g.add_edge(stops[u], stops[v], nom_linia=name)
+
+    return g
+
+
+def save_buses_graph(g: nx.Graph, filename: str) -> None:
+    """
+    Saves the BusesGraph in a snapshot file
+    """
+
+    save_snapshot(filename, 'buses', buses_to_snapshot(g), graph_meta(g))
+
+
+def load_buses_graph(filename: str, mmap: bool = True) -> nx.Graph:
+    """
+    Loads the BusesGraph saved with save_buses_graph
+    """
+
+    return buses_from_snapshot(load_snapshot(filename, mmap))
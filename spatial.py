@@ -0,0 +1,56 @@
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+EARTH_RADIUS = 6371009  # m, the same mean radius osmnx uses
+
+
+def project(lats: Iterable[float], lons: Iterable[float], lat0: float) -> np.ndarray:
+    """
+    Returns the (x, y) position in metres of each pair of latitude and longitude, projected around lat0 (in radians)
+    """
+
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack((lons * np.cos(lat0) * EARTH_RADIUS, lats * EARTH_RADIUS))
+
+
+@dataclass
+class SpatialIndex:
+    """
+    Class that stores a KD-tree over the positions of a set of nodes to find the nearest one to any point.
+    The coordinates are projected to metres around the mean latitude, which is exact enough at the scale of a city
+    """
+
+    ids: list[Any]  # the node id of each point of the tree
+    lat0: float  # the latitude of the projection, in radians
+    tree: cKDTree = field(repr=False)
+
+    def nearest_many(self, lats: Iterable[float], lons: Iterable[float]) -> list[Any]:
+        """
+        Returns the nearest node to each point, with all the points queried at once
+        """
+
+        _, found = self.tree.query(project(lats, lons, self.lat0))
+        return [self.ids[i] for i in found]
+
+    def nearest_nodes(self, X: float | Iterable[float], Y: float | Iterable[float]) -> Any:
+        """
+        Works as ox.distance.nearest_nodes: X are the longitudes and Y the latitudes.
+        Returns a node if they are numbers and a list of nodes if they are lists
+        """
+
+        if np.isscalar(X):
+            return self.nearest_many([Y], [X])[0]
+        return self.nearest_many(Y, X)
+
+
+def build_index(ids: list[Any], lats: list[float], lons: list[float]) -> SpatialIndex:
+    """
+    Builds the SpatialIndex of the points with the given ids and coordinates
+    """
+
+    lat0 = float(np.radians(np.mean(lats)))
+    return SpatialIndex(list(ids), lat0, cKDTree(project(lats, lons, lat0)))
@@ -0,0 +1,50 @@
+import os
+import sys
+import pytest
+
+# the modules of the project are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import billboard  # noqa: E402
+import render  # noqa: E402
+import buses  # noqa: E402
+import city  # noqa: E402
+from fixtures import FixtureServer, write_billboard, write_amb_payload, street_grid  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs the test in an empty directory, where the caches are written, without downloading any tile.
+    The geocoder and the cache of coordinates are restored after the test
+    """
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(billboard, 'resolver', billboard.resolver)
+    monkeypatch.setattr(billboard, 'geocode_cache', None)
+    monkeypatch.setattr(render, 'offline', True)
+    return tmp_path
+
+
+@pytest.fixture
+def site(workdir):
+    """
+    Serves a billboard of 3 pages and 6 cinemas from a local server that stands in for Sensacine
+    """
+
+    gazetteer = write_billboard(str(workdir), cinemas=6, films=10, pages=3, size=10)
+    billboard.set_resolver(billboard.gazetteer_resolver(gazetteer))
+    with FixtureServer(str(workdir)) as server:
+        yield server
+
+
+@pytest.fixture
+def graphs(workdir):
+    """
+    Builds the graphs of a city of 12 x 12 crossroads with 6 bus lines: the streets, the buses and the CityGraph
+    """
+
+    write_amb_payload(str(workdir / 'amb.json'), lines=6, stops=8, size=12)
+    g1 = street_grid(12)
+    g2 = buses.build_buses_graph(str(workdir / 'amb.json'))
+    return g1, g2, city.build_city_graph(g1, g2)
@@ -0,0 +1,16 @@
+import pytest
+from atomic import atomic_write
+
+
+def test_atomic_write_keeps_the_old_file_when_it_fails(workdir):
+    filename = workdir / 'cache.json'
+    with atomic_write(str(filename), 'w') as file:
+        file.write('old')
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(filename), 'w') as file:
+            file.write('half written')
+            raise RuntimeError('killed')
+
+    assert filename.read_text() == 'old'
+    assert [f.name for f in workdir.iterdir()] == ['cache.json']
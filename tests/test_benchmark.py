@@ -0,0 +1,13 @@
+import benchmark
+import billboard
+
+
+def test_run_restores_the_geocoder(workdir):
+    resolver, cache = billboard.resolver, {'Carrer de Prova, 1, 08001 Barcelona': [41.38, 2.17]}
+    billboard.geocode_cache = cache
+
+    results = benchmark.run(sizes=[6], stages=['read', 'find_path'], repeat=1)
+
+    assert [(r.stage, r.size) for r in results] == [('read', 6), ('find_path', 6)]
+    assert billboard.resolver is resolver
+    assert billboard.geocode_cache is cache and list(cache) == ['Carrer de Prova, 1, 08001 Barcelona']
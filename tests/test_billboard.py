@@ -0,0 +1,151 @@
+import http.client
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import urlparse
+import billboard
+
+
+DATA = Path(__file__).parent / 'data'
+
+
+def get(server, path: str) -> int:
+    url = urlparse(server.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def test_read_from_fixture_server(site):
+    bill = billboard.read(base_url=site.url, pages=3)
+
+    assert len(bill.cinemas) == 6
+    assert len(bill.films) == 10
+    # each cinema shows 8 films, 4 sessions each
+    assert len(bill.projections) == 6 * 8 * 4
+    assert all(p.cinema in bill.cinemas for p in bill.projections)
+
+
+def test_concurrent_read_is_the_same_as_sequential(site):
+    concurrent = billboard.read(base_url=site.url, pages=3)
+    sequential = billboard.read(base_url=site.url, pages=3, concurrent=False)
+
+    assert concurrent.films == sequential.films
+    assert concurrent.cinemas == sequential.cinemas
+    assert list(concurrent.projections) == list(sequential.projections)
+
+
+def test_refresh_without_changes(site):
+    bill = billboard.read(base_url=site.url, pages=3)
+    changes = bill.refresh()
+
+    assert not changes
+    assert changes.pages == []
+
+
+def test_fixture_server_stays_in_its_directory(site, workdir):
+    (workdir.parent / 'secret.txt').write_text('secret')
+
+    assert get(site, '/page_1.html') == 200
+    assert get(site, '/../secret.txt') == 404
+    assert get(site, '/%2e%2e/secret.txt') == 404
+    assert get(site, '/missing.html') == 404
+
+
+def test_refresh_replaces_edited_films(site, workdir):
+    bill = billboard.read(base_url=site.url, pages=3)
+    for page in workdir.glob('page_*.html'):
+        page.write_text(page.read_text(encoding='utf-8').replace('&quot;Director 1&quot;', '&quot;Director X&quot;'),
+                        encoding='utf-8')
+
+    changes = bill.refresh()
+
+    assert [film.id for film in changes.added_films] == ['1']
+    assert [film.id for film in changes.removed_films] == ['1']
+    assert changes.added_films[0].director == ['Director X']
+    assert changes.added_projections and len(changes.added_projections) == len(changes.removed_projections)
+    # the projections of the edited film are the ones of the new film, and the others are kept
+    assert all(p.film == changes.added_films[0] for p in bill.projections if p.film.id == '1')
+    assert all(p.film in bill.films for p in bill.projections)
+    assert not changes.added_cinemas and not changes.removed_cinemas
+
+
+def test_sessions_are_sorted_by_start(site):
+    bill = billboard.read(base_url=site.url, pages=3)
+    table = bill.table()
+
+    sessions = bill.sessions()
+    assert len(sessions) == len(bill.projections)
+    assert [billboard.minutes(p.time) for p in sessions] == sorted(table.start)
+
+    cinema = bill.cinemas[0].name
+    in_cinema = bill.sessions(cinema=cinema, first=12 * 60, last=18 * 60)
+    assert in_cinema == sorted((p for p in bill.projections
+                                if p.cinema.name == cinema and 12 * 60 <= billboard.minutes(p.time) <= 18 * 60),
+                               key=lambda p: billboard.minutes(p.time))
+
+
+def parse_both(link: str, content: bytes) -> tuple[billboard.Page, billboard.Page]:
+    response = SimpleNamespace(content=content, headers={})
+    return billboard.parse_page(link, response, 'soup'), billboard.parse_page(link, response, 'stream')
+
+
+def test_parsers_agree_on_saved_pages(workdir):
+    billboard.set_resolver(lambda address: (41.38 + len(address) * 1e-4, 2.17))
+    for filename in sorted(DATA.glob('sensacine_*.html')):
+        soup, stream = parse_both(filename.name, filename.read_bytes())
+
+        assert soup.films and soup.cinemas and len(soup.projections) > 0
+        assert stream.films == soup.films
+        assert stream.cinemas == soup.cinemas
+        assert list(stream.projections) == list(soup.projections)
+
+
+def test_saved_page_contents(workdir):
+    billboard.set_resolver(lambda address: (41.38, 2.17))
+    page = billboard.parse_page('sensacine', SimpleNamespace(content=(DATA / 'sensacine_barcelona.html').read_bytes(),
+                                                            headers={}))
+
+    # the cinema of L'Hospitalet is not in Barcelona, and the item without data is skipped
+    assert [c.name for c in page.cinemas] == ['Cinesa Diagonal Mar', 'Verdi & Verdi Park',
+                                              'Cines Renoir Floridablanca']
+    assert [c.adress for c in page.cinemas] == ['Avenida Diagonal, 3, 08019 Barcelona',
+                                                'Calle Verdi, 32, 08012 Barcelona',
+                                                'Calle Floridablanca, 135, 08011 Barcelona']
+    assert [f.title for f in page.films] == ['Oppenheimer', 'Barbie', 'Anatomía de una caída', 'Perfect Days',
+                                             'Vidas pasadas', 'El chico y la garza']
+    times = [(p.cinema.name, p.time, p.language) for p in page.projections if p.film.title == 'Oppenheimer']
+    assert times == [('Cinesa Diagonal Mar', (16, 0), 'Original Version'),
+                     ('Cinesa Diagonal Mar', (19, 30), 'Original Version'),
+                     ('Cinesa Diagonal Mar', (22, 45), 'Original Version'),
+                     ('Verdi & Verdi Park', (20, 0), 'Original Version')]
+
+
+def test_parsers_agree_on_fixture_pages(site, workdir):
+    for filename in sorted(workdir.glob('page_*.html')):
+        soup, stream = parse_both(filename.name, filename.read_bytes())
+
+        assert stream.films == soup.films
+        assert stream.cinemas == soup.cinemas
+        assert list(stream.projections) == list(soup.projections)
+
+
+def test_geocode_cache_keeps_the_addresses_of_other_workers(workdir):
+    billboard.set_resolver(lambda address: (41.38, 2.17))
+    billboard.get_coordinates('Carrer de Mallorca, 1, 08001 Barcelona')
+
+    # another worker, with its own copy of the cache, saves a new address meanwhile
+    other = json.loads((workdir / billboard.GEOCODE_CACHE).read_text(encoding='utf-8'))
+    other['Carrer de Sants, 2, 08014 Barcelona'] = [41.37, 2.13]
+    (workdir / billboard.GEOCODE_CACHE).write_text(json.dumps(other), encoding='utf-8')
+
+    billboard.get_coordinates('Carrer de Girona, 3, 08010 Barcelona')
+
+    saved = json.loads((workdir / billboard.GEOCODE_CACHE).read_text(encoding='utf-8'))
+    assert sorted(saved) == ['Carrer de Girona, 3, 08010 Barcelona', 'Carrer de Mallorca, 1, 08001 Barcelona',
+                             'Carrer de Sants, 2, 08014 Barcelona']
@@ -0,0 +1,25 @@
+import json
+import buses
+import metrics
+from fixtures import FixtureServer, write_amb_payload
+
+
+def test_download_keeps_the_meta_of_each_payload(workdir, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    site = workdir / 'site'
+    site.mkdir()
+    write_amb_payload(str(site / 'amb.json'), lines=3, stops=5, size=10)
+    write_amb_payload(str(site / 'other.json'), lines=4, stops=5, size=10, seed=1)
+
+    with FixtureServer(str(site)) as server:
+        amb = buses.download_amb_data(server.url + 'amb.json', 'amb.json')
+        other = buses.download_amb_data(server.url + 'other.json', 'other.json')
+        assert amb != other
+        assert json.loads((workdir / 'amb.meta.json').read_text())['version'] == amb
+        assert json.loads((workdir / 'other.meta.json').read_text())['version'] == other
+
+        # the second download of each payload is answered with a 304
+        assert buses.download_amb_data(server.url + 'amb.json', 'amb.json') == amb
+        assert buses.download_amb_data(server.url + 'other.json', 'other.json') == other
+        assert metrics.snapshot()['counters']['buses.download_not_modified'] == 2
@@ -0,0 +1,83 @@
+import random
+import networkx as nx
+import osmnx as ox
+import pytest
+import buses
+import city
+import metrics
+from fixtures import street_grid, write_amb_payload
+
+
+def snapshot_hits() -> float:
+    return metrics.snapshot()['counters'].get('city.snapshot_hits', 0)
+
+
+def test_city_graph_is_keyed_on_its_inputs(graphs, workdir, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    g1, g2, _ = graphs
+
+    first = city.get_city_graph(g1, g2)
+    second = city.get_city_graph(street_grid(12), g2)
+    assert snapshot_hits() == 1
+    assert second.graph['digest'] == first.graph['digest']
+    assert second.number_of_nodes() == first.number_of_nodes()
+
+    # a saved street graph of another city in the directory is not taken for g1
+    city.save_osmnx_graph(g1, city.GRAPH_NAME)
+    bigger = street_grid(20)
+    assert city.get_city_graph(bigger, g2).number_of_nodes() == bigger.number_of_nodes() + g2.number_of_nodes()
+    assert snapshot_hits() == 1
+
+    # the length of one street
+    streets = street_grid(12)
+    u, v, k = next(iter(streets.edges(keys=True)))
+    streets.edges[u, v, k]['length'] += 1
+    assert city.get_city_graph(streets, g2).graph['digest'] != first.graph['digest']
+
+    # the buses
+    write_amb_payload(str(workdir / 'other.json'), lines=5, stops=8, size=12, seed=1)
+    other = buses.build_buses_graph(str(workdir / 'other.json'))
+    assert city.get_city_graph(g1, other).graph['digest'] != first.graph['digest']
+
+    # a constant
+    monkeypatch.setattr(city, 'WALK_SPEED', city.WALK_SPEED * 2)
+    assert city.get_city_graph(g1, g2).graph['digest'] != first.graph['digest']
+    assert snapshot_hits() == 1
+
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_bus_edges_are_the_shortest_paths_of_the_streets(graphs, processes):
+    g1, g2, serial = graphs
+    G = city.build_city_graph(g1, g2, processes)
+
+    # each stop is joined to its crossroad, its only neighbour that is not a stop
+    crossroad = {stop: next(n for n in G[stop] if not isinstance(n, str)) for stop in g2.nodes}
+    bus_edges = [(u, v, d) for u, v, d in G.edges(data=True) if d['type'] == 'Bus']
+    assert len(bus_edges) == g2.number_of_edges()
+    for u, v, d in bus_edges:
+        length = nx.shortest_path_length(g1, crossroad[u], crossroad[v], weight='time')
+        assert d['length'] == pytest.approx(length)
+        assert d['speed'] == city.BUS_SPEED and d['time'] == pytest.approx(length / city.BUS_SPEED)
+
+    assert sorted(G.edges(data=True), key=repr) == sorted(serial.edges(data=True), key=repr)
+
+
+def test_spatial_index_agrees_with_osmnx(workdir):
+    rng = random.Random(0)
+    grid = street_grid(12)
+    # another street graph with as many nodes, saved in the same directory, has its own index
+    shifted = street_grid(12)
+    for n in shifted.nodes:
+        shifted.nodes[n]['y'] += 0.01
+    city.get_spatial_index(shifted)
+
+    for g1 in (grid, street_grid(12), shifted):
+        ys = [g1.nodes[n]['y'] + rng.uniform(-0.0006, 0.0006) for n in g1.nodes for _ in range(2)]
+        xs = [g1.nodes[n]['x'] + rng.uniform(-0.0006, 0.0006) for n in g1.nodes for _ in range(2)]
+        points = rng.sample(list(zip(xs, ys)), 200)
+        X, Y = [x for x, _ in points], [y for _, y in points]
+        assert list(city.nearest_nodes(g1, X, Y)) == list(ox.distance.nearest_nodes(g1, X, Y))
+        assert city.nearest_nodes(g1, X[0], Y[0]) == ox.distance.nearest_nodes(g1, X[0], Y[0])
+
+    assert len(list(workdir.glob(city.INDEX_PREFIX + '*.idx'))) == 2
@@ -0,0 +1,29 @@
+import random
+import networkx as nx
+import pytest
+import city
+import routing
+from hierarchy import HIERARCHY_KEY, load_hierarchy
+
+
+def test_hierarchy_agrees_with_dijkstra(graphs, workdir):
+    _, _, G = graphs
+    hierarchy = city.get_hierarchy(G)
+    saved = load_hierarchy(next(str(f) for f in workdir.glob(city.HIERARCHY_PREFIX + '*.npz')))
+
+    nodes = sorted(max(nx.connected_components(G), key=len), key=repr)
+    rng = random.Random(0)
+    pairs = [tuple(rng.sample(nodes, 2)) for _ in range(300)]
+
+    dijkstra, ch = routing.get_backend('csr'), routing.get_backend('ch')
+    c = routing.compile_graph(G)
+    for src, dst in pairs:
+        expected = dijkstra.time(G, src, dst)
+        assert ch.time(G, src, dst) == pytest.approx(expected)
+        assert saved.query(c.index[src], c.index[dst])[0] == pytest.approx(expected)
+
+        # the unpacked path is a path of the graph, and its edges add up to the same time
+        path = ch.path(G, src, dst)
+        assert path[0] == src and path[-1] == dst
+        assert sum(G.edges[u, v]['time'] for u, v in zip(path, path[1:])) == pytest.approx(expected)
+    assert hierarchy is G.graph[HIERARCHY_KEY]
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import requests
+from PIL import Image
+import metrics
+import render
+
+
+class BrokenSession:
+    """
+    Session whose requests always fail, as they do without a connection
+    """
+
+    def get(self, url, **kwargs):
+        raise requests.ConnectionError(url)
+
+
+def test_offline_canvas_pastes_the_cached_tiles(workdir, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    os.makedirs(os.path.dirname(render.tile_path(1, 0, 0)))
+    Image.new('RGB', (render.TILE_SIZE, render.TILE_SIZE), (200, 10, 10)).save(render.tile_path(1, 0, 0))
+
+    # the canvas covers the tiles (0, 0), which is in the cache, and (1, 0), which is not
+    canvas = render.Canvas(2 * render.TILE_SIZE, render.TILE_SIZE, 1, 1.0, 0.5)
+    canvas.draw_base()
+    assert np.all(canvas.pixels[:, :render.TILE_SIZE] == (200, 10, 10))
+    assert np.all(canvas.pixels[:, render.TILE_SIZE:] == render.BACKGROUND)
+
+    counters = metrics.snapshot()['counters']
+    assert counters['render.tile_cache_hits'] == 1
+    assert counters['render.tile_misses'] == 1
+
+
+def test_failed_download_is_a_miss(workdir, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+
+    assert render.get_tile(BrokenSession(), 1, 1, 0) is None
+    assert not os.path.exists(render.tile_path(1, 1, 0))
+    assert metrics.snapshot()['counters']['render.tile_misses'] == 1
@@ -0,0 +1,107 @@
+import random
+import networkx as nx
+import pytest
+import city
+import routing
+
+
+def path_time(G: nx.Graph, path: list) -> float:
+    """
+    Returns the time of a path of G, checking that each two consecutive nodes are joined by an edge
+    """
+
+    assert all(G.has_edge(u, v) for u, v in zip(path, path[1:]))
+    return sum(G.edges[u, v]['time'] for u, v in zip(path, path[1:]))
+
+
+def random_pairs(G: nx.Graph, count: int, seed: int = 0) -> list[tuple]:
+    nodes = sorted(max(nx.connected_components(G), key=len), key=repr)
+    rng = random.Random(seed)
+    return [tuple(rng.sample(nodes, 2)) for _ in range(count)]
+
+
+@pytest.mark.parametrize('backend', ['csr', 'astar'])
+def test_backend_agrees_with_networkx(graphs, backend):
+    _, _, G = graphs
+    reference, tested = routing.get_backend('networkx'), routing.get_backend(backend)
+
+    for src, dst in random_pairs(G, 200):
+        expected = reference.time(G, src, dst)
+        assert tested.time(G, src, dst) == pytest.approx(expected)
+
+        # the paths can differ where two of them take the same time
+        path = tested.path(G, src, dst)
+        assert path[0] == src and path[-1] == dst
+        assert path_time(G, path) == pytest.approx(expected)
+
+
+def test_astar_settles_fewer_nodes_than_dijkstra(graphs):
+    _, _, G = graphs
+    csr = routing.get_backend('csr')
+    dijkstra_settled = astar_settled = 0
+
+    for src, dst in random_pairs(G, 200, seed=2):
+        time, path, settled = routing.astar(G, src, dst)
+        assert time == pytest.approx(csr.time(G, src, dst))
+        assert path_time(G, path) == pytest.approx(time)
+
+        searched = routing.one_to_many(G, src, [dst]).settled
+        assert settled <= searched
+        dijkstra_settled += searched
+        astar_settled += settled
+
+    # the landmarks must narrow the search, not only keep it as wide as Dijkstra
+    assert astar_settled < dijkstra_settled / 2
+
+
+def test_one_to_many_agrees_with_networkx(graphs):
+    g1, _, G = graphs
+    rng = random.Random(1)
+    nodes = sorted(max(nx.connected_components(G), key=len), key=repr)
+
+    for src in rng.sample(nodes, 10):
+        targets = rng.sample(nodes, 15)
+        reach = routing.one_to_many(G, src, targets)
+        expected = nx.single_source_dijkstra_path_length(G, src, weight='time')
+        for i, target in enumerate(targets):
+            assert reach.times[i] == pytest.approx(expected[target])
+            path = reach.path(i)
+            assert path[0] == src and path[-1] == target
+            assert path_time(G, path) == pytest.approx(reach.times[i])
+
+    # from coordinates, that are snapped to their crossroads
+    crossroads = rng.sample(sorted(g1.nodes), 6)
+    src, *dsts = [(g1.nodes[n]['y'], g1.nodes[n]['x']) for n in crossroads]
+    reach = city.find_paths_to_many(g1, G, src, dsts)
+    assert reach.targets == crossroads[1:]
+    for i, target in enumerate(crossroads[1:]):
+        assert reach.times[i] == pytest.approx(nx.shortest_path_length(G, crossroads[0], target, weight='time'))
+        assert reach.path(i)[0] == crossroads[0] and reach.path(i)[-1] == target
+        assert path_time(G, reach.path(i)) == pytest.approx(reach.times[i])
+
+
+def test_cinema_tables_agree_with_networkx(graphs, workdir, monkeypatch):
+    g1, _, G = graphs
+    rng = random.Random(2)
+    cinemas = {f'Cine {i}': (g1.nodes[n]['y'], g1.nodes[n]['x'])
+               for i, n in enumerate(rng.sample(sorted(g1.nodes), 4))}
+    tables = city.get_cinema_tables(g1, G, cinemas)
+    assert tables.names == list(cinemas)
+
+    nodes = sorted(max(nx.connected_components(G), key=len), key=repr)
+    for src in rng.sample(nodes, 20):
+        reach = tables.reach_from(G, src)
+        for i, target in enumerate(tables.targets):
+            # the tables keep the times as float32
+            expected = nx.shortest_path_length(G, src, target, weight='time')
+            assert reach.times[i] == pytest.approx(expected, rel=1e-6, abs=1e-4)
+            path = reach.path(i)
+            assert path[0] == src and path[-1] == target
+            assert path_time(G, path) == pytest.approx(expected)
+
+    # the second time they are loaded from their file
+    assert len(list(workdir.glob(city.CINEMA_TABLES_PREFIX + '*.npz'))) == 1
+    monkeypatch.setattr(city, 'precompute_cinema_tables', None)
+    loaded = city.get_cinema_tables(g1, G, cinemas)
+    assert loaded.names == tables.names and loaded.targets == tables.targets
+    assert (loaded.times == tables.times).all() and (loaded.next_nodes == tables.next_nodes).all()
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import pytest
+from PIL import Image
+import metrics
+import service
+from fixtures import LAT0, LON0
+
+
+@pytest.fixture
+def server(workdir, monkeypatch):
+    """
+    Loads the state of the service from the fixtures of a city of 10 x 10 crossroads and gives a function
+    that sends raw requests to it. The state is not prepared, because gc.freeze would stay in the tests
+    """
+
+    monkeypatch.setattr(service, 'state', service.fixture_state(10, str(workdir)))
+    sock = socket.create_server(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+
+    def send(raw: bytes) -> tuple[int, bytes]:
+        with socket.create_connection(('127.0.0.1', port), timeout=30) as client:
+            client.sendall(raw)
+            data = b''
+            while chunk := client.recv(1 << 16):
+                data += chunk
+        head, _, body = data.partition(b'\r\n\r\n')
+        return int(head.split()[1]), body
+
+    def exchange(*requests: bytes) -> list[tuple[int, bytes]]:
+        async def run() -> list[tuple[int, bytes]]:
+            serving = asyncio.create_task(service.serve(sock))
+            try:
+                return [await asyncio.to_thread(send, raw) for raw in requests]
+            finally:
+                serving.cancel()
+        return asyncio.run(run())
+
+    try:
+        yield exchange
+    finally:
+        sock.close()
+
+
+def get(path: str) -> bytes:
+    return f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode()
+
+
+def test_endpoints(server):
+    origin = f'lat={LAT0 + 0.002}&lon={LON0 + 0.002}'
+    (health_status, health), (films_status, films), (route_status, route), (missing_status, _), \
+        (no_title_status, _), (bad_lat_status, _), (unknown_status, _) = server(
+            get('/health'), get('/films'), get(f'/route?title=Film%201&{origin}&at=09:00'), get('/missing'),
+            get(f'/route?{origin}'), get('/route?title=Film%201&lat=north&lon=2'),
+            get(f'/route?title=Unknown&{origin}'))
+
+    assert health_status == 200 and json.loads(health)['status'] == 'ok'
+    assert films_status == 200 and 'Film 1' in [film['title'] for film in json.loads(films)]
+    assert route_status == 200
+    route = json.loads(route)
+    assert route['projection']['film'] == 'Film 1' and route['projection']['time'] >= '09:00'
+    assert route['path'] and route['cinema']['name'] == route['projection']['cinema']
+    assert missing_status == 404
+    assert no_title_status == 400 and bad_lat_status == 400
+    assert unknown_status == 404
+
+
+def test_route_png_sizes(server):
+    route = f'/route.png?title=Film%201&lat={LAT0 + 0.002}&lon={LON0 + 0.002}&at=09:00'
+    answers = server(*(get(route + size) for size in ('&width=120&height=80', '&width=nan', '&width=-5',
+                                                      '&height=inf', '&width=10.5', '&height=5000')))
+
+    status, png = answers[0]
+    # the image is cropped to the route, so it is at most the size asked
+    width, height = Image.open(BytesIO(png)).size
+    assert status == 200 and 0 < width <= 120 and 0 < height <= 80
+    assert [status for status, _ in answers[1:]] == [400] * 5
+
+
+def test_invalid_content_length(server):
+    (invalid, body), (negative, _), (health, _) = server(
+        b'POST /health HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+        b'GET /health HTTP/1.1\r\nContent-Length: -5\r\n\r\n',
+        b'GET /health HTTP/1.1\r\nContent-Length: 4\r\nConnection: close\r\n\r\nbody')
+
+    assert invalid == 400 and 'Content-Length' in json.loads(body)['error']
+    assert negative == 400
+    assert health == 200
+
+
+def test_metrics_are_labelled_with_the_worker(server, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    (_, health), (status, body) = server(get('/health'), get('/metrics'))
+
+    samples = [line for line in body.decode().splitlines() if not line.startswith('#')]
+    label = '{pid="%d"}' % json.loads(health)['pid']
+    assert status == 200
+    assert any(line.startswith('citybus_service_requests_total' + label) for line in samples)
+    assert all(label in line for line in samples)
+
+
+def test_forked_workers(tmp_path):
+    """
+    Runs the service with 2 forked workers, checks that both answer, that a killed worker is replaced
+    and that the service stops cleanly with SIGTERM
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, 'service.py', '--fixtures', '8', '--workers', '2', '--port', '0',
+                                '--host', '127.0.0.1', '--fixtures-dir', str(tmp_path)],
+                               cwd=root, stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(process.stdout.readline().split()[2].rsplit(':', 1)[1])
+
+        def health(_: int) -> int:
+            with socket.create_connection(('127.0.0.1', port), timeout=30) as client:
+                client.sendall(get('/health'))
+                data = b''
+                while chunk := client.recv(1 << 16):
+                    data += chunk
+            return json.loads(data.partition(b'\r\n\r\n')[2])['pid']
+
+        def pids_until(done) -> set[int]:
+            seen: set[int] = set()
+            deadline = time.monotonic() + 60
+            with ThreadPoolExecutor(8) as executor:
+                while not done(seen) and time.monotonic() < deadline:
+                    seen.update(executor.map(health, range(32)))
+            return seen
+
+        workers = pids_until(lambda seen: len(seen) >= 2)
+        assert len(workers) == 2 and process.pid not in workers
+
+        killed = workers.pop()
+        os.kill(killed, signal.SIGKILL)
+        after = pids_until(lambda seen: len(seen - workers) >= 1)
+        assert killed not in after and after - workers
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
@@ -0,0 +1,33 @@
+import numpy as np
+import routing
+import snapshot
+
+
+def test_city_snapshot_routes_on_the_mapped_arrays(graphs, workdir):
+    _, _, G = graphs
+    filename = str(workdir / 'city.snap')
+    snapshot.save_city_graph(G, filename)
+
+    snap = snapshot.load_snapshot(filename)
+    loaded = snapshot.city_from_snapshot(snap)
+    compiled = loaded.graph[routing.COMPILED_KEY]
+
+    # the arrays of routing are the ones of the mapped file, not copies of them
+    for name in ('indptr', 'indices', 'times', 'types'):
+        assert np.shares_memory(getattr(compiled, name), snap.arrays['csr_' + name])
+    assert np.shares_memory(compiled.matrix.data, snap.arrays['csr_times'])
+
+    original = routing.compile_graph(G)
+    assert compiled.nodes == original.nodes
+    assert np.array_equal(compiled.indptr, original.indptr)
+    assert np.array_equal(compiled.times, original.times)
+
+    # the edges between a stop and its crossroad keep their attributes
+    assert sorted(G.edges(data=True), key=repr) == sorted(loaded.edges(data=True), key=repr)
+    for u, v, d in loaded.edges(data=True):
+        if d['type'] == 'Carrer' and (isinstance(u, str) or isinstance(v, str)):
+            assert 'length' in d and 'lenght' not in d
+
+    backend = routing.get_backend('csr')
+    for source, target in ((1, 144), (12, 133), (compiled.nodes[-1], 1)):
+        assert backend.time(loaded, source, target) == backend.time(G, source, target)
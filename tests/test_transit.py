@@ -0,0 +1,32 @@
+import random
+import pytest
+from scipy.sparse.csgraph import dijkstra
+import routing
+import transit
+
+
+@pytest.mark.parametrize('max_access_walk', [transit.MAX_ACCESS_WALK, 60])
+def test_transit_routes_are_paths_of_the_city(graphs, monkeypatch, max_access_walk):
+    _, g2, G = graphs
+    monkeypatch.setattr(transit, 'MAX_ACCESS_WALK', max_access_walk)
+    net = transit.build_transit(g2, G)
+    csr = routing.get_backend('csr')
+
+    rng = random.Random(0)
+    nodes = sorted(G.nodes, key=repr)
+    buses = 0
+    for _ in range(100):
+        src, dst = rng.sample(nodes, 2)
+        route = transit.transit_route(net, src, dst)
+        buses += route.buses
+
+        # the legs are joined, and their edges add up to the time of the route
+        path = route.path
+        assert path[0] == src and path[-1] == dst
+        assert sum(G.edges[u, v]['time'] for u, v in zip(path, path[1:])) == pytest.approx(route.time)
+
+        # it is never slower than walking all the way, nor faster than the shortest path of the city
+        walking = dijkstra(net.walk, indices=net.compiled.index[src])[net.compiled.index[dst]]
+        assert route.time <= walking + 1e-9
+        assert route.time >= csr.time(G, src, dst) - 1e-9
+    assert buses > 0
@@ -0,0 +1,282 @@
+from dataclasses import dataclass, field
+from typing import Any
+import networkx as nx
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+from routing import CompiledGraph, compile_graph, EDGE_TYPES
+
+
+TRANSIT_KEY = 'transit'  # key of the transit network in the dictionary g.graph
+MAX_TRANSFER_WALK = 600  # s, the longest walk between two stops considered as a transfer
+MAX_ACCESS_WALK = 1800  # s, the longest walk from the source to the first stop or from the last stop to the target
+FOOTPATH_CHUNK = 32  # the number of stops whose footpaths are searched at the same time
+
+
+@dataclass
+class Leg:
+    """
+    Class that stores each part of a route: a walk or a ride in one line
+    """
+
+    mode: str  # 'walk' or 'bus'
+    line: str | None  # the name of the line of a ride
+    nodes: list[Any]  # the nodes of the CityGraph of the leg, in order
+
+
+@dataclass
+class TransitRoute:
+    """
+    Class that stores the fastest route found by the transit engine
+    """
+
+    time: float  # s
+    legs: list[Leg] = field(default_factory=list)
+
+    @property
+    def buses(self) -> int:
+        """
+        The number of buses taken, one for each ride
+        """
+
+        return sum(1 for leg in self.legs if leg.mode == 'bus')
+
+    @property
+    def path(self) -> list[Any]:
+        """
+        The nodes of the CityGraph of the whole route, as find_path gives them
+        """
+
+        path: list[Any] = []
+        for leg in self.legs:
+            nodes = leg.nodes[1:] if path and leg.nodes and leg.nodes[0] == path[-1] else leg.nodes
+            path += nodes
+        return path
+
+
+@dataclass
+class TransitNetwork:
+    """
+    Class that stores the lines of buses as routes, sequences of stops with the time between each two,
+    and the walking transfers between stops taken from the streets of the CityGraph
+    """
+
+    compiled: CompiledGraph
+    walk: sp.csr_matrix  # the compiled graph with only the edges of type 'Carrer'
+    stops: list[Any]  # the node id of each stop
+    stop_nodes: np.ndarray  # the index of each stop in the compiled graph
+    routes: list[list[int]]  # the stops of each route in the order of the line
+    route_names: list[str]
+    hops: list[list[float]]  # the time from each stop of each route to the next one
+    routes_of: list[list[int]]  # the routes of each stop
+    footpaths: list[list[tuple[int, float]]]  # the stops reached walking from each stop and the time
+    # the walks of the footpaths of each stop, as a tree: its nodes sorted and the previous node of each one
+    transfers: list[tuple[np.ndarray, np.ndarray]]
+
+
+def build_transit(g2: nx.Graph, G: nx.Graph) -> TransitNetwork:
+    """
+    Builds the routes from the lines of the BusesGraph, with the stops of each line sorted by their
+    order (the node ids are IdLinia_Ordre), and the walking transfers from the streets of the CityGraph
+    """
+
+    c = compile_graph(G)
+    n = len(c.nodes)
+    walking = c.types == EDGE_TYPES['Carrer']
+    src = np.repeat(np.arange(n), np.diff(c.indptr))
+    walk = sp.csr_matrix((c.times[walking], (src[walking], c.indices[walking])), shape=(n, n))
+
+    lines: dict[str, list[Any]] = dict()
+    for stop in g2.nodes:
+        lines.setdefault(stop.split('_')[0], []).append(stop)
+
+    stops = list(g2.nodes)
+    stop_index = {stop: i for i, stop in enumerate(stops)}
+    routes: list[list[int]] = []
+    route_names: list[str] = []
+    hops: list[list[float]] = []
+
+    for line, line_stops in lines.items():
+        line_stops.sort(key=lambda stop: int(stop.split('_')[1]))
+        # a line is split where two consecutive stops are not joined by a bus edge
+        current = [line_stops[0]]
+        for a, b in zip(line_stops, line_stops[1:]):
+            if G.has_edge(a, b) and G.edges[a, b]['type'] == 'Bus':
+                current.append(b)
+                continue
+            if len(current) > 1:
+                routes.append([stop_index[s] for s in current])
+            current = [b]
+        if len(current) > 1:
+            routes.append([stop_index[s] for s in current])
+
+        for route in routes[len(route_names):]:
+            a, b = stops[route[0]], stops[route[1]]
+            route_names.append(g2.edges[a, b].get('nom_linia', line) if g2.has_edge(a, b) else line)
+            hops.append([G.edges[stops[p], stops[q]]['time'] for p, q in zip(route, route[1:])])
+
+    routes_of: list[list[int]] = [[] for _ in stops]
+    for r, route in enumerate(routes):
+        for p in route:
+            routes_of[p].append(r)
+
+    stop_nodes = np.array([c.index[stop] for stop in stops], dtype=np.int32)
+    footpaths: list[list[tuple[int, float]]] = [[] for _ in stops]
+    transfers: list[tuple[np.ndarray, np.ndarray]] = []
+    for first in range(0, len(stops), FOOTPATH_CHUNK):
+        chunk = stop_nodes[first:first + FOOTPATH_CHUNK]
+        dist, pred = dijkstra(walk, indices=chunk, limit=MAX_TRANSFER_WALK, return_predecessors=True)
+        dist, pred = np.atleast_2d(dist), np.atleast_2d(pred)
+        for row, p in enumerate(range(first, first + len(chunk))):
+            for q in np.flatnonzero(np.isfinite(dist[row, stop_nodes])).tolist():
+                if q != p:
+                    footpaths[p].append((q, float(dist[row, stop_nodes[q]])))
+            transfers.append(transfer_tree(pred[row], [int(stop_nodes[q]) for q, _ in footpaths[p]]))
+
+    return TransitNetwork(c, walk, stops, stop_nodes, routes, route_names, hops, routes_of, footpaths, transfers)
+
+
+def transfer_tree(pred: np.ndarray, targets: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keeps of the predecessors of a walking search only the nodes on the walks to targets, so the walk of
+    each transfer can be rebuilt without searching again
+    """
+
+    tree: dict[int, int] = dict()
+    for node in targets:
+        while node >= 0 and node not in tree:
+            tree[node] = int(pred[node])
+            node = tree[node]
+    nodes = np.array(sorted(tree), dtype=np.int32)
+    return nodes, np.array([tree[node] for node in nodes.tolist()], dtype=np.int32)
+
+
+def walk_path(net: TransitNetwork, pred: np.ndarray, target: int, reverse: bool = False) -> list[Any]:
+    """
+    Returns the nodes from the source of a walking search to target. If reverse, the search was done
+    from the end of the walk, so the nodes are given from target to it
+    """
+
+    path: list[Any] = []
+    while target >= 0:
+        path.append(net.compiled.nodes[target])
+        target = pred[target]
+    if not reverse:
+        path.reverse()
+    return path
+
+
+def transfer_path(net: TransitNetwork, p: int, q: int) -> list[Any]:
+    """
+    Returns the nodes of the walk of the transfer from stop p to stop q, from the tree of the footpaths of p
+    """
+
+    nodes, preds = net.transfers[p]
+    path: list[Any] = []
+    target = int(net.stop_nodes[q])
+    while target >= 0:
+        path.append(net.compiled.nodes[target])
+        target = int(preds[np.searchsorted(nodes, target)])
+    path.reverse()
+    return path
+
+
+def transit_route(net: TransitNetwork, src: Any, dst: Any, max_transfers: int = 2) -> TransitRoute:
+    """
+    Returns the fastest route from src to dst, nodes of the CityGraph, taking at most max_transfers + 1 buses.
+    It works by rounds like RAPTOR: round k scans once each route that has a stop improved in round k - 1,
+    so it finds the best arrival at each stop with k buses, and then relaxes the walking transfers.
+    The walks to the first stop and from the last one are at most MAX_ACCESS_WALK
+    """
+
+    c = net.compiled
+    s, t = c.index[src], c.index[dst]
+    from_src, pred_src = dijkstra(net.walk, indices=s, limit=MAX_ACCESS_WALK, return_predecessors=True)
+    # when dst is reached walking, no walk from a stop longer than that can be part of a faster route
+    walk_time = float(from_src[t])
+    to_dst, pred_dst = dijkstra(net.walk, indices=t, limit=min(walk_time, MAX_ACCESS_WALK), return_predecessors=True)
+
+    inf = float('inf')
+    n = len(net.stops)
+    access = from_src[net.stop_nodes].tolist()
+    egress = to_dst[net.stop_nodes].tolist()
+
+    # the route walking all the way is the first one to beat
+    best_time, best_round, best_stop = walk_time, 0, -1
+    best = list(access)  # the best arrival at each stop in any round
+    labels = [access]  # the arrival at each stop in each round
+    rides: list[list[tuple[int, int, int] | None]] = [[None] * n]  # (route, boarding, alighting) of each arrival
+    walks: list[list[int]] = [[-1] * n]  # the stop of the ride before the transfer of each arrival, or -1
+    marked = {p for p in range(n) if access[p] < inf}
+
+    for k in range(1, max_transfers + 2):
+        previous = labels[k - 1]
+        label, ride, walk = [inf] * n, [None] * n, [-1] * n
+        rode: set[int] = set()
+
+        for r in {r for p in marked for r in net.routes_of[p]}:
+            route, hops = net.routes[r], net.hops[r]
+            # the buses of the CityGraph can go both ways along a line
+            for order in (range(len(route)), range(len(route) - 1, -1, -1)):
+                carry, board, last = inf, -1, -1
+                for i in order:
+                    p = route[i]
+                    if board >= 0:
+                        # the hop between stop i and the one scanned before it
+                        carry += hops[min(i, last)]
+                        if carry < best[p] and carry < best_time:
+                            label[p], ride[p], best[p] = carry, (r, board, i), carry
+                            rode.add(p)
+                    if previous[p] < carry:
+                        carry, board = previous[p], i
+                    last = i
+
+        # the transfers start from the arrivals by bus, before any of them is improved walking
+        arrivals = {p: label[p] for p in rode}
+        marked = set(rode)
+        for p, arrival in arrivals.items():
+            for q, w in net.footpaths[p]:
+                if arrival + w < best[q] and arrival + w < best_time:
+                    label[q], walk[q], best[q] = arrival + w, p, arrival + w
+                    marked.add(q)
+
+        labels.append(label)
+        rides.append(ride)
+        walks.append(walk)
+
+        for p in marked:
+            if label[p] + egress[p] < best_time:
+                best_time, best_round, best_stop = label[p] + egress[p], k, p
+
+        if not marked:
+            break
+
+    if walk_time == inf and best_time > MAX_ACCESS_WALK:
+        # dst is further than MAX_ACCESS_WALK walking, so walking all the way is only searched up to the best route
+        from_src, pred_walk = dijkstra(net.walk, indices=s, limit=best_time, return_predecessors=True)
+        if from_src[t] <= best_time:
+            best_time, best_round, best_stop, pred_src = float(from_src[t]), 0, -1, pred_walk
+
+    if best_time == inf:
+        raise nx.NetworkXNoPath(f'Node {dst} not reachable from {src}')
+    if best_stop < 0:
+        return TransitRoute(best_time, [Leg('walk', None, walk_path(net, pred_src, t))])
+
+    # The route is rebuilt from the last stop to the first one
+    legs = [Leg('walk', None, walk_path(net, pred_dst, int(net.stop_nodes[best_stop]), reverse=True))]
+    p = best_stop
+    for k in range(best_round, 0, -1):
+        q = walks[k][p]
+        if q >= 0:
+            # p was reached walking from q, that was reached by bus in the same round
+            legs.append(Leg('walk', None, transfer_path(net, q, p)))
+            p = q
+        r, board, alight = rides[k][p]
+        step = 1 if board < alight else -1
+        legs.append(Leg('bus', net.route_names[r],
+                        [net.stops[net.routes[r][i]] for i in range(board, alight + step, step)]))
+        p = net.routes[r][board]
+    legs.append(Leg('walk', None, walk_path(net, pred_src, int(net.stop_nodes[p]))))
+    legs.reverse()
+
+    return TransitRoute(best_time, legs)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, TYPE_CHECKING
+import threading
+from lazy import lazy_import
+
+if TYPE_CHECKING:
+    from billboard import Billboard
+    from buses import BusesGraph
+    from city import OsmnxGraph, CityGraph
+
+billboard = lazy_import('billboard')
+buses = lazy_import('buses')
+city = lazy_import('city')
+
+
+def background(name: str, function: Callable[..., Any], *args: Any) -> Future:
+    """
+    Runs the function in a daemon thread and returns the future of its result. The thread does not keep
+    the program alive when the user exits, so the files it writes must be written with another name and renamed
+    """
+
+    future: Future = Future()
+
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(function(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
+
+
+@dataclass
+class Warmup:
+    """
+    Class that stores the futures of the billboard and the graphs, that are read or built in the background
+    as soon as the program starts. An option only waits for the ones it needs that are still missing
+    """
+
+    billboard: Future  # Billboard
+    streets: Future  # OsmnxGraph
+    buses: Future  # BusesGraph
+    city: Future  # CityGraph
+
+    def get_billboard(self) -> Billboard:
+        return self.billboard.result()
+
+    def get_streets(self) -> OsmnxGraph:
+        return self.streets.result()
+
+    def get_buses(self) -> BusesGraph:
+        return self.buses.result()
+
+    def get_city(self) -> CityGraph:
+        return self.city.result()
+
+    def pending(self) -> list[str]:
+        """
+        Returns the names of what is still being read or built
+        """
+
+        return [name for name, future in (('billboard', self.billboard), ('streets', self.streets),
+                                          ('buses', self.buses), ('city', self.city)) if not future.done()]
+
+
+def start() -> Warmup:
+    """
+    Starts reading the billboard, the street graph and the bus graph, each one in its own thread, and building
+    the city graph when both graphs are ready. Threads are used instead of processes so the graphs are
+    shared with the program without copying them
+    """
+
+    bill = background('billboard', lambda: billboard.read())
+    streets = background('streets', lambda: city.get_osmnx_graph())
+    bus_graph = background('buses', lambda: buses.get_buses_graph())
+    city_graph = background('city', lambda: city.get_city_graph(streets.result(), bus_graph.result()))
+    return Warmup(bill, streets, bus_graph, city_graph)
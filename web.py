@@ -0,0 +1,22 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUS = (429, 500, 502, 503, 504)  # the answers of a server that is busy or failing, worth retrying
+
+
+def make_session(retries: int = 3, pool_maxsize: int = 10, headers: dict[str, str] | None = None) -> requests.Session:
+    """
+    Returns a session that keeps the connections alive and retries the requests that fail, waiting more
+    after each try. The pool keeps up to pool_maxsize connections to each host, one for each thread that uses it
+    """
+
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=RETRY_STATUS)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session